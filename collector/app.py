@@ -1,199 +1,1845 @@
 import asyncio
-import json
+import csv
+import functools
+import gzip
+import io
 import os
+import queue
+import re
+import signal
 import ssl
 import sqlite3
+import subprocess
+import sys
 import time
+from collections import deque
 from aiohttp import web
 import threading
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
 import paho.mqtt.client as mqtt
-from datetime import datetime, timedelta
+from datetime import datetime
+
+import fastjson
+import telemetry_codec
+
+from ipc_bus import BusClient, BusServer
+from metrics import Registry
+from mqtt_asyncio import AsyncioMqtt
+from response_cache import ResponseCache
+from rolling_stats import RollingStats
+from sse import SseHub, encode_event, encode_raw_event
 
 
 MQTT_BROKER = os.getenv('MQTT_BROKER', 'mosquitto')
 MQTT_PORT = int(os.getenv('MQTT_PORT', 1883))
 TOPIC = os.getenv('MQTT_TOPIC', 'kelo/#')
+# asyncio : client MQTT piloté par la boucle aiohttp, messages traités par itération ;
+# thread : ancien fonctionnement (loop_forever dans un thread dédié).
+MQTT_MODE = os.getenv('MQTT_MODE', 'asyncio')
+MQTT_READ_BURST = int(os.getenv('MQTT_READ_BURST', 256))
+MQTT_KEEPALIVE = int(os.getenv('MQTT_KEEPALIVE', 60))
 DB_PATH = os.getenv('DB_PATH', 'data/results.db')
 SSL_ENABLED = os.getenv('SSL_ENABLED', 'false').lower() in ('1', 'true', 'yes', 'on')
 SSL_CERT_PATH = os.getenv('SSL_CERT_PATH', 'certs/server.crt')
 SSL_KEY_PATH = os.getenv('SSL_KEY_PATH', 'certs/server.key')
 SSL_PORT = int(os.getenv('SSL_PORT', 8443))
+HTTP_PORT = int(os.getenv('HTTP_PORT', 8081))
+# Mode multi-processus : au-delà d'un worker, le processus principal devient superviseur
+# (seul écrivain SQLite, bus local) et lance les workers (MQTT en abonnement partagé,
+# HTTP sur un port commun via SO_REUSEPORT).
+COLLECTOR_WORKERS = int(os.getenv('COLLECTOR_WORKERS', 1))
+COLLECTOR_BUS_PATH = os.getenv('COLLECTOR_BUS_PATH', os.path.join(os.path.dirname(DB_PATH) or '.', 'collector-bus.sock'))
+# Rôle du processus : positionné à « worker » par le superviseur pour ses workers.
+COLLECTOR_ROLE = os.getenv('COLLECTOR_ROLE', '')
+# Abonnement partagé ($share/<groupe>/<topic>) : chaque message n'est remis qu'à un membre du groupe.
+MQTT_SHARE_GROUP = os.getenv('MQTT_SHARE_GROUP', 'kelo-collector' if COLLECTOR_WORKERS > 1 else '')
+# Écriture différée : les mesures sont regroupées et validées par lots.
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', 500))
+DB_BATCH_INTERVAL = float(os.getenv('DB_BATCH_INTERVAL', 0.05))
+DB_QUEUE_MAX = int(os.getenv('DB_QUEUE_MAX', 10000))
+# File d'écriture pleine (base lente ou bloquée) : block attend au plus INGEST_BLOCK_SECONDS
+# (en mode asyncio, la lecture MQTT est suspendue au lieu de bloquer la boucle) puis
+# abandonne la mesure, drop_oldest abandonne la plus ancienne mesure en file, spill
+# écrit la mesure dans un fichier local rejoué dès que la file a de nouveau de la place.
+INGEST_OVERFLOW_POLICY = os.getenv('INGEST_OVERFLOW_POLICY', 'block')
+INGEST_BLOCK_SECONDS = float(os.getenv('INGEST_BLOCK_SECONDS', 5))
+INGEST_SPILL_PATH = os.getenv('INGEST_SPILL_PATH', os.path.join(os.path.dirname(DB_PATH) or '.', 'ingest-spill.ndjson'))
+DB_JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'WAL').upper()
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL').upper()
+# Conserve le JSON brut de chaque mesure en plus des colonnes typées.
+DB_KEEP_PAYLOAD = os.getenv('DB_KEEP_PAYLOAD', 'false').lower() in ('1', 'true', 'yes', 'on')
+DB_BACKFILL_CHUNK = int(os.getenv('DB_BACKFILL_CHUNK', 2000))
+# Largeur des tranches des statistiques glissantes 24h tenues en mémoire.
+STATS_BUCKET_SECONDS = float(os.getenv('STATS_BUCKET_SECONDS', 300))
+STATS_WINDOW_HOURS = 24
+
+# Partitionnement des mesures brutes : un fichier SQLite par période de DB_PARTITION_DAYS jours
+# (0 = tout dans la table results de DB_PATH). Les partitions sorties de DB_RETENTION_DAYS sont
+# supprimées (0 = conservation illimitée), les agrégats horaires sont gardés plus longtemps.
+DB_PARTITION_DAYS = int(os.getenv('DB_PARTITION_DAYS', 1))
+DB_PARTITION_DIR = os.getenv('DB_PARTITION_DIR') or os.path.join(os.path.dirname(DB_PATH) or '.', 'partitions')
+DB_RETENTION_DAYS = float(os.getenv('DB_RETENTION_DAYS', 0))
+DB_ROLLUP_1H_RETENTION_DAYS = float(os.getenv('DB_ROLLUP_1H_RETENTION_DAYS', 365))
+DB_RETENTION_CHECK_SECONDS = 3600
+PARTITION_MS = DB_PARTITION_DAYS * 86_400_000
+
+# Tables d'agrégats (count/somme/min/max par métrique, nid et tranche) : résolution -> largeur en ms.
+ROLLUPS = {'1m': 60_000, '1h': 3_600_000}
+HISTORY_RESOLUTIONS = ('raw', *ROLLUPS, 'auto')
+# Export en flux : nombre de lignes lues dans le curseur SQLite par écriture HTTP.
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 1000))
+EXPORT_FORMATS = ('ndjson', 'csv')
+# Lectures SQLite hors de la boucle asyncio : nombre de threads lecteurs et durée maximale
+# d'une requête (secondes) avant interruption.
+DB_READ_WORKERS = int(os.getenv('DB_READ_WORKERS', min(8, os.cpu_count() or 4)))
+DB_READ_TIMEOUT = float(os.getenv('DB_READ_TIMEOUT', 10))
+# Diffusion SSE : trames en attente par client et traitement des clients trop lents
+# (drop_oldest : on jette les plus anciennes, disconnect : on ferme le flux).
+SSE_CLIENT_QUEUE = int(os.getenv('SSE_CLIENT_QUEUE', 256))
+SSE_SLOW_CONSUMER_POLICY = os.getenv('SSE_SLOW_CONSUMER_POLICY', 'drop_oldest')
+SSE_KEEPALIVE_SECONDS = float(os.getenv('SSE_KEEPALIVE_SECONDS', 15))
+# Reprise après reconnexion (Last-Event-ID) : événements gardés en mémoire, et nombre
+# maximal de mesures relues en base quand l'écart dépasse cette mémoire.
+SSE_REPLAY_EVENTS = int(os.getenv('SSE_REPLAY_EVENTS', 1000))
+SSE_REPLAY_DB_LIMIT = int(os.getenv('SSE_REPLAY_DB_LIMIT', 5000))
+# Cache des réponses /collector/results et /collector/history (0 octet = désactivé), durée
+# de vie maximale, tolérance aux écritures (secondes) et taille minimale compressée en gzip.
+# Sous ingestion continue, chaque lot validé (une vingtaine par seconde) change ingest_seq :
+# sans tolérance, presque chaque sondage serait recalculé ; une réponse peut donc avoir
+# jusqu'à RESPONSE_CACHE_MAX_STALE secondes de retard (0 : toujours à jour).
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 60))
+RESPONSE_CACHE_MAX_STALE = float(os.getenv('RESPONSE_CACHE_MAX_STALE', 1))
+RESPONSE_GZIP_MIN_BYTES = int(os.getenv('RESPONSE_GZIP_MIN_BYTES', 1024))
+
+# Champs de télémétrie stockés dans des colonnes dédiées de la table results.
+METRIC_FIELDS = ('temperature', 'humidite', 'vibration', 'tension')
+RESULT_COLUMNS = ('ts', 'received_at', 'topic', 'nid', *METRIC_FIELDS, 'horodatage', 'extra', 'payload')
 
 latest = {}
+# Dernière mesure de chaque nid ({nid, topic, data, version}) ; `latest_version` augmente à
+# chaque message et sert d'ETag à /collector/latest. Les instantanés sont remplacés, jamais
+# modifiés en place. En mode multi-processus, les versions sont attribuées par le superviseur
+# (même ETag pour les mêmes données sur tous les workers, y compris un worker relancé).
+latest_by_nid: dict[str, dict] = {}
+latest_version = 0
+# (version, corps JSON encodé) du dernier instantané de tous les nids servi.
+_latest_all_body: tuple[int, bytes] = (-1, b'')
+
+sse_hub = SseHub(SSE_CLIENT_QUEUE, SSE_SLOW_CONSUMER_POLICY, SSE_REPLAY_EVENTS)
 
-clients = set()
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_STALE)
+# Numéro de séquence d'ingestion : incrémenté par le thread d'écriture après chaque écriture
+# validée (lot, migration, rétention) ; une réponse en cache calculée avant est périmée.
+ingest_seq = 0
 
 db_conn = None
-_db_lock = threading.Lock()
+
+# Partitions connues (début en ms epoch -> chemin). Le dictionnaire est remplacé, jamais modifié
+# en place : les lecteurs peuvent le parcourir sans verrou.
+_partitions: dict[int, str] = {}
+# (plus petit id, plus grand id) des mesures de chaque fichier (partition ou DB_PATH), tenus à
+# jour par le thread d'écriture : les lectures par id n'ouvrent que les fichiers concernés.
+# Une borne peut être trop large (lignes purgées), jamais trop étroite. Remplacé à chaque
+# mise à jour, jamais modifié en place.
+_id_bounds: dict[str, tuple[int, int]] = {}
+# Connexions de lecture en lecture seule, propres à chaque thread (chemin -> connexion) ;
+# en WAL, les lecteurs ne bloquent pas le thread d'écriture ni ne s'attendent entre eux.
+_read_local = threading.local()
+_read_executor = ThreadPoolExecutor(max_workers=DB_READ_WORKERS, thread_name_prefix='db-reader')
+
+
+# Métriques exportées sur /collector/metrics (format texte Prometheus).
+metrics = Registry()
+MQTT_MESSAGES = metrics.counter('kelo_mqtt_messages_total', "Messages MQTT reçus")
+MQTT_INVALID = metrics.counter('kelo_mqtt_invalid_messages_total', "Messages MQTT rejetés (JSON invalide ou non objet)")
+MQTT_BINARY = metrics.counter('kelo_mqtt_binary_messages_total', "Messages MQTT reçus au format binaire compact")
+MQTT_CONNECTS = metrics.counter('kelo_mqtt_connects_total', "Connexions (et reconnexions) au broker MQTT")
+INGEST_DROPPED = metrics.counter(
+    'kelo_ingest_dropped_total', "Mesures abandonnées, file d'écriture pleine", labelnames=('policy',))
+INGEST_SPILLED = metrics.counter('kelo_ingest_spilled_total', "Mesures écrites dans le fichier de débordement")
+INGEST_REPLAYED = metrics.counter('kelo_ingest_replayed_total', "Mesures du fichier de débordement enregistrées")
+INGEST_BLOCKED_SECONDS = metrics.histogram(
+    'kelo_ingest_blocked_seconds', "Attente d'une place dans la file d'écriture pleine (politique block)")
+INGEST_HANDLE_SECONDS = metrics.histogram(
+    'kelo_ingest_handle_seconds', "Décodage et mise en file d'un message ou d'un lot de messages MQTT")
+STORE_RESULT_SECONDS = metrics.histogram('kelo_store_result_seconds', "Attente de store_result jusqu'au commit")
+DB_COMMIT_SECONDS = metrics.histogram('kelo_db_commit_seconds', "Écriture d'un lot : insertion, agrégats et commit")
+DB_BATCH_ROWS = metrics.histogram(
+    'kelo_db_batch_rows', "Lignes par lot écrit", buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000))
+DB_INGEST_LATENCY = metrics.histogram(
+    'kelo_db_ingest_latency_seconds', "Délai entre réception et commit de la plus ancienne mesure d'un lot")
+DB_WRITE_ERRORS = metrics.counter('kelo_db_write_errors_total', "Lots ou tâches de maintenance dont l'écriture a échoué")
+DB_READ_WAIT_SECONDS = metrics.histogram('kelo_db_read_wait_seconds', "Attente d'un lecteur libre dans le pool")
+QUERY_SECONDS = metrics.histogram('kelo_query_seconds', "Durée des requêtes de lecture", labelnames=('query',))
+QUERY_TIMEOUTS = metrics.counter('kelo_query_timeouts_total', "Requêtes interrompues après DB_READ_TIMEOUT")
+BROADCAST_SECONDS = metrics.histogram('kelo_broadcast_seconds', "Encodage et mise en file d'un événement SSE")
+SSE_WRITE_SECONDS = metrics.histogram('kelo_sse_write_seconds', "Durée d'un write() vers un client SSE")
+metrics.callback('kelo_ingest_queue_depth', "Mesures en attente d'écriture", 'gauge', lambda: _ingest_queue.qsize())
+metrics.callback(
+    'kelo_ingest_spill_bytes', "Taille du fichier de débordement en attente de rejeu", 'gauge',
+    lambda: sum(os.path.getsize(p) for p in (INGEST_SPILL_PATH, INGEST_SPILL_PATH + '.replay') if os.path.exists(p)))
+metrics.callback('kelo_ingest_seq', "Numéro de séquence d'ingestion", 'counter', lambda: ingest_seq)
+metrics.callback('kelo_nests', "Nids ayant publié depuis le démarrage", 'gauge', lambda: len(latest_by_nid))
+metrics.callback('kelo_partitions', "Partitions journalières de la table results", 'gauge', lambda: len(_partitions))
+metrics.callback('kelo_sse_clients', "Clients SSE connectés", 'gauge', lambda: len(sse_hub.clients))
+metrics.callback(
+    'kelo_sse_hub_total', "Compteurs du diffuseur SSE", 'counter', lambda: dict(sse_hub.counters), ('counter',))
+metrics.callback(
+    'kelo_response_cache_total', "Compteurs du cache de réponses", 'counter',
+    lambda: dict(response_cache.counters), ('result',))
+metrics.callback('kelo_response_cache_bytes', "Taille du cache de réponses", 'gauge', lambda: response_cache.size)
+# Métriques de la file et du thread d'écriture : en mode multi-processus, elles sont tenues
+# par le superviseur et diffusées aux workers, qui les exposent telles quelles.
+_SUPERVISOR_METRICS = (
+    'kelo_ingest_dropped_total', 'kelo_ingest_spilled_total', 'kelo_ingest_replayed_total',
+    'kelo_ingest_blocked_seconds', 'kelo_db_commit_seconds', 'kelo_db_batch_rows',
+    'kelo_db_ingest_latency_seconds', 'kelo_db_write_errors_total', 'kelo_ingest_queue_depth',
+    'kelo_ingest_spill_bytes',
+)
+
+
+def _timed_query(fn):
+    """Mesure la durée de chaque appel dans kelo_query_seconds{query="<nom>"}."""
+    histogram = QUERY_SECONDS.labels(fn.__name__)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+
+class QueryTimeout(Exception):
+    """Requête de lecture interrompue après DB_READ_TIMEOUT secondes."""
+
+
+# Partitions attachées à la connexion du thread d'écriture (début -> nom de schéma).
+_writer_attached: dict[int, str] = {}
+_MAX_ATTACHED = 8
+# Connexions de lecture ouvertes vers des partitions, par thread du pool de lecteurs.
+_READER_PARTITIONS = 8
+_PARTITION_FILE = re.compile(r'^results-(\d{8})\.db$')
+
+# File d'attente d'ingestion vidée par le thread d'écriture (db_writer).
+_ingest_queue: queue.Queue = queue.Queue(maxsize=DB_QUEUE_MAX)
+_writer_thread = None
+_STOP = object()
+if INGEST_OVERFLOW_POLICY not in ('block', 'drop_oldest', 'spill'):
+    raise ValueError(f"INGEST_OVERFLOW_POLICY inconnue : {INGEST_OVERFLOW_POLICY}")
+
+# Débordement sur disque (politique spill) : les lignes sont ajoutées à INGEST_SPILL_PATH ;
+# le thread d'écriture renomme le fichier en .replay avant de le rejouer.
+_spill_lock = threading.Lock()
+_spill_file = None
+_spill_pending = False
+_spill_reader = None
+# Rejeu en échec : nouvel essai après un délai doublé à chaque échec (1 s, puis jusqu'à 60 s).
+_SPILL_RETRY_MAX_SECONDS = 60
+_spill_retry_delay = 0.0
+_spill_retry_at = 0.0
+# Fin de l'attente autorisée pendant l'épisode de saturation en cours (politique block) :
+# l'attente totale est bornée, quel que soit le nombre de mesures qui arrivent.
+_block_until = 0.0
+# Mesures venues de la boucle (MQTT asyncio, bus des workers) en attente d'une place dans la
+# file pleine (politique block) : la boucle n'attend pas, elles y entrent dans l'ordre
+# d'arrivée depuis _drain_parked() ; en attendant, la lecture des sources est suspendue.
+_parked: deque = deque()
+_parked_task = None
+_ingest_sources: list = []
+
+
+class IngestDropped(Exception):
+    """Mesure abandonnée faute de place dans la file d'écriture."""
+
+# Migration en ligne des anciennes bases (payload JSON seul, horodatage ISO seul) vers les
+# colonnes typées et `ts` : les lignes d'id <= _backfill_cursor ne sont pas encore converties.
+_backfill_cursor = 0
+_keep_payload = DB_KEEP_PAYLOAD
+
+# Statistiques 24h par nid, alimentées par le thread d'écriture après chaque commit.
+STATS_FIELDS = ('temperature', 'humidite')
+rolling_stats = RollingStats(STATS_FIELDS, STATS_WINDOW_HOURS * 3600, STATS_BUCKET_SECONDS)
+_rolling_stats_ready = False
+
+
+def _configure_connection(conn: sqlite3.Connection) -> None:
+    conn.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+
+
+_RESULTS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {schema}.results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts INTEGER,
+        received_at TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        nid TEXT,
+        temperature REAL,
+        humidite REAL,
+        vibration REAL,
+        tension REAL,
+        horodatage TEXT,
+        extra TEXT,
+        payload TEXT
+    )
+"""
+
+
+def _create_results_indexes(cursor, schema: str = 'main') -> None:
+    # ts = horodatage de réception en millisecondes epoch (UTC). L'index (nid, ts) couvre
+    # aussi les colonnes agrégées par get_statistics.
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {schema}.idx_results_nid_ts ON results (nid, ts, temperature, humidite)"
+    )
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_results_ts ON results (ts)")
+
+
+def _partition_path(start: int) -> str:
+    day = datetime.utcfromtimestamp(start / 1000)
+    return os.path.join(DB_PARTITION_DIR, f"results-{day:%Y%m%d}.db")
+
+
+def _scan_partitions() -> dict[int, str]:
+    if not os.path.isdir(DB_PARTITION_DIR):
+        return {}
+    found = {}
+    for name in os.listdir(DB_PARTITION_DIR):
+        match = _PARTITION_FILE.match(name)
+        if match:
+            day = datetime.strptime(match.group(1), '%Y%m%d')
+            start = int((day - datetime(1970, 1, 1)).total_seconds() * 1000)
+            found[start] = os.path.join(DB_PARTITION_DIR, name)
+    return dict(sorted(found.items()))
+
+
+def _overlapping_partitions(cutoff_ts: int | None = None) -> list[tuple[int, str]]:
+    """Partitions pouvant contenir des mesures postérieures à cutoff_ts, de la plus récente à la plus ancienne.
+
+    Une partition couvre [son début, début de la suivante[ ; la dernière est ouverte.
+    """
+    partitions = list(_partitions.items())
+    selected = []
+    for i, (start, path) in enumerate(partitions):
+        end = partitions[i + 1][0] if i + 1 < len(partitions) else None
+        if cutoff_ts is None or end is None or end > cutoff_ts:
+            selected.append((start, path))
+    selected.reverse()
+    return selected
+
+
+def _deadline_exceeded() -> int:
+    deadline = getattr(_read_local, 'deadline', None)
+    return 1 if deadline is not None and time.monotonic() > deadline else 0
+
+
+def _readonly_uri(path: str) -> str:
+    """URI SQLite de lecture seule : un fichier absent n'est pas créé."""
+    return 'file:' + urllib.request.pathname2url(os.path.abspath(path)) + '?mode=ro'
+
+
+def _reader(path: str) -> sqlite3.Connection:
+    """Connexion de lecture seule du thread courant sur `path`.
+
+    Au plus _READER_PARTITIONS partitions restent ouvertes par thread : la moins
+    récemment lue est refermée quand une autre est ouverte.
+    """
+    conns = getattr(_read_local, 'conns', None)
+    if conns is None:
+        conns = _read_local.conns = {}
+    conn = conns.pop(path, None)
+    if conn is None:
+        # Les connexions vers des partitions supprimées par la rétention sont refermées ici.
+        for old in [old for old in conns if old != DB_PATH and old not in _partitions.values()]:
+            conns.pop(old).close()
+        opened = [old for old in conns if old != DB_PATH]
+        if path != DB_PATH and len(opened) >= _READER_PARTITIONS:
+            for old in opened[:len(opened) - _READER_PARTITIONS + 1]:
+                conns.pop(old).close()
+        conn = sqlite3.connect(_readonly_uri(path), uri=True)
+        conn.row_factory = sqlite3.Row
+        conn.set_progress_handler(_deadline_exceeded, 10000)
+    # Ordre d'insertion = ordre d'utilisation : la première partition est la moins récente.
+    conns[path] = conn
+    return conn
+
+
+def _read_sources(cutoff_ts: int | None = None, oldest_first: bool = False):
+    """Connexions à interroger, de la plus récente à la plus ancienne (ou l'inverse).
+
+    La table results de DB_PATH vient en dernier : elle contient les mesures antérieures
+    au partitionnement (ou toutes les mesures si DB_PARTITION_DAYS = 0). Chaque connexion
+    n'est ouverte qu'au moment où l'appelant passe à sa source : une lecture qui s'arrête
+    à la partition du jour n'ouvre pas les autres.
+    """
+    for path in _source_paths(cutoff_ts, oldest_first):
+        yield _reader(path)
+
+
+def _source_paths(cutoff_ts: int | None = None, oldest_first: bool = False) -> list[str]:
+    paths = [path for _, path in _overlapping_partitions(cutoff_ts)] + [DB_PATH]
+    if oldest_first:
+        paths.reverse()
+    return paths
+
+
+def _run_read(deadline: float, fn, *args, **kwargs):
+    _read_local.deadline = deadline
+    DB_READ_WAIT_SECONDS.observe(time.monotonic() - (deadline - DB_READ_TIMEOUT))
+    try:
+        return fn(*args, **kwargs)
+    except sqlite3.OperationalError as err:
+        if time.monotonic() > deadline and 'interrupted' in str(err):
+            QUERY_TIMEOUTS.inc()
+            raise QueryTimeout(f"{fn.__name__} interrompue après {DB_READ_TIMEOUT} s") from err
+        raise
+    finally:
+        _read_local.deadline = None
+
+
+async def run_db_read(fn, *args, **kwargs):
+    """Exécute une fonction de lecture dans le pool de lecteurs, avec délai maximal."""
+    deadline = time.monotonic() + DB_READ_TIMEOUT
+    return await asyncio.get_running_loop().run_in_executor(
+        _read_executor, functools.partial(_run_read, deadline, fn, *args, **kwargs)
+    )
 
 
 def init_db() -> None:
-    global db_conn
+    global db_conn, _backfill_cursor, _keep_payload, _partitions
     if not os.path.exists(os.path.dirname(DB_PATH) or '.'):
         os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     db_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     db_conn.row_factory = sqlite3.Row
+    _configure_connection(db_conn)
     cursor = db_conn.cursor()
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS results (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            received_at TEXT NOT NULL,
-            topic TEXT NOT NULL,
-            nid TEXT,
-            payload TEXT NOT NULL
+    cursor.execute(_RESULTS_TABLE_SQL.format(schema='main'))
+    cursor.execute("CREATE TABLE IF NOT EXISTS collector_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    columns = {row["name"]: row for row in cursor.execute("PRAGMA table_info(results)")}
+    missing = [name for name in ('ts', *METRIC_FIELDS, 'horodatage', 'extra') if name not in columns]
+    if missing:
+        # Ancien schéma : on ajoute les colonnes, les lignes existantes sont converties
+        # progressivement par le thread d'écriture (voir _backfill_step).
+        for name in missing:
+            col_type = 'INTEGER' if name == 'ts' else 'REAL' if name in METRIC_FIELDS else 'TEXT'
+            cursor.execute(f"ALTER TABLE results ADD COLUMN {name} {col_type}")
+        max_id = cursor.execute("SELECT MAX(id) FROM results").fetchone()[0] or 0
+        cursor.execute(
+            "INSERT OR REPLACE INTO collector_meta (key, value) VALUES ('backfill_cursor', ?)",
+            (str(max_id),),
         )
-        """
+    _create_results_indexes(cursor)
+    rollup_columns = ', '.join(
+        f"{name}_count INTEGER NOT NULL, {name}_sum REAL NOT NULL, {name}_min REAL, {name}_max REAL"
+        for name in METRIC_FIELDS
     )
+    for resolution in ROLLUPS:
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS rollup_{resolution} (
+                nid TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                {rollup_columns},
+                PRIMARY KEY (nid, bucket)
+            ) WITHOUT ROWID
+            """
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_rollup_{resolution}_bucket ON rollup_{resolution} (bucket)"
+        )
     db_conn.commit()
 
+    row = cursor.execute("SELECT value FROM collector_meta WHERE key = 'backfill_cursor'").fetchone()
+    _backfill_cursor = int(row["value"]) if row else 0
+    # L'ancien schéma impose payload NOT NULL : le JSON brut reste alors obligatoire
+    # tant que les nouvelles mesures sont écrites dans cette table.
+    _keep_payload = DB_KEEP_PAYLOAD or (not PARTITION_MS and bool(columns["payload"]["notnull"]))
+    _partitions = _scan_partitions()
+    _max_result_id(db_conn)
+
+
+def _split_payload(data: dict) -> tuple:
+    """Répartit une mesure entre colonnes typées et JSON `extra` (champs non standards)."""
+    metrics = []
+    extra = {}
+    for name in METRIC_FIELDS:
+        value = data.get(name)
+        if value is None or isinstance(value, bool):
+            if value is not None:
+                extra[name] = value
+            metrics.append(None)
+            continue
+        try:
+            metrics.append(float(value))
+        except (TypeError, ValueError):
+            extra[name] = value
+            metrics.append(None)
+    horodatage = data.get('horodatage')
+    if horodatage is not None and not isinstance(horodatage, str):
+        extra['horodatage'] = horodatage
+        horodatage = None
+    for key, value in data.items():
+        if key not in METRIC_FIELDS and key not in ('nid', 'horodatage'):
+            extra[key] = value
+    if 'nid' in data and not isinstance(data['nid'], str):
+        extra['nid'] = data['nid']
+    extra_json = fastjson.dumps_str(extra) if extra else None
+    return (*metrics, horodatage, extra_json)
+
+
+def _row_payload(row: sqlite3.Row) -> dict:
+    """Reconstruit le payload d'une ligne à partir des colonnes typées."""
+    if row["id"] <= _backfill_cursor and row["payload"] is not None:
+        return fastjson.loads(row["payload"])
+    payload = {}
+    if row["nid"] is not None:
+        payload["nid"] = row["nid"]
+    for name in METRIC_FIELDS:
+        if row[name] is not None:
+            payload[name] = row[name]
+    if row["horodatage"] is not None:
+        payload["horodatage"] = row["horodatage"]
+    if row["extra"] is not None:
+        payload.update(fastjson.loads(row["extra"]))
+    return payload
+
+
+def _row_to_result(row: sqlite3.Row) -> dict:
+    return {
+        "id": row["id"],
+        "received_at": row["received_at"],
+        "topic": row["topic"],
+        "nid": row["nid"],
+        "payload": _row_payload(row),
+    }
+
+
+def _backfill_step(conn: sqlite3.Connection) -> None:
+    """Convertit un lot de lignes de l'ancien schéma vers les colonnes typées."""
+    global _backfill_cursor
+    upper = _backfill_cursor
+    lower = max(upper - DB_BACKFILL_CHUNK, 0)
+    conn.execute(
+        "UPDATE results SET ts = CAST(ROUND((julianday(rtrim(received_at, 'Z')) - 2440587.5)"
+        " * 86400000) AS INTEGER) WHERE id > ? AND id <= ? AND ts IS NULL",
+        (lower, upper),
+    )
+    rows = conn.execute(
+        "SELECT id, payload FROM results WHERE id > ? AND id <= ? AND payload IS NOT NULL",
+        (lower, upper),
+    ).fetchall()
+    updates = []
+    for row_id, payload in rows:
+        try:
+            data = fastjson.loads(payload)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(data, dict):
+            updates.append((*_split_payload(data), row_id))
+    conn.executemany(
+        "UPDATE results SET temperature = ?, humidite = ?, vibration = ?, tension = ?,"
+        " horodatage = ?, extra = ? WHERE id = ?",
+        updates,
+    )
+    conn.execute(
+        "UPDATE collector_meta SET value = ? WHERE key = 'backfill_cursor'", (str(lower),)
+    )
+    conn.commit()
+    _backfill_cursor = lower
+    if lower == 0:
+        print("Migration des colonnes typées terminée", flush=True)
+        rebuild_rollups(conn)
+        warm_rolling_stats(conn)
+
+
+def warm_rolling_stats(conn: sqlite3.Connection) -> None:
+    """Reconstruit les statistiques glissantes à partir de la base.
+
+    Appelée depuis le thread d'écriture : aucune ligne ne peut être validée pendant
+    la lecture, les agrégats chargés ne manquent ni ne doublent aucune mesure.
+    """
+    global rolling_stats, _rolling_stats_ready
+    stats = RollingStats(STATS_FIELDS, STATS_WINDOW_HOURS * 3600, STATS_BUCKET_SECONDS)
+    partials = ', '.join(
+        f"COUNT({name}), TOTAL({name}), MIN({name}), MAX({name})" for name in STATS_FIELDS
+    )
+    since = _cutoff_ts(STATS_WINDOW_HOURS) // stats.bucket_ms * stats.bucket_ms
+    for schema in _writer_schemas(conn, since):
+        rows = conn.execute(
+            f"SELECT nid, ts / ? AS bucket, COUNT(*), {partials} FROM {schema}.results"
+            " WHERE ts >= ? AND nid IS NOT NULL GROUP BY nid, bucket",
+            (stats.bucket_ms, since),
+        ).fetchall()
+        for nid, bucket_no, count, *values in rows:
+            # Une tranche peut être répartie sur deux partitions : on cumule.
+            stats.merge_bucket(nid, bucket_no, count, values)
+    rolling_stats = stats
+    _rolling_stats_ready = True
+
+
+def submit_result(data: dict, topic: str, nid: str | None, raw: str | None = None,
+                  wait: bool = True) -> Future:
+    """Place une mesure dans la file d'écriture.
+
+    Le Future est résolu avec l'id de la ligne une fois le lot validé (commit),
+    ce qui permet de ne diffuser la mesure qu'après son enregistrement. `raw` (texte JSON
+    reçu) est conservé tel quel si DB_KEEP_PAYLOAD est actif, sans ré-encodage.
+    `wait=False` depuis la boucle asyncio (voir _enqueue_row).
+    """
+    return _enqueue_row(_prepare_row(data, topic, nid, raw), wait)
+
+
+def _prepare_row(data: dict, topic: str, nid: str | None, raw: str | None = None) -> tuple:
+    """Ligne de la table results (sans id) pour une mesure reçue maintenant."""
+    payload = None
+    if _keep_payload:
+        payload = raw if raw is not None else fastjson.dumps_str(data)
+    now = time.time()
+    received_at = datetime.utcfromtimestamp(now).isoformat() + 'Z'
+    return (int(now * 1000), received_at, topic, nid, *_split_payload(data), payload)
+
+
+def _enqueue_row(row: tuple, wait: bool = True) -> Future:
+    """Met une ligne en file d'écriture en appliquant INGEST_OVERFLOW_POLICY si la file est pleine.
+
+    Le Future d'une mesure abandonnée porte IngestDropped ; celui d'une mesure débordée
+    sur disque est résolu aussitôt avec None (son id n'est connu qu'au rejeu). Avec
+    `wait=False` (appel depuis la boucle), la politique block n'attend pas : la mesure
+    est mise de côté et la lecture des sources suspendue jusqu'à ce qu'elle trouve place.
+    """
+    global _block_until
+    future: Future = Future()
+    item = (row, future)
+    # Des mesures déjà mises de côté passent d'abord : l'ordre d'arrivée est conservé.
+    if not _parked:
+        try:
+            _ingest_queue.put_nowait(item)
+            _block_until = 0.0
+            return future
+        except queue.Full:
+            pass
+    if INGEST_OVERFLOW_POLICY == 'block':
+        started = time.monotonic()
+        if not _block_until:
+            _block_until = started + INGEST_BLOCK_SECONDS
+        if not wait:
+            _park(item, started)
+            return future
+        try:
+            _ingest_queue.put(item, timeout=max(0.0, _block_until - started))
+            _block_until = 0.0
+        except queue.Full:
+            _drop_blocked(item)
+        INGEST_BLOCKED_SECONDS.observe(time.monotonic() - started)
+    elif INGEST_OVERFLOW_POLICY == 'drop_oldest':
+        while True:
+            try:
+                oldest = _ingest_queue.get_nowait()
+            except queue.Empty:
+                oldest = None
+            if oldest is _STOP:
+                # Arrêt en cours : on ne retire pas la demande d'arrêt.
+                _ingest_queue.put(oldest)
+                INGEST_DROPPED.labels('drop_oldest').inc()
+                future.set_exception(IngestDropped("arrêt du thread d'écriture"))
+                break
+            if oldest is not None:
+                INGEST_DROPPED.labels('drop_oldest').inc()
+                oldest[1].set_exception(IngestDropped("remplacée par une mesure plus récente"))
+            try:
+                _ingest_queue.put_nowait(item)
+                break
+            except queue.Full:
+                continue
+    else:
+        _spill_row(row)
+        future.set_result(None)
+    return future
+
+
+def _drop_blocked(item: tuple) -> None:
+    INGEST_DROPPED.labels('block').inc()
+    item[1].set_exception(IngestDropped(f"file d'écriture pleine depuis plus de {INGEST_BLOCK_SECONDS} s"))
+
+
+def _park(item: tuple, started: float) -> None:
+    """Met une mesure de côté (politique block, boucle) ; abandon si l'attente est épuisée."""
+    global _parked_task
+    if started >= _block_until:
+        _drop_blocked(item)
+        INGEST_BLOCKED_SECONDS.observe(0.0)
+        return
+    _parked.append((item, started))
+    if _parked_task is None:
+        # Plus de lecture MQTT ni du bus : le broker et les workers retiennent la suite.
+        for source in _ingest_sources:
+            source.pause_reading()
+        _parked_task = loop.create_task(_drain_parked())
+
+
+async def _drain_parked() -> None:
+    """Fait entrer les mesures mises de côté dans la file dès qu'elle a de la place.
+
+    L'attente reste bornée par INGEST_BLOCK_SECONDS comme pour un appel bloquant ; au-delà,
+    les mesures restantes sont abandonnées. La lecture des sources reprend ensuite.
+    """
+    global _parked_task, _block_until
+    try:
+        while _parked:
+            item, started = _parked[0]
+            try:
+                _ingest_queue.put_nowait(item)
+            except queue.Full:
+                now = time.monotonic()
+                if not _block_until:
+                    _block_until = now + INGEST_BLOCK_SECONDS
+                elif now >= _block_until:
+                    break
+                await asyncio.sleep(0.01)
+                continue
+            _parked.popleft()
+            _block_until = 0.0
+            INGEST_BLOCKED_SECONDS.observe(time.monotonic() - started)
+    finally:
+        # Délai épuisé, ou arrêt (tâche annulée) : les mesures restantes sont abandonnées.
+        while _parked:
+            item, started = _parked.popleft()
+            _drop_blocked(item)
+            INGEST_BLOCKED_SECONDS.observe(time.monotonic() - started)
+        _parked_task = None
+        for source in _ingest_sources:
+            source.resume_reading()
+
+
+def _spill_row(row: tuple) -> None:
+    global _spill_file, _spill_pending
+    with _spill_lock:
+        if _spill_file is None:
+            _spill_file = open(INGEST_SPILL_PATH, 'ab')
+        _spill_file.write(fastjson.dumps(row) + b'\n')
+        _spill_file.flush()
+        _spill_pending = True
+    INGEST_SPILLED.inc()
+
+
+def _replay_spill(conn: sqlite3.Connection, next_id: int) -> int:
+    """Enregistre un lot de lignes du fichier de débordement (thread d'écriture).
+
+    Les lignes gardent leur ts de réception mais reçoivent les id suivants : elles ne sont
+    pas rediffusées en SSE (elles l'ont été à leur arrivée, sans id). Les id ne suivent donc
+    pas ts : les lectures par id (query_results sans nid, query_results_after) fusionnent
+    les partitions au lieu de s'arrêter à la première.
+
+    La position atteinte dans le fichier .replay est validée avec chaque lot (clé
+    spill_offset de collector_meta) : après une erreur ou un redémarrage, le rejeu reprend
+    au premier lot non validé.
+    """
+    global _spill_file, _spill_pending, _spill_reader, _spill_retry_delay, _spill_retry_at
+    if time.monotonic() < _spill_retry_at:
+        return next_id
+    replay_path = INGEST_SPILL_PATH + '.replay'
+    if _spill_reader is None:
+        if not os.path.exists(replay_path):
+            with _spill_lock:
+                if _spill_file is not None:
+                    _spill_file.close()
+                    _spill_file = None
+                if not os.path.exists(INGEST_SPILL_PATH):
+                    _spill_pending = False
+                    return next_id
+                # Nouveau fichier à rejouer : la position du précédent ne vaut plus.
+                conn.execute("DELETE FROM collector_meta WHERE key = 'spill_offset'")
+                conn.commit()
+                os.replace(INGEST_SPILL_PATH, replay_path)
+        _spill_reader = open(replay_path, 'rb')
+        row = conn.execute("SELECT value FROM collector_meta WHERE key = 'spill_offset'").fetchone()
+        _spill_reader.seek(int(row[0]) if row else 0)
+    committed = _spill_reader.tell()
+    batch, starts, complete = [], set(), False
+    while len(batch) < DB_BATCH_SIZE:
+        offset = _spill_reader.tell()
+        line = _spill_reader.readline()
+        if not line:
+            complete = True
+            break
+        if not line.strip():
+            continue
+        row = tuple(fastjson.loads(line))
+        if PARTITION_MS:
+            start = row[_TS] - row[_TS] % PARTITION_MS
+            if start not in starts and len(starts) == _MAX_ATTACHED:
+                # Un lot validé en plusieurs fois ne pourrait pas être repris proprement.
+                _spill_reader.seek(offset)
+                break
+            starts.add(start)
+        batch.append((row, Future()))
+    if batch:
+        try:
+            next_id = _write_batch(conn, next_id, batch, {'spill_offset': _spill_reader.tell()})
+        except Exception as err:
+            conn.rollback()
+            DB_WRITE_ERRORS.inc()
+            _spill_retry_delay = min(_SPILL_RETRY_MAX_SECONDS, max(1.0, _spill_retry_delay * 2))
+            _spill_retry_at = time.monotonic() + _spill_retry_delay
+            print(f"Erreur de rejeu du fichier de débordement : {err}"
+                  f" (nouvel essai dans {_spill_retry_delay:.0f} s)", flush=True)
+            # Rien n'est validé : on reprendra ce lot.
+            _spill_reader.seek(committed)
+            return _max_result_id(conn) + 1
+        _spill_retry_delay = 0.0
+        _feed_rolling_stats(batch)
+        INGEST_REPLAYED.inc(len(batch))
+        _bump_ingest_seq()
+    if complete:
+        # Fichier entièrement rejoué (la clé spill_offset est effacée au prochain débordement).
+        _spill_reader.close()
+        _spill_reader = None
+        os.unlink(replay_path)
+    return next_id
+
 
 def store_result(data: dict, topic: str, nid: str | None) -> int:
-    payload = json.dumps(data, ensure_ascii=False)
-    received_at = datetime.utcnow().isoformat() + 'Z'
-    with _db_lock:
-        cursor = db_conn.cursor()
-        cursor.execute(
-            "INSERT INTO results (received_at, topic, nid, payload) VALUES (?, ?, ?, ?)",
-            (received_at, topic, nid, payload),
+    started = time.perf_counter()
+    try:
+        return submit_result(data, topic, nid).result()
+    finally:
+        STORE_RESULT_SECONDS.observe(time.perf_counter() - started)
+
+
+def _attach_partition(conn: sqlite3.Connection, start: int, keep: set = frozenset()) -> str:
+    """Attache (en la créant au besoin) la partition débutant à `start` à la connexion d'écriture.
+
+    Hors transaction uniquement. Au-delà de _MAX_ATTACHED, les partitions les plus
+    anciennes qui ne sont pas dans `keep` sont détachées.
+    """
+    global _partitions
+    schema = _writer_attached.get(start)
+    if schema is not None:
+        return schema
+    for old in sorted(_writer_attached):
+        if len(_writer_attached) < _MAX_ATTACHED:
+            break
+        if old not in keep:
+            conn.execute(f"DETACH DATABASE {_writer_attached.pop(old)}")
+
+    path = _partition_path(start)
+    os.makedirs(DB_PARTITION_DIR, exist_ok=True)
+    schema = f"p{start // 1000}"
+    conn.execute("ATTACH DATABASE ? AS " + schema, (path,))
+    conn.execute(f"PRAGMA {schema}.journal_mode={DB_JOURNAL_MODE}")
+    conn.execute(f"PRAGMA {schema}.synchronous={DB_SYNCHRONOUS}")
+    if start not in _partitions:
+        conn.execute(_RESULTS_TABLE_SQL.format(schema=schema))
+        _create_results_indexes(conn, schema)
+        conn.commit()
+        _partitions = dict(sorted({**_partitions, start: path}.items()))
+    _writer_attached[start] = schema
+    return schema
+
+
+def _detach_partitions(conn: sqlite3.Connection) -> None:
+    for schema in _writer_attached.values():
+        conn.execute(f"DETACH DATABASE {schema}")
+    _writer_attached.clear()
+
+
+def _writer_schemas(conn: sqlite3.Connection, cutoff_ts: int | None = None):
+    """Schémas (côté thread d'écriture) pouvant contenir des mesures postérieures à cutoff_ts.
+
+    Chaque schéma doit être entièrement lu avant de passer au suivant : l'attachement
+    d'une partition peut en détacher une autre.
+    """
+    yield 'main'
+    for start, _ in _overlapping_partitions(cutoff_ts):
+        yield _attach_partition(conn, start)
+
+
+def _write_batch(conn: sqlite3.Connection, next_id: int, batch: list, meta: dict | None = None) -> int:
+    """Insère le lot avec les id suivant `next_id` ; `meta` : clés de collector_meta validées avec lui."""
+    rows = [(next_id + i, *row) for i, (row, _) in enumerate(batch)]
+    insert_sql = (
+        "INSERT INTO {schema}.results" f" (id, {', '.join(RESULT_COLUMNS)})"
+        f" VALUES ({', '.join('?' * (len(RESULT_COLUMNS) + 1))})"
+    )
+    if PARTITION_MS:
+        by_start: dict[int, list] = {}
+        for row in rows:
+            by_start.setdefault(row[_TS + 1] - row[_TS + 1] % PARTITION_MS, []).append(row)
+        starts = sorted(by_start)
+        added = {_partition_path(start): (by_start[start][0][0], by_start[start][-1][0]) for start in starts}
+        # Les partitions sont attachées hors transaction. Un lot qui en couvre plus que
+        # _MAX_ATTACHED (rejeu d'historique) est validé en plusieurs fois.
+        for i in range(0, len(starts), _MAX_ATTACHED):
+            if i:
+                conn.commit()
+            group = starts[i:i + _MAX_ATTACHED]
+            schemas = {start: _attach_partition(conn, start, keep=set(group)) for start in group}
+            for start in group:
+                conn.executemany(insert_sql.format(schema=schemas[start]), by_start[start])
+    else:
+        conn.executemany(insert_sql.format(schema='main'), rows)
+        added = {DB_PATH: (rows[0][0], rows[-1][0])}
+    for key, value in (meta or {}).items():
+        conn.execute("INSERT OR REPLACE INTO collector_meta (key, value) VALUES (?, ?)", (key, str(value)))
+    _update_rollups(conn, batch)
+    # Un seul COMMIT, mais pas atomique entre fichiers : en mode WAL, SQLite ne garantit pas
+    # une transaction multi-fichiers en cas de coupure. Après un crash, une partition peut
+    # contenir le lot sans les agrégats de la base principale (ou l'inverse). Supprimer la
+    # clé rollups_built de collector_meta fait recalculer les agrégats au démarrage.
+    conn.commit()
+    _extend_id_bounds(added)
+    return next_id + len(rows)
+
+
+_METRIC_COLUMNS = tuple(RESULT_COLUMNS.index(name) for name in METRIC_FIELDS)
+_ROLLUP_FIELDS = ('count', *(
+    f"{name}_{part}" for name in METRIC_FIELDS for part in ('count', 'sum', 'min', 'max')
+))
+
+
+def _rollup_merge_sql() -> str:
+    updates = ["count = count + excluded.count"]
+    for name in METRIC_FIELDS:
+        updates += [
+            f"{name}_count = {name}_count + excluded.{name}_count",
+            f"{name}_sum = {name}_sum + excluded.{name}_sum",
+            f"{name}_min = CASE WHEN {name}_min IS NULL OR excluded.{name}_min < {name}_min"
+            f" THEN excluded.{name}_min ELSE {name}_min END",
+            f"{name}_max = CASE WHEN {name}_max IS NULL OR excluded.{name}_max > {name}_max"
+            f" THEN excluded.{name}_max ELSE {name}_max END",
+        ]
+    return ', '.join(updates)
+
+
+_ROLLUP_MERGE = _rollup_merge_sql()
+
+
+def _rollup_upsert_sql(resolution: str) -> str:
+    return (
+        f"INSERT INTO rollup_{resolution} (nid, bucket, {', '.join(_ROLLUP_FIELDS)})"
+        f" VALUES ({', '.join('?' * (len(_ROLLUP_FIELDS) + 2))})"
+        f" ON CONFLICT (nid, bucket) DO UPDATE SET {_ROLLUP_MERGE}"
+    )
+
+
+_ROLLUP_UPSERT_SQL = {resolution: _rollup_upsert_sql(resolution) for resolution in ROLLUPS}
+
+
+def _update_rollups(conn: sqlite3.Connection, batch: list) -> None:
+    """Agrège le lot par (nid, tranche) puis fusionne le résultat dans les tables d'agrégats."""
+    for resolution, width in ROLLUPS.items():
+        partials: dict[tuple, list] = {}
+        for row, _ in batch:
+            nid = row[_NID]
+            if nid is None:
+                continue
+            key = (nid, row[_TS] - row[_TS] % width)
+            acc = partials.get(key)
+            if acc is None:
+                acc = partials[key] = [0] + [0, 0.0, None, None] * len(METRIC_FIELDS)
+            acc[0] += 1
+            for i, column in enumerate(_METRIC_COLUMNS):
+                value = row[column]
+                if value is None:
+                    continue
+                base = 1 + i * 4
+                acc[base] += 1
+                acc[base + 1] += value
+                if acc[base + 2] is None or value < acc[base + 2]:
+                    acc[base + 2] = value
+                if acc[base + 3] is None or value > acc[base + 3]:
+                    acc[base + 3] = value
+        conn.executemany(
+            _ROLLUP_UPSERT_SQL[resolution],
+            [(nid, bucket, *acc) for (nid, bucket), acc in partials.items()],
         )
-        db_conn.commit()
-        return cursor.lastrowid
 
 
-def query_results(limit: int = 100, nid: str | None = None) -> list[dict]:
-    sql = "SELECT id, received_at, topic, nid, payload FROM results"
+def rebuild_rollups(conn: sqlite3.Connection) -> None:
+    """Recalcule entièrement les tables d'agrégats depuis les mesures brutes.
+
+    Appelée depuis le thread d'écriture (base existante sans agrégats, fin de migration) :
+    aucun lot n'est validé pendant le recalcul.
+    """
+    minute_columns = ', '.join(
+        f"COUNT({name}), TOTAL({name}), MIN({name}), MAX({name})" for name in METRIC_FIELDS
+    )
+    hour_columns = ', '.join(
+        f"SUM({name}_count), TOTAL({name}_sum), MIN({name}_min), MAX({name}_max)"
+        for name in METRIC_FIELDS
+    )
+    conn.execute("DELETE FROM rollup_1m")
+    conn.execute("DELETE FROM rollup_1h")
+    conn.commit()
+    for schema in _writer_schemas(conn):
+        # Une minute peut être répartie entre l'ancienne table et la première partition.
+        conn.execute(
+            f"INSERT INTO rollup_1m (nid, bucket, {', '.join(_ROLLUP_FIELDS)})"
+            f" SELECT nid, ts - ts % {ROLLUPS['1m']} AS bucket, COUNT(*), {minute_columns}"
+            f" FROM {schema}.results WHERE nid IS NOT NULL AND ts IS NOT NULL GROUP BY nid, bucket"
+            f" ON CONFLICT (nid, bucket) DO UPDATE SET {_ROLLUP_MERGE}"
+        )
+        conn.commit()
+    conn.execute(
+        f"INSERT INTO rollup_1h (nid, bucket, {', '.join(_ROLLUP_FIELDS)})"
+        f" SELECT nid, bucket - bucket % {ROLLUPS['1h']} AS hour, SUM(count), {hour_columns}"
+        " FROM rollup_1m GROUP BY nid, hour"
+    )
+    conn.execute("INSERT OR REPLACE INTO collector_meta (key, value) VALUES ('rollups_built', '1')")
+    conn.commit()
+
+
+_TS, _NID = RESULT_COLUMNS.index('ts'), RESULT_COLUMNS.index('nid')
+_STATS_COLUMNS = tuple(RESULT_COLUMNS.index(name) for name in STATS_FIELDS)
+
+
+def _feed_rolling_stats(batch: list) -> None:
+    stats = rolling_stats
+    for row, _ in batch:
+        if row[_NID] is not None:
+            stats.add(row[_NID], row[_TS], tuple(row[i] for i in _STATS_COLUMNS))
+
+
+def apply_retention(conn: sqlite3.Connection) -> None:
+    """Supprime les mesures sorties de la fenêtre de conservation (thread d'écriture).
+
+    Une partition expirée est simplement détachée puis son fichier supprimé. La table
+    results de DB_PATH (mesures non partitionnées) est purgée par petits lots.
+    """
+    global _partitions, _id_bounds
+    if not DB_RETENTION_DAYS:
+        return
+    now_ms = int(time.time() * 1000)
+    cutoff = now_ms - int(DB_RETENTION_DAYS * 86_400_000)
+
+    starts = list(_partitions)
+    expired = [start for start, end in zip(starts, starts[1:]) if end <= cutoff]
+    for start in expired:
+        schema = _writer_attached.pop(start, None)
+        if schema is not None:
+            conn.execute(f"DETACH DATABASE {schema}")
+        path = _partitions[start]
+        # Les lecteurs qui ont encore le fichier ouvert le referment à leur prochaine requête.
+        _partitions = {key: value for key, value in _partitions.items() if key != start}
+        _id_bounds = {key: value for key, value in _id_bounds.items() if key != path}
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+        print(f"Partition expirée supprimée : {path}", flush=True)
+
+    if not _backfill_cursor:
+        while True:
+            deleted = conn.execute(
+                "DELETE FROM main.results WHERE id IN"
+                " (SELECT id FROM main.results WHERE ts < ? LIMIT ?)",
+                (cutoff, DB_BACKFILL_CHUNK),
+            ).rowcount
+            conn.commit()
+            if deleted < DB_BACKFILL_CHUNK:
+                break
+
+    conn.execute("DELETE FROM rollup_1m WHERE bucket < ?", (cutoff,))
+    rollup_1h_days = max(DB_RETENTION_DAYS, DB_ROLLUP_1H_RETENTION_DAYS)
+    conn.execute("DELETE FROM rollup_1h WHERE bucket < ?", (now_ms - int(rollup_1h_days * 86_400_000),))
+    conn.commit()
+
+
+_ID_BOUNDS_SQL = "SELECT (SELECT MIN(id) FROM {schema}.results), (SELECT MAX(id) FROM {schema}.results)"
+
+
+def _max_result_id(conn: sqlite3.Connection) -> int:
+    """Plus grand id enregistré, toutes partitions confondues ; recalcule _id_bounds."""
+    global _id_bounds
+    bounds = {}
+    low, high = conn.execute(_ID_BOUNDS_SQL.format(schema='main')).fetchone()
+    if high is not None:
+        bounds[DB_PATH] = (low, high)
+    for path in _partitions.values():
+        partition = sqlite3.connect(path)
+        try:
+            low, high = partition.execute(_ID_BOUNDS_SQL.format(schema='main')).fetchone()
+        finally:
+            partition.close()
+        if high is not None:
+            bounds[path] = (low, high)
+    _id_bounds = bounds
+    return max((high for _, high in bounds.values()), default=0)
+
+
+def _extend_id_bounds(added: dict[str, tuple[int, int]]) -> None:
+    global _id_bounds
+    bounds = dict(_id_bounds)
+    for path, (low, high) in added.items():
+        old = bounds.get(path)
+        bounds[path] = (low, high) if old is None else (min(old[0], low), max(old[1], high))
+    _id_bounds = bounds
+
+
+def db_writer() -> None:
+    """Vide la file d'ingestion par lots : un seul commit par lot.
+
+    Un lot est écrit dès qu'il atteint DB_BATCH_SIZE lignes ou que
+    DB_BATCH_INTERVAL secondes se sont écoulées depuis sa première ligne.
+    """
+    global _spill_pending
+    conn = sqlite3.connect(DB_PATH)
+    _configure_connection(conn)
+    # Ce thread est le seul écrivain : les id sont attribués ici, sans relire lastrowid,
+    # et restent uniques sur l'ensemble des partitions.
+    next_id = _max_result_id(conn) + 1
+    if not _backfill_cursor:
+        if conn.execute("SELECT 1 FROM collector_meta WHERE key = 'rollups_built'").fetchone() is None:
+            rebuild_rollups(conn)
+        warm_rolling_stats(conn)
+    next_prune = time.monotonic() + STATS_BUCKET_SECONDS
+    next_retention = time.monotonic()
+    # Débordement laissé par une exécution précédente.
+    _spill_pending = os.path.exists(INGEST_SPILL_PATH) or os.path.exists(INGEST_SPILL_PATH + '.replay')
+
+    stopping = False
+    while not stopping:
+        try:
+            # Tant que la migration ou un rejeu ne sont pas terminés, les temps morts servent à les avancer.
+            idle_work = _backfill_cursor or _spill_pending
+            item = _ingest_queue.get(timeout=DB_BATCH_INTERVAL if idle_work else None)
+        except queue.Empty:
+            if _spill_pending:
+                next_id = _housekeeping(conn, _replay_spill, next_id) or _max_result_id(conn) + 1
+            if _backfill_cursor:
+                _housekeeping(conn, _backfill_step)
+                _bump_ingest_seq()
+            continue
+        if item is _STOP:
+            break
+        batch = [item]
+        deadline = time.monotonic() + DB_BATCH_INTERVAL
+        while len(batch) < DB_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            try:
+                item = _ingest_queue.get(timeout=timeout) if timeout > 0 else _ingest_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+
+        first_id = next_id
+        started = time.perf_counter()
+        try:
+            next_id = _write_batch(conn, next_id, batch)
+        except Exception as err:
+            conn.rollback()
+            DB_WRITE_ERRORS.inc()
+            print(f"Erreur d'enregistrement en base : {err}", flush=True)
+            # Une partie d'un lot multi-partitions a pu être validée.
+            next_id = _max_result_id(conn) + 1
+            _bump_ingest_seq()
+            for _, future in batch:
+                future.set_exception(err)
+            continue
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+        DB_BATCH_ROWS.observe(len(batch))
+        DB_INGEST_LATENCY.observe(time.time() - batch[0][0][0] / 1000)
+        _feed_rolling_stats(batch)
+        _bump_ingest_seq()
+        for i, (_, future) in enumerate(batch):
+            future.set_result(first_id + i)
+
+        # Maintenance, une fois les producteurs débloqués : une erreur est journalisée
+        # et comptée sans arrêter le thread d'écriture.
+        if time.monotonic() >= next_prune:
+            rolling_stats.prune()
+            next_prune = time.monotonic() + STATS_BUCKET_SECONDS
+        if time.monotonic() >= next_retention:
+            _housekeeping(conn, apply_retention)
+            next_retention = time.monotonic() + DB_RETENTION_CHECK_SECONDS
+        if _backfill_cursor:
+            _housekeeping(conn, _backfill_step)
+            _bump_ingest_seq()
+        if _spill_pending and _ingest_queue.qsize() < DB_QUEUE_MAX // 2:
+            next_id = _housekeeping(conn, _replay_spill, next_id) or _max_result_id(conn) + 1
+
+    _detach_partitions(conn)
+    conn.close()
+
+
+def _housekeeping(conn: sqlite3.Connection, task, *args):
+    """Exécute une tâche de maintenance du thread d'écriture ; None si elle échoue.
+
+    L'erreur (disque, suppression de fichier, ATTACH/DETACH...) est journalisée et comptée
+    dans kelo_db_write_errors_total : la tâche sera retentée plus tard.
+    """
+    try:
+        return task(conn, *args)
+    except Exception as err:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            pass
+        DB_WRITE_ERRORS.inc()
+        print(f"Erreur de maintenance de la base ({task.__name__}) : {err}", flush=True)
+        return None
+
+
+def _bump_ingest_seq() -> None:
+    global ingest_seq
+    ingest_seq += 1
+
+
+def start_db_writer() -> None:
+    global _writer_thread
+    _writer_thread = threading.Thread(target=db_writer, name='db-writer', daemon=True)
+    _writer_thread.start()
+
+
+def stop_db_writer() -> None:
+    """Écrit les mesures encore en file puis arrête le thread d'écriture."""
+    if _writer_thread is None:
+        return
+    _ingest_queue.put(_STOP)
+    _writer_thread.join()
+
+
+def _cutoff_ts(hours: float) -> int:
+    return int((time.time() - hours * 3600) * 1000)
+
+
+def _ts_filter() -> str:
+    # Tant que la migration n'est pas terminée, certaines lignes n'ont pas encore de ts.
+    if _backfill_cursor:
+        return "(ts >= ? OR (ts IS NULL AND received_at >= ?))"
+    return "ts >= ?"
+
+
+def _ts_params(cutoff_ts: int) -> tuple:
+    if _backfill_cursor:
+        return (cutoff_ts, datetime.utcfromtimestamp(cutoff_ts / 1000).isoformat() + 'Z')
+    return (cutoff_ts,)
+
+
+def _fetch_newest(sql: str, params: tuple, limit: int, cutoff_ts: int | None = None) -> list:
+    """Exécute `sql` (terminé par LIMIT ?) sur chaque partition, de la plus récente à la plus
+    ancienne, jusqu'à obtenir `limit` lignes."""
+    rows = []
+    for conn in _read_sources(cutoff_ts):
+        rows += conn.execute(sql, (*params, limit - len(rows))).fetchall()
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def _fetch_by_id(sql: str, params: tuple, limit: int, descending: bool, bound: int | None = None) -> list:
+    """Exécute `sql` (tri par id, terminé par LIMIT ?) sur chaque partition utile et fusionne.
+
+    Les partitions sont découpées selon ts, et les id ne suivent pas toujours ts (lignes
+    rejouées d'un débordement) : une partition n'est écartée que lorsque ses bornes d'id
+    (_id_bounds) ne peuvent plus entrer dans le résultat, ce qui est le cas général des plus
+    anciennes. `bound` : id exclu par `sql` (before_id en ordre décroissant, after_id sinon).
+    """
+    bounds = _id_bounds
+    rows = []
+    for path in _source_paths(oldest_first=not descending):
+        span = bounds.get(path)
+        if span is None:
+            continue
+        low, high = span
+        if bound is not None and (low >= bound if descending else high <= bound):
+            continue
+        if len(rows) >= limit and (high < rows[-1][0] if descending else low > rows[-1][0]):
+            continue
+        rows += _reader(path).execute(sql, (*params, limit)).fetchall()
+        rows.sort(key=lambda row: row[0], reverse=descending)
+        del rows[limit:]
+    return rows
+
+
+_NO_ROW = object()
+
+
+def _row_ts(row_id: int):
+    """ts de la ligne `row_id` (None si elle n'est pas encore migrée), _NO_ROW si elle n'existe plus."""
+    bounds = _id_bounds
+    for path in _source_paths():
+        span = bounds.get(path)
+        if span is None or not span[0] <= row_id <= span[1]:
+            continue
+        row = _reader(path).execute("SELECT ts FROM results WHERE id = ?", (row_id,)).fetchone()
+        if row is not None:
+            return row[0]
+    return _NO_ROW
+
+
+def _before_condition(before_id: int) -> tuple[str, tuple]:
+    """Condition de pagination pour un tri `ts DESC, id DESC` : lignes situées après `before_id`.
+
+    Les id ne suivent pas forcément ts (horodatage pris par chaque worker, rejeu d'un
+    débordement, horloge recalée) : la clé de page est le couple (ts, id) de la dernière
+    ligne renvoyée, retrouvé à partir de son id.
+    """
+    before_ts = _row_ts(before_id)
+    if before_ts is _NO_ROW:
+        # Ligne supprimée par la rétention entre deux pages : on se contente de l'id.
+        return "id < ?", (before_id,)
+    if before_ts is None:
+        # Les lignes non migrées (ts NULL) viennent en dernier dans l'ordre ts DESC.
+        return "(ts IS NULL AND id < ?)", (before_id,)
+    # Écrit « ts <= ? AND ... » pour que l'index sur ts borne le parcours.
+    condition = "(ts <= ? AND (ts < ? OR id < ?))"
+    if _backfill_cursor:
+        condition = f"({condition} OR ts IS NULL)"
+    return condition, (before_ts, before_ts, before_id)
+
+
+@_timed_query
+def query_results(limit: int = 100, nid: str | None = None, before_id: int | None = None) -> list[dict]:
+    """Dernières mesures ; `before_id` (pagination par clé) ne garde que les id inférieurs."""
+    sql = f"SELECT id, {', '.join(RESULT_COLUMNS)} FROM results"
+    conditions = []
     params: tuple = ()
     if nid:
-        sql += " WHERE nid = ?"
+        conditions.append("nid = ?")
         params = (nid,)
-    sql += " ORDER BY id DESC LIMIT ?"
-    params = (*params, limit)
+    if before_id is not None:
+        condition, condition_params = _before_condition(before_id) if nid else ("id < ?", (before_id,))
+        conditions.append(condition)
+        params = (*params, *condition_params)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    # Avec un nid, l'index (nid, ts) fournit directement l'ordre recherché ; l'id départage
+    # les mesures de même ts et sert, avec ts, de clé de page.
+    if nid:
+        rows = _fetch_newest(sql + " ORDER BY ts DESC, id DESC LIMIT ?", params, limit)
+    else:
+        rows = _fetch_by_id(sql + " ORDER BY id DESC LIMIT ?", params, limit, descending=True, bound=before_id)
+    return [_row_to_result(row) for row in rows]
 
-    with _db_lock:
-        cursor = db_conn.cursor()
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
 
-    return [
-        {
-            "id": row["id"],
-            "received_at": row["received_at"],
-            "topic": row["topic"],
-            "nid": row["nid"],
-            "payload": json.loads(row["payload"]),
-        }
-        for row in rows
-    ]
+@_timed_query
+def query_results_after(after_id: int, limit: int = 1000) -> list[dict]:
+    """Mesures d'id strictement supérieur à `after_id`, dans l'ordre croissant des id."""
+    sql = f"SELECT id, {', '.join(RESULT_COLUMNS)} FROM results WHERE id > ? ORDER BY id LIMIT ?"
+    rows = _fetch_by_id(sql, (after_id,), limit, descending=False, bound=after_id)
+    return [_row_to_result(row) for row in rows]
+
 
+@_timed_query
+def query_history_by_date(
+    nid: str | None = None,
+    hours: int = 24,
+    limit: int = 1000,
+    before_id: int | None = None,
+    after_ts: int | None = None,
+) -> list[dict]:
+    """Récupère l'historique des données pour une période donnée.
 
-def query_history_by_date(nid: str | None = None, hours: int = 24, limit: int = 1000) -> list[dict]:
-    """Récupère l'historique des données pour une période donnée."""
-    cutoff_time = (datetime.utcnow() - timedelta(hours=hours)).isoformat() + 'Z'
+    `before_id` poursuit une page précédente (mesures plus anciennes), `after_ts` ne renvoie
+    que les mesures reçues après cet horodatage (ms epoch), pour un rafraîchissement incrémental.
+    """
+    cutoff_ts = _cutoff_ts(hours)
+    if after_ts is not None and after_ts >= cutoff_ts:
+        cutoff_ts = after_ts + 1
     
-    sql = "SELECT id, received_at, topic, nid, payload FROM results WHERE received_at >= ?"
-    params: tuple = (cutoff_time,)
+    sql = f"SELECT id, {', '.join(RESULT_COLUMNS)} FROM results WHERE {_ts_filter()}"
+    params: tuple = _ts_params(cutoff_ts)
     
     if nid:
         sql += " AND nid = ?"
         params = (*params, nid)
+    if before_id is not None:
+        condition, condition_params = _before_condition(before_id)
+        sql += f" AND {condition}"
+        params = (*params, *condition_params)
     
-    sql += " ORDER BY received_at DESC LIMIT ?"
-    params = (*params, limit)
-    
-    with _db_lock:
-        cursor = db_conn.cursor()
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
+    sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+    rows = _fetch_newest(sql, params, limit, cutoff_ts)
     
-    return [
-        {
-            "id": row["id"],
-            "received_at": row["received_at"],
-            "topic": row["topic"],
+    return [_row_to_result(row) for row in rows]
+
+
+def _export_sources(cutoff_ts: int | None) -> list[str]:
+    """Fichiers à exporter, du plus ancien au plus récent."""
+    return [DB_PATH] + [path for _, path in reversed(_overlapping_partitions(cutoff_ts))]
+
+
+def iter_export_rows(nid: str | None = None, hours: float | None = None):
+    """Parcourt les mesures par paquets de EXPORT_CHUNK_ROWS lignes, en ordre chronologique.
+
+    Chaque fichier est lu via sa propre connexion et un curseur, sans tout charger en mémoire
+    ni occuper un lecteur du pool : le générateur peut être consommé depuis un exécuteur.
+    """
+    cutoff_ts = _cutoff_ts(hours) if hours else None
+    sql = f"SELECT id, {', '.join(RESULT_COLUMNS)} FROM results"
+    conditions = []
+    params: tuple = ()
+    if cutoff_ts is not None:
+        conditions.append(_ts_filter())
+        params = _ts_params(cutoff_ts)
+    if nid:
+        conditions.append("nid = ?")
+        params = (*params, nid)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY ts, id" if nid or cutoff_ts is not None else " ORDER BY id"
+
+    for path in _export_sources(cutoff_ts):
+        # Lecture seule : une partition supprimée par la rétention entre-temps n'est pas
+        # recréée vide, elle est simplement sautée.
+        try:
+            conn = sqlite3.connect(_readonly_uri(path), uri=True, check_same_thread=False)
+        except sqlite3.OperationalError:
+            continue
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+
+_CSV_COLUMNS = ('id', 'ts', 'received_at', 'topic', 'nid', *METRIC_FIELDS, 'horodatage', 'extra')
+
+
+def _encode_export_chunk(rows: list, fmt: str) -> bytes:
+    if fmt == 'ndjson':
+        return b''.join(fastjson.dumps(_row_to_result(row)) + b'\n' for row in rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        if row["id"] <= _backfill_cursor and row["payload"] is not None:
+            # Ligne pas encore migrée : colonnes reconstituées depuis le JSON brut.
+            payload = _row_payload(row)
+            writer.writerow([
+                row["id"], row["ts"], row["received_at"], row["topic"], row["nid"],
+                *(payload.get(name) for name in METRIC_FIELDS), payload.get("horodatage"), None,
+            ])
+        else:
+            writer.writerow([row[name] for name in _CSV_COLUMNS])
+    return buffer.getvalue().encode()
+
+
+def _bounded_count(sql: str, params: tuple, bound: int, sources: str = 'main', cutoff_ts: int | None = None) -> int:
+    """Compte les lignes d'une requête sans dépasser `bound + 1` lignes parcourues.
+
+    Avec sources='results', la requête est répartie sur les partitions de mesures brutes.
+    """
+    count = 0
+    connections = _read_sources(cutoff_ts) if sources == 'results' else [_reader(DB_PATH)]
+    for conn in connections:
+        cursor = conn.execute(f"SELECT COUNT(*) FROM ({sql} LIMIT ?)", (*params, bound + 1 - count))
+        count += cursor.fetchone()[0]
+        if count > bound:
+            break
+    return count
+
+
+@_timed_query
+def choose_resolution(nid: str | None, hours: float, limit: int) -> str:
+    """Choisit la résolution la plus fine dont la période tient dans `limit` points."""
+    cutoff_ts = _cutoff_ts(hours)
+    sql = f"SELECT 1 FROM results WHERE {_ts_filter()}"
+    params = _ts_params(cutoff_ts)
+    if nid:
+        sql += " AND nid = ?"
+        params = (*params, nid)
+    if _bounded_count(sql, params, limit, sources='results', cutoff_ts=cutoff_ts) <= limit:
+        return 'raw'
+    for resolution, width in ROLLUPS.items():
+        sql = f"SELECT 1 FROM rollup_{resolution} WHERE bucket >= ?"
+        params = (cutoff_ts - cutoff_ts % width,)
+        if nid:
+            sql += " AND nid = ?"
+            params = (*params, nid)
+        if _bounded_count(sql, params, limit) <= limit:
+            return resolution
+    # Même la résolution la plus grossière dépasse `limit` : la réponse sera tronquée.
+    return list(ROLLUPS)[-1]
+
+
+@_timed_query
+def query_rollup_history(resolution: str, nid: str | None = None, hours: int = 24, limit: int = 1000) -> list[dict]:
+    """Historique agrégé (une entrée par nid et par tranche), du plus récent au plus ancien.
+
+    `payload` contient les moyennes, au même format que les mesures brutes ;
+    `min`/`max` donnent les extrêmes de chaque métrique sur la tranche.
+    """
+    width = ROLLUPS[resolution]
+    cutoff_ts = _cutoff_ts(hours)
+    sql = f"SELECT nid, bucket, {', '.join(_ROLLUP_FIELDS)} FROM rollup_{resolution} WHERE bucket >= ?"
+    params: tuple = (cutoff_ts - cutoff_ts % width,)
+    if nid:
+        sql += " AND nid = ?"
+        params = (*params, nid)
+    sql += " ORDER BY bucket DESC LIMIT ?"
+    params = (*params, limit)
+
+    rows = _reader(DB_PATH).execute(sql, params).fetchall()
+
+    results = []
+    for row in rows:
+        payload = {"nid": row["nid"]}
+        minimum, maximum = {}, {}
+        for name in METRIC_FIELDS:
+            if row[f"{name}_count"]:
+                payload[name] = round(row[f"{name}_sum"] / row[f"{name}_count"], 2)
+                minimum[name] = row[f"{name}_min"]
+                maximum[name] = row[f"{name}_max"]
+        results.append({
+            "ts": row["bucket"],
+            "received_at": datetime.utcfromtimestamp(row["bucket"] / 1000).isoformat() + 'Z',
             "nid": row["nid"],
-            "payload": json.loads(row["payload"]),
-        }
-        for row in rows
-    ]
+            "count": row["count"],
+            "payload": payload,
+            "min": minimum,
+            "max": maximum,
+        })
+    return results
 
 
-def get_statistics(nid: str) -> dict | None:
-    """Calcule les statistiques moyennes/min/max pour un nid."""
-    sql = """
+def _sql_partials(nid: str, since_ts: int, until_ts: int | None = None) -> tuple[int, list]:
+    """(nb de mesures, [(count, somme, min, max) par champ de STATS_FIELDS]) pour since_ts <= ts < until_ts."""
+    temperature, humidite = 'temperature', 'humidite'
+    if _backfill_cursor:
+        # Migration en cours : les lignes non converties n'ont que le JSON brut.
+        temperature = "COALESCE(temperature, CAST(json_extract(payload, '$.temperature') AS REAL))"
+        humidite = "COALESCE(humidite, CAST(json_extract(payload, '$.humidite') AS REAL))"
+    sql = f"""
         SELECT 
             COUNT(*) as count,
-            AVG(CAST(json_extract(payload, '$.temperature') AS REAL)) as avg_temp,
-            MIN(CAST(json_extract(payload, '$.temperature') AS REAL)) as min_temp,
-            MAX(CAST(json_extract(payload, '$.temperature') AS REAL)) as max_temp,
-            AVG(CAST(json_extract(payload, '$.humidite') AS REAL)) as avg_humidity,
-            MIN(CAST(json_extract(payload, '$.humidite') AS REAL)) as min_humidity,
-            MAX(CAST(json_extract(payload, '$.humidite') AS REAL)) as max_humidity
+            COUNT({temperature}) as count_temp,
+            TOTAL({temperature}) as sum_temp,
+            MIN({temperature}) as min_temp,
+            MAX({temperature}) as max_temp,
+            COUNT({humidite}) as count_humidity,
+            TOTAL({humidite}) as sum_humidity,
+            MIN({humidite}) as min_humidity,
+            MAX({humidite}) as max_humidity
         FROM results 
         WHERE nid = ?
-        AND received_at >= datetime('now', '-24 hours')
+        AND {_ts_filter()}
     """
-    
-    with _db_lock:
-        cursor = db_conn.cursor()
-        cursor.execute(sql, (nid,))
-        row = cursor.fetchone()
-    
-    if not row:
+    params = (nid, *_ts_params(since_ts))
+    if until_ts is not None:
+        sql += " AND ts < ?"
+        params += (until_ts,)
+
+    # Les agrégats de chaque partition sont combinés : (count, somme, min, max) par métrique.
+    count = 0
+    totals = [[0, 0.0, None, None], [0, 0.0, None, None]]
+    for conn in _read_sources(since_ts):
+        row = conn.execute(sql, params).fetchone()
+        count += row[0]
+        _merge_partials(totals, (row[1:5], row[5:9]))
+    return count, totals
+
+
+def _merge_partials(totals: list, partials) -> None:
+    for total, (f_count, f_sum, f_min, f_max) in zip(totals, partials):
+        if not f_count:
+            continue
+        total[0] += f_count
+        total[1] += f_sum
+        total[2] = f_min if total[2] is None else min(total[2], f_min)
+        total[3] = f_max if total[3] is None else max(total[3], f_max)
+
+
+@_timed_query
+def get_statistics(nid: str, now_ms: int | None = None) -> dict | None:
+    """Calcule les statistiques moyennes/min/max pour un nid."""
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    count, totals = _sql_partials(nid, now_ms - STATS_WINDOW_HOURS * 3_600_000)
+    return _statistics(count, totals)
+
+
+def get_rolling_statistics(nid: str, now_ms: int | None = None) -> dict | None:
+    """Statistiques 24h d'un nid depuis les agrégats en mémoire.
+
+    Les tranches entièrement dans la fenêtre viennent de la mémoire ; la tranche la plus
+    ancienne, coupée par la limite des 24h, est relue en base (au plus STATS_BUCKET_SECONDS
+    de mesures, sur l'index (nid, ts)) : le résultat est celui de get_statistics.
+    Retourne None tant que le démarrage à chaud n'est pas fait (migration en cours) :
+    l'appelant se rabat alors sur get_statistics.
+    """
+    if not _rolling_stats_ready:
         return None
-    
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    stats = rolling_stats
+    count, fields = stats.snapshot(nid, now_ms)
+    totals = [list(field) for field in fields]
+    cutoff, covered_from = stats.edge(now_ms)
+    if cutoff < covered_from:
+        edge_count, edge_totals = _sql_partials(nid, cutoff, covered_from)
+        count += edge_count
+        _merge_partials(totals, edge_totals)
+    return _statistics(count, totals)
+
+
+def _statistics(count: int, totals: list) -> dict:
+    temperature, humidity = (
+        (f_sum / f_count if f_count else None, f_min, f_max)
+        for f_count, f_sum, f_min, f_max in totals
+    )
+    return _format_statistics(count, temperature, humidity)
+
+
+def _format_statistics(count: int, temperature: tuple, humidity: tuple) -> dict:
+    """Met en forme (moyenne, min, max) de température et d'humidité."""
+    def _round(value):
+        return round(value, 2) if value is not None else None
+
     return {
-        "count": row[0],
-        "temperature": {
-            "avg": round(row[1], 2) if row[1] else None,
-            "min": round(row[2], 2) if row[2] else None,
-            "max": round(row[3], 2) if row[3] else None,
-        },
-        "humidity": {
-            "avg": round(row[4], 2) if row[4] else None,
-            "min": round(row[5], 2) if row[5] else None,
-            "max": round(row[6], 2) if row[6] else None,
-        }
+        "count": count,
+        "temperature": dict(zip(("avg", "min", "max"), map(_round, temperature))),
+        "humidity": dict(zip(("avg", "min", "max"), map(_round, humidity))),
     }
 
 loop = None
 
+def _split_param(params, name: str) -> list[str]:
+    """Valeurs d'un paramètre répété et/ou séparé par des virgules (?nid=A12,B07&nid=C01)."""
+    return [value.strip() for raw in params.getall(name, []) for value in raw.split(',') if value.strip()]
+
+
+async def _replay_events(resp, client, last_id: int) -> None:
+    """Renvoie les événements manqués depuis `last_id` : mémoire du hub, sinon base."""
+    client.last_id = last_id
+    frames, complete = sse_hub.replay(client, last_id)
+    if not complete:
+        # L'écart dépasse la mémoire : les mesures manquantes sont relues en base, puis
+        # la mémoire est rejouée à partir de la dernière mesure relue.
+        sse_hub.counters["replays_from_db"] += 1
+        rows = await run_db_read(query_results_after, last_id, SSE_REPLAY_DB_LIMIT)
+        missed = [
+            encode_event({"nid": row["nid"], "topic": row["topic"], "data": row["payload"]}, row["id"])
+            for row in rows
+            if client.accepts(row["nid"], row["topic"])
+        ]
+        if rows:
+            client.last_id = rows[-1]["id"]
+        if missed:
+            await resp.write(b''.join(missed))
+        frames, _ = sse_hub.replay(client, client.last_id)
+    else:
+        sse_hub.counters["replays_from_ring"] += 1
+    if frames:
+        await resp.write(b''.join(frames))
+    if sse_hub.ring:
+        client.last_id = max(client.last_id, sse_hub.ring[-1][0])
+
+
 async def sse_handler(request):
-    global clients
-    
+    """Flux SSE, filtrable par nid (?nid=A12,B07) et/ou filtre de topic MQTT (?topic=kelo/nid/+/telemetry).
+
+    Chaque événement porte l'id de la mesure en base ; un client qui se reconnecte avec
+    Last-Event-ID (ou ?lastEventId=) reçoit les événements manqués avant le flux en direct.
+    """
+    params = request.rel_url.query
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or params.get('lastEventId') or -1)
+    except ValueError:
+        last_id = -1
     resp = web.StreamResponse(status=200, reason='OK', headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'Connection': 'keep-alive'})
     await resp.prepare(request)
-    clients.add(resp)
+    # Chaque requête SSE vide sa propre file : un client lent ne retarde pas les autres.
+    # Le client est inscrit avant la reprise : les événements publiés pendant la lecture en
+    # base sont mis en file, et ceux déjà rejoués sont écartés par drain() grâce à leur id.
+    client = sse_hub.register(nids=_split_param(params, 'nid'), topics=_split_param(params, 'topic'))
     try:
-        
-        if latest:
-            await resp.write(f"data: {json.dumps(latest)}\n\n".encode())
-        while True:
-            await asyncio.sleep(15)
+        if last_id >= 0:
+            await _replay_events(resp, client, last_id)
+        elif latest and client.accepts(latest.get('nid'), latest.get('topic')):
+            await resp.write(encode_event(latest))
+        while not client.closed:
+            try:
+                await asyncio.wait_for(client.wakeup.wait(), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                await resp.write(b": keep-alive\n\n")
+                continue
             
-            await resp.write(b": keep-alive\n\n")
+            data = client.drain()
+            if data:
+                started = time.perf_counter()
+                await resp.write(data)
+                SSE_WRITE_SECONDS.observe(time.perf_counter() - started)
     except asyncio.CancelledError:
         pass
+    except ConnectionError:
+        sse_hub.counters["write_errors"] += 1
     finally:
-        clients.discard(resp)
+        sse_hub.unregister(client)
     return resp
 
+def _latest_response(request, etag: str, body) -> web.Response:
+    """Réponse JSON conditionnelle : 304 si le client possède déjà cette version."""
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    candidates = [tag.strip().removeprefix('W/') for tag in request.headers.get('If-None-Match', '').split(',')]
+    if etag in candidates or '*' in candidates:
+        return web.Response(status=304, headers=headers)
+    if not isinstance(body, bytes):
+        body = fastjson.dumps(body)
+    return web.Response(body=body, content_type='application/json', headers=headers)
+
+
+async def metrics_handler(request):
+    """Métriques du collector au format texte Prometheus."""
+    return web.Response(
+        body=metrics.render().encode(),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+    )
+
+
 async def latest_handler(request):
-   
-    return web.json_response(latest if latest else {})
+    """Dernière mesure reçue ; ?nid=A12,B07 : dernière mesure de ces nids ; ?all=1 : tous les nids.
+
+    L'ETag suit la version des données : un sondage sans changement reçoit un 304 vide.
+    """
+    global _latest_all_body
+    params = request.rel_url.query
+    nids = _split_param(params, 'nid')
+    version = latest_version
+    if len(nids) == 1:
+        snapshot = latest_by_nid.get(nids[0])
+        etag = f'"{snapshot["version"]}"' if snapshot else '"0"'
+        return _latest_response(request, etag, snapshot or {})
+    if nids:
+        selected = {nid: latest_by_nid[nid] for nid in nids if nid in latest_by_nid}
+        # Versions seules : un nid (issu du payload ou du topic) peut contenir des caractères
+        # interdits dans un en-tête. Chaque version désigne une seule mesure d'un seul nid.
+        etag = '"' + ('.'.join(str(snap["version"]) for snap in selected.values()) or '0') + '"'
+        newest = max((snap["version"] for snap in selected.values()), default=0)
+        return _latest_response(request, etag, {"version": newest, "nests": selected})
+    if params.get('all', '').lower() in ('1', 'true', 'yes', 'on'):
+        cached_version, body = _latest_all_body
+        if cached_version != version:
+            # Encodé une seule fois par version, quel que soit le nombre de clients qui sondent.
+            body = fastjson.dumps({"version": version, "nests": dict(latest_by_nid)})
+            _latest_all_body = (version, body)
+        return _latest_response(request, f'"all-{version}"', body)
+    return _latest_response(request, f'"{version}"', latest if latest else {})
+
+def _optional_int(params, name: str) -> int | None:
+    value = params.get(name)
+    return int(value) if value not in (None, '') else None
+
+
+def _next_page(results: list[dict], limit: int) -> dict:
+    # Une page pleine peut avoir une suite : on fournit la clé de la page suivante.
+    if results and len(results) >= limit:
+        return {"next_before_id": results[-1]["id"]}
+    return {}
+
+
+def _encode_body(data) -> tuple[bytes, bytes | None]:
+    """Corps JSON encodé, et sa version gzip s'il est assez volumineux."""
+    body = fastjson.dumps(data)
+    if RESPONSE_GZIP_MIN_BYTES and len(body) >= RESPONSE_GZIP_MIN_BYTES:
+        return body, gzip.compress(body, compresslevel=5)
+    return body, None
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """gzip accepté selon Accept-Encoding (RFC 9110) : `gzip;q=0` est un refus, `*` vaut pour gzip non cité."""
+    wildcard = None
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding in ('gzip', 'x-gzip'):
+            return q > 0
+        if coding == '*':
+            wildcard = q > 0
+    return bool(wildcard)
+
+
+async def cached_json_response(request, key: tuple, build, *args) -> web.Response:
+    """Réponse JSON servie depuis le cache si aucune écriture n'a eu lieu depuis son calcul.
+
+    `build(*args)` calcule l'objet à renvoyer ; il est exécuté, encodé et compressé dans
+    le pool de lecteurs. `key` doit contenir tous les paramètres normalisés de la requête.
+    """
+    seq = ingest_seq
+    entry = response_cache.get(key, seq) if RESPONSE_CACHE_MAX_BYTES else None
+    cache_status = 'HIT'
+    if entry is None:
+        cache_status = 'MISS'
+
+        def _build_body():
+            return _encode_body(build(*args))
+        _build_body.__name__ = build.__name__
+
+        # Le numéro lu avant la requête : une écriture concurrente rend l'entrée périmée.
+        body, gzip_body = await run_db_read(_build_body)
+        entry = response_cache.put(key, seq, body, gzip_body) if RESPONSE_CACHE_MAX_BYTES else None
+        if entry is None:
+            return web.Response(body=body, content_type='application/json')
+    headers = {'X-Cache': cache_status, 'Vary': 'Accept-Encoding'}
+    if entry.gzip_body is not None and _accepts_gzip(request.headers.get('Accept-Encoding', '')):
+        headers['Content-Encoding'] = 'gzip'
+        return web.Response(body=entry.gzip_body, content_type='application/json', headers=headers)
+    return web.Response(body=entry.body, content_type='application/json', headers=headers)
+
+
+def _results_page(limit: int, nid: str | None, before_id: int | None) -> dict:
+    results = query_results(limit=limit, nid=nid, before_id=before_id)
+    return {
+        "count": len(results),
+        "results": results,
+        **_next_page(results, limit),
+    }
+
 
 async def results_handler(request):
     params = request.rel_url.query
     limit = int(params.get('limit', 100))
     nid = params.get('nid')
+    before_id = _optional_int(params, 'before_id')
     if limit <= 0:
         limit = 100
 
-    results = query_results(limit=limit, nid=nid)
-    return web.json_response({
+    return await cached_json_response(
+        request, ('results', limit, nid, before_id), _results_page, limit, nid, before_id,
+    )
+
+
+def _history_page(
+    nid: str | None, hours: int, limit: int, resolution: str, before_id: int | None, after_ts: int | None,
+) -> dict:
+    if resolution == 'auto':
+        resolution = choose_resolution(nid, hours, limit)
+    page = {}
+    if resolution == 'raw':
+        results = query_history_by_date(nid=nid, hours=hours, limit=limit, before_id=before_id, after_ts=after_ts)
+        page = _next_page(results, limit)
+    else:
+        results = query_rollup_history(resolution, nid=nid, hours=hours, limit=limit)
+    return {
         "count": len(results),
+        "period_hours": hours,
+        "resolution": resolution,
         "results": results,
-    })
+        **page,
+    }
 
 
 async def history_handler(request):
@@ -203,18 +1849,65 @@ async def history_handler(request):
     hours = int(params.get('hours', 24))
     limit = int(params.get('limit', 1000))
     
+    resolution = params.get('resolution', 'raw')
+    
     if limit <= 0:
         limit = 1000
     if hours <= 0:
         hours = 24
+    if resolution not in HISTORY_RESOLUTIONS:
+        return web.json_response(
+            {'error': f"resolution invalide (valeurs possibles : {', '.join(HISTORY_RESOLUTIONS)})"},
+            status=400,
+        )
     
-    results = query_history_by_date(nid=nid, hours=hours, limit=limit)
     
-    return web.json_response({
-        "count": len(results),
-        "period_hours": hours,
-        "results": results,
+    # Choix de la résolution, lecture et encodage en un seul passage dans le pool de lecteurs.
+    args = (nid, hours, limit, resolution, _optional_int(params, 'before_id'), _optional_int(params, 'after_ts'))
+    return await cached_json_response(request, ('history', *args), _history_page, *args)
+
+
+async def export_handler(request):
+    """Exporte les mesures en flux (NDJSON ou CSV), par paquets lus directement en base."""
+    params = request.rel_url.query
+    nid = params.get('nid')
+    fmt = params.get('format', 'ndjson')
+    hours = float(params['hours']) if params.get('hours') else None
+    
+    if fmt not in EXPORT_FORMATS:
+        return web.json_response(
+            {'error': f"format invalide (valeurs possibles : {', '.join(EXPORT_FORMATS)})"},
+            status=400,
+        )
+    
+    content_type = 'application/x-ndjson' if fmt == 'ndjson' else 'text/csv'
+    resp = web.StreamResponse(status=200, reason='OK', headers={
+        'Content-Type': f'{content_type}; charset=utf-8',
+        'Content-Disposition': f'attachment; filename="kelo-export.{fmt}"',
     })
+    await resp.prepare(request)
+    if fmt == 'csv':
+        await resp.write((','.join(_CSV_COLUMNS) + '\r\n').encode())
+    
+    # La lecture SQLite et l'encodage se font hors de la boucle asyncio ; un seul paquet
+    # est en mémoire à la fois.
+    chunks = iter_export_rows(nid=nid, hours=hours)
+    current_loop = asyncio.get_running_loop()
+    
+    def _next_chunk() -> bytes | None:
+        rows = next(chunks, None)
+        return _encode_export_chunk(rows, fmt) if rows is not None else None
+    
+    try:
+        while True:
+            data = await current_loop.run_in_executor(None, _next_chunk)
+            if data is None:
+                break
+            await resp.write(data)
+    finally:
+        await current_loop.run_in_executor(None, chunks.close)
+    await resp.write_eof()
+    return resp
 
 
 async def stats_handler(request):
@@ -225,7 +1918,13 @@ async def stats_handler(request):
     if not nid:
         return web.json_response({'error': 'nid requis'}, status=400)
     
-    stats = get_statistics(nid)
+    # source=db force le calcul SQL (contrôle de cohérence des agrégats en mémoire). Sans
+    # agrégats prêts (worker, dont le superviseur tient l'écriture, ou démarrage à chaud en
+    # cours), le calcul SQL est lancé directement, sans aller-retour inutile dans le pool.
+    in_memory = _rolling_stats_ready and params.get('source') != 'db'
+    stats = await run_db_read(get_rolling_statistics, nid) if in_memory else None
+    if stats is None:
+        stats = await run_db_read(get_statistics, nid)
     
     if not stats:
         return web.json_response({'error': 'Aucune donnée pour ce nid'}, status=404)
@@ -236,42 +1935,141 @@ async def stats_handler(request):
     })
 
 def on_connect(client, userdata, flags, rc):
-   
-    client.subscribe(TOPIC)
+    MQTT_CONNECTS.inc()
+    client.subscribe(f'$share/{MQTT_SHARE_GROUP}/{TOPIC}' if MQTT_SHARE_GROUP else TOPIC)
 
-def on_message(client, userdata, msg):
+def _decode_message(msg) -> tuple[dict, str, bytes] | None:
+    """Analyse le payload d'un message : (mesure, texte JSON, octets JSON), ou None s'il est invalide.
+
+    Le payload JSON n'est analysé qu'une fois ; ses octets d'origine sont gardés pour la base
+    (DB_KEEP_PAYLOAD) et la trame SSE. Un payload binaire (voir telemetry_codec), reconnu
+    à son premier octet, est encodé une fois en JSON pour ces deux usages.
+    """
+    MQTT_MESSAGES.inc()
     try:
+        if telemetry_codec.is_binary(msg.payload):
+            data = telemetry_codec.decode(msg.payload)
+            MQTT_BINARY.inc()
+            raw = fastjson.dumps(data)
+            return data, raw.decode(), raw
         payload = msg.payload.decode()
-        data = json.loads(payload)
+        data = fastjson.loads(payload)
     except Exception:
-       
-        return
+        MQTT_INVALID.inc()
+        return None
+    if not isinstance(data, dict):
+        MQTT_INVALID.inc()
+        return None
+    return data, payload, msg.payload
 
-    
-   
-    nid = data.get('nid', 'unknown')
+
+def _update_latest(nid: str, topic: str, data: dict, version: int | None = None) -> dict:
+    """Met à jour `latest` et `latest_by_nid` ; retourne un instantané de `latest`.
+
+    `version` : version attribuée par le superviseur (worker), sinon la suivante.
+    """
+    global latest_version
     latest['nid'] = nid
-    latest['topic'] = msg.topic
+    latest['topic'] = topic
     latest['data'] = data
+    latest_version = latest_version + 1 if version is None else version
+    latest_by_nid[nid] = {"nid": nid, "topic": topic, "data": data, "version": latest_version}
+    return dict(latest)
 
-    try:
-        store_result(data, msg.topic, nid)
-    except Exception as err:
-        print(f"Erreur d'enregistrement en base : {err}", flush=True)
 
-    # On diffuse immédiatement la nouvelle valeur à tous les clients SSE connectés.
-    # Le callback MQTT tourne dans un thread, donc on passe par run_coroutine_threadsafe.
-    if loop:
-        asyncio.run_coroutine_threadsafe(broadcast(latest), loop)
+def _ingest_message(msg, wait: bool = True) -> tuple[dict, bytes, Future] | None:
+    """Décode un message, met à jour `latest` et le place dans la file d'écriture."""
+    decoded = _decode_message(msg)
+    if decoded is None:
+        return None
+    data, payload, raw = decoded
+    nid = data.get('nid', 'unknown')
+    return _update_latest(nid, msg.topic, data), raw, submit_result(data, msg.topic, nid, payload, wait)
+
+
+def on_message(client, userdata, msg):
+    started = time.perf_counter()
+    ingested = _ingest_message(msg)
+    INGEST_HANDLE_SECONDS.observe(time.perf_counter() - started)
+    if ingested is None:
+        return
+    snapshot, raw, future = ingested
+
+    # La mesure est diffusée aux clients SSE une fois son lot traité par le thread d'écriture
+    # (les erreurs d'enregistrement y sont journalisées). Le callback tourne dans ce thread,
+    # donc on passe par run_coroutine_threadsafe.
+    def _on_stored(fut: Future) -> None:
+        if loop:
+            event_id = None if fut.exception() else fut.result()
+            asyncio.run_coroutine_threadsafe(broadcast(snapshot, event_id, raw), loop)
+
+    future.add_done_callback(_on_stored)
+
+async def broadcast(data, event_id: int | None = None, raw: bytes | None = None):
+    _publish(data, event_id, raw)
+
+
+def _publish(data, event_id: int | None = None, raw: bytes | None = None) -> None:
+    # La trame est encodée une seule fois puis déposée dans la file de chaque client ;
+    # sans id (échec d'enregistrement), elle n'est pas conservée pour la reprise.
+    # Avec le payload d'origine, seule l'enveloppe {nid, topic} est encodée.
+    started = time.perf_counter()
+    nid, topic = data.get('nid'), data.get('topic')
+    frame = None
+    if raw is not None and isinstance(nid, str) and isinstance(topic, str):
+        frame = encode_raw_event(nid, topic, raw, event_id)
+    if frame is None:
+        frame = encode_event(data, event_id)
+    sse_hub.publish(frame, nid, topic, event_id)
+    BROADCAST_SECONDS.observe(time.perf_counter() - started)
+
+
+def on_messages(messages) -> None:
+    """Traite les messages lus pendant une itération de la boucle (mode asyncio)."""
+    if _bus is not None:
+        _forward_messages(messages)
+        return
+    started = time.perf_counter()
+    # Pas d'attente dans la boucle : file pleine, la lecture MQTT est suspendue (_park).
+    pending = [ingested for msg in messages if (ingested := _ingest_message(msg, wait=False)) is not None]
+    INGEST_HANDLE_SECONDS.observe(time.perf_counter() - started)
+    if not pending:
+        return
+    # Un seul retour vers la boucle par lot de messages, une fois toutes les mesures traitées.
+    _when_all_done([future for _, _, future in pending], _publish_stored, pending)
+
+
+def _when_all_done(futures: list, callback, *args) -> None:
+    """Planifie callback(*args) dans la boucle quand toutes les futures sont résolues.
+
+    Les futures ne sont pas toutes résolues dans l'ordre de la file : une mesure abandonnée
+    ou débordée sur disque l'est dès sa mise en file.
+    """
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _done(_) -> None:
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        loop.call_soon_threadsafe(callback, *args)
+
+    for future in futures:
+        future.add_done_callback(_done)
+
+
+def _publish_stored(pending: list) -> None:
+    for snapshot, raw, future in pending:
+        _publish(snapshot, None if future.exception() else future.result(), raw)
 
-async def broadcast(data):
-    # On clone `clients` (list(clients)) pour éviter les erreurs si le set change pendant la boucle.
-    for resp in list(clients):
-        try:
-            await resp.write(f"data: {json.dumps(data)}\n\n".encode())
-        except Exception:
-            # Client déconnecté: on le retire de la liste active.
-            clients.discard(resp)
+
+async def mqtt_consumer(app) -> None:
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    consumer = AsyncioMqtt(client, on_messages, MQTT_READ_BURST)
+    _ingest_sources.append(consumer)
+    await consumer.run(MQTT_BROKER, MQTT_PORT, MQTT_KEEPALIVE)
 
 def mqtt_thread():
     # Client MQTT exécuté dans un thread dédié pour ne pas bloquer aiohttp.
@@ -281,7 +2079,7 @@ def mqtt_thread():
         client.on_message = on_message
 
         try:
-            client.connect(MQTT_BROKER, MQTT_PORT, 60)
+            client.connect(MQTT_BROKER, MQTT_PORT, MQTT_KEEPALIVE)
             client.loop_forever()
         except Exception as err:
             print(f"MQTT connection error to {MQTT_BROKER}:{MQTT_PORT}: {err}", flush=True)
@@ -296,22 +2094,238 @@ def mqtt_thread():
             except Exception:
                 pass
 
+# Bus local du mode multi-processus : client dans un worker, serveur dans le superviseur.
+_bus: BusClient | None = None
+_bus_server: BusServer | None = None
+_bus_sent_partitions = None
+_bus_sent_id_bounds = None
+_bus_drain_task = None
+
+
+def _forward_messages(messages) -> None:
+    """Worker : les mesures sont découpées ici puis envoyées au superviseur pour écriture."""
+    global _bus_drain_task
+    started = time.perf_counter()
+    items = []
+    for msg in messages:
+        decoded = _decode_message(msg)
+        if decoded is None:
+            continue
+        data, payload, raw = decoded
+        nid = data.get('nid', 'unknown')
+        snapshot = {"nid": nid, "topic": msg.topic, "data": data}
+        items.append((_prepare_row(data, msg.topic, nid, payload), snapshot, raw))
+    if items:
+        _bus.send(('ingest', items))
+        if _bus_drain_task is None and _bus.congested():
+            # Le superviseur ne lit plus (file d'écriture pleine) : plus de lecture MQTT
+            # jusqu'à ce que les envois en attente soient passés.
+            for source in _ingest_sources:
+                source.pause_reading()
+            _bus_drain_task = loop.create_task(_drain_bus())
+    INGEST_HANDLE_SECONDS.observe(time.perf_counter() - started)
+
+
+async def _drain_bus() -> None:
+    global _bus_drain_task
+    try:
+        await _bus.drain()
+    except ConnectionError:
+        # Bus fermé : _bus_listener arrête le worker.
+        pass
+    finally:
+        _bus_drain_task = None
+        for source in _ingest_sources:
+            source.resume_reading()
+
+
+def _bus_state() -> dict:
+    """État partagé avec les workers ; les partitions ne sont renvoyées que si elles ont changé."""
+    global _bus_sent_partitions, _bus_sent_id_bounds
+    state = {"ingest_seq": ingest_seq, "backfill_cursor": _backfill_cursor}
+    if _partitions is not _bus_sent_partitions:
+        state["partitions"] = _bus_sent_partitions = _partitions
+    if _id_bounds is not _bus_sent_id_bounds:
+        state["id_bounds"] = _bus_sent_id_bounds = _id_bounds
+    return state
+
+
+def _bus_welcome() -> dict:
+    # Un worker (re)lancé reprend les dernières mesures et leurs versions : ses ETags de
+    # /collector/latest sont ceux des autres workers.
+    return {
+        "ingest_seq": ingest_seq,
+        "backfill_cursor": _backfill_cursor,
+        "keep_payload": _keep_payload,
+        "partitions": _partitions,
+        "id_bounds": _id_bounds,
+        "latest": dict(latest),
+        "latest_by_nid": dict(latest_by_nid),
+        "latest_version": latest_version,
+    }
+
+
+def _apply_bus_state(state: dict) -> None:
+    global ingest_seq, _backfill_cursor, _keep_payload, _partitions, _id_bounds, latest_version
+    ingest_seq = state.get("ingest_seq", ingest_seq)
+    _backfill_cursor = state.get("backfill_cursor", _backfill_cursor)
+    _keep_payload = state.get("keep_payload", _keep_payload)
+    _partitions = state.get("partitions", _partitions)
+    _id_bounds = state.get("id_bounds", _id_bounds)
+    if "latest_by_nid" in state:
+        latest.update(state["latest"])
+        latest_by_nid.update(state["latest_by_nid"])
+        latest_version = state["latest_version"]
+
+
+def _on_bus_message(message) -> None:
+    """Superviseur : met en file d'écriture les mesures envoyées par un worker."""
+    kind, items = message
+    if kind != 'ingest' or not items:
+        return
+    # Pas d'attente dans la boucle : file pleine, la lecture du bus est suspendue (_park).
+    futures = [_enqueue_row(row, wait=False) for row, _, _ in items]
+    # Comme on_messages : un seul retour vers la boucle, quand toutes les mesures sont traitées.
+    _when_all_done(futures, _broadcast_stored, items, futures)
+
+
+def _broadcast_stored(items: list, futures: list) -> None:
+    # Le superviseur tient aussi `latest` : il attribue les versions (ETags) des mesures.
+    events = []
+    for (_, snapshot, raw), future in zip(items, futures):
+        _update_latest(snapshot["nid"], snapshot["topic"], snapshot["data"])
+        events.append((None if future.exception() else future.result(), snapshot, raw, latest_version))
+    _bus_server.broadcast(('events', events, _bus_state()))
+
+
+async def _bus_listener() -> None:
+    """Worker : applique les mesures enregistrées (par tous les workers) à latest et au flux SSE."""
+    try:
+        while True:
+            kind, *body = await _bus.receive()
+            if kind == 'events':
+                events, state = body
+                _apply_bus_state(state)
+                for event_id, snapshot, raw, version in events:
+                    _publish(
+                        _update_latest(snapshot["nid"], snapshot["topic"], snapshot["data"], version), event_id, raw)
+            elif kind == 'state':
+                _apply_bus_state(body[0])
+            elif kind == 'metrics':
+                metrics.load(body[0])
+    except (asyncio.IncompleteReadError, ConnectionError):
+        print("Bus du superviseur fermé : arrêt du worker", flush=True)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _spawn_worker(worker_id: int) -> subprocess.Popen:
+    env = {**os.environ, 'COLLECTOR_ROLE': 'worker', 'COLLECTOR_WORKER_ID': str(worker_id)}
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+
+async def _supervise() -> None:
+    """Superviseur : bus local, écriture SQLite, lancement et relance des workers."""
+    global loop, _bus_server
+    loop = asyncio.get_running_loop()
+    _bus_server = BusServer(COLLECTOR_BUS_PATH, _on_bus_message, _bus_welcome)
+    _ingest_sources.append(_bus_server)
+    await _bus_server.start()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    workers = [_spawn_worker(i) for i in range(COLLECTOR_WORKERS)]
+    print(f"Superviseur : {COLLECTOR_WORKERS} workers, abonnement $share/{MQTT_SHARE_GROUP}/{TOPIC}", flush=True)
+    sent_seq = ingest_seq
+    try:
+        while not stopping.is_set():
+            try:
+                await asyncio.wait_for(stopping.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+            # Écritures sans nouvelle mesure (migration, rétention, nouvelle partition).
+            if (ingest_seq != sent_seq or _partitions is not _bus_sent_partitions
+                    or _id_bounds is not _bus_sent_id_bounds):
+                sent_seq = ingest_seq
+                _bus_server.broadcast(('state', _bus_state()))
+            # Les workers servent /collector/metrics : métriques d'écriture du superviseur.
+            _bus_server.broadcast(('metrics', metrics.state(_SUPERVISOR_METRICS)))
+            for i, proc in enumerate(workers):
+                if proc.poll() is not None:
+                    print(f"Worker {i} arrêté (code {proc.returncode}) : relance", flush=True)
+                    workers[i] = _spawn_worker(i)
+    finally:
+        for proc in workers:
+            proc.terminate()
+        for proc in workers:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        await _bus_server.close()
+
+
+def run_supervisor() -> None:
+    init_db()
+    start_db_writer()
+    try:
+        asyncio.run(_supervise())
+    finally:
+        stop_db_writer()
+
+
+@web.middleware
+async def db_timeout_middleware(request, handler):
+    try:
+        return await handler(request)
+    except QueryTimeout as err:
+        return web.json_response({'error': str(err)}, status=504)
+
+
 async def init_app():
     # Application web: endpoints de lecture
-    # - /collector/latest : snapshot JSON
+    # - /collector/latest : snapshot JSON (?nid= : par nid, ?all=1 : tous les nids ; ETag)
     # - /collector/events : stream SSE
     # - /collector/results : historique JSON (dernières N entrées)
-    # - /collector/history : historique sur période (dernières X heures)
+    # - /collector/history : historique sur période (dernières X heures, resolution=raw|1m|1h|auto)
     # - /collector/stats : statistiques (min/max/avg sur 24h)
-    app = web.Application()
+    # - /collector/export : export en flux NDJSON/CSV
+    # - /collector/metrics : métriques au format Prometheus
+    app = web.Application(middlewares=[db_timeout_middleware])
     app.router.add_get('/collector/events', sse_handler)
     app.router.add_get('/collector/latest', latest_handler)
     app.router.add_get('/collector/results', results_handler)
     app.router.add_get('/collector/history', history_handler)
     app.router.add_get('/collector/stats', stats_handler)
+    app.router.add_get('/collector/export', export_handler)
+    app.router.add_get('/collector/metrics', metrics_handler)
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
     return app
 
 
+async def _on_startup(app) -> None:
+    global loop, _bus
+    loop = asyncio.get_running_loop()
+    if COLLECTOR_ROLE == 'worker':
+        # État initial (partitions, migration...) fourni par le superviseur.
+        _bus = BusClient(COLLECTOR_BUS_PATH)
+        _apply_bus_state(await _bus.connect())
+        app['bus'] = asyncio.create_task(_bus_listener())
+    if MQTT_MODE == 'asyncio' or _bus is not None:
+        app['mqtt'] = asyncio.create_task(mqtt_consumer(app))
+    else:
+        # Consommateur MQTT historique, dans un thread dédié.
+        threading.Thread(target=mqtt_thread, daemon=True).start()
+
+
+async def _on_cleanup(app) -> None:
+    for name in ('mqtt', 'bus'):
+        task = app.get(name)
+        if task is not None:
+            task.cancel()
+
+
 def create_ssl_context() -> ssl.SSLContext | None:
     if not SSL_ENABLED:
         return None
@@ -327,22 +2341,31 @@ def create_ssl_context() -> ssl.SSLContext | None:
     return context
 
 
-if __name__ == '__main__':
-    # Initialisation de la base de données locale.
-    init_db()
-
-    # Initialisation de la boucle asyncio principale.
+def run_http(reuse_port: bool = False) -> None:
+    # Initialisation de la boucle asyncio principale ; le consommateur MQTT y est lancé
+    # au démarrage de l'application (voir _on_startup).
+    global loop
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
-    # Lancement du consommateur MQTT en arrière-plan.
-    t = threading.Thread(target=mqtt_thread, daemon=True)
-    t.start()
-
     ssl_context = create_ssl_context()
     if ssl_context is not None:
         print(f"Démarrage en HTTPS sur le port {SSL_PORT}", flush=True)
-        web.run_app(init_app(), host='0.0.0.0', port=SSL_PORT, ssl_context=ssl_context)
+        web.run_app(init_app(), host='0.0.0.0', port=SSL_PORT, ssl_context=ssl_context, reuse_port=reuse_port)
+    else:
+        print(f"Démarrage en HTTP sur le port {HTTP_PORT}", flush=True)
+        web.run_app(init_app(), host='0.0.0.0', port=HTTP_PORT, reuse_port=reuse_port)
+
+
+if __name__ == '__main__':
+    if COLLECTOR_ROLE == 'worker':
+        # Worker : ni écriture ni migration, la base est lue en lecture seule.
+        run_http(reuse_port=True)
+    elif COLLECTOR_WORKERS > 1:
+        run_supervisor()
     else:
-        print("Démarrage en HTTP sur le port 8081", flush=True)
-        web.run_app(init_app(), host='0.0.0.0', port=8081)
+        # Initialisation de la base de données locale et du thread d'écriture par lots.
+        init_db()
+        start_db_writer()
+        run_http()
+        stop_db_writer()
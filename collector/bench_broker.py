@@ -0,0 +1,124 @@
+"""Broker MQTT minimal pour les benchmarks : MQTT 3.1.1, sans rétention ni session.
+
+Suffisant pour le collector et ses bancs d'essai (CONNECT, SUBSCRIBE, PUBLISH, PINGREQ,
+DISCONNECT), y compris les abonnements partagés `$share/<groupe>/<filtre>` distribués
+à tour de rôle. Les publications QoS 1 sont acquittées (PUBACK) puis distribuées en
+QoS 0. Ne remplace pas mosquitto en production.
+
+    python bench_broker.py --port 18830
+"""
+import argparse
+import asyncio
+import struct
+
+from sse import topic_matches
+
+_CONNACK = b'\x20\x02\x00\x00'
+_PINGRESP = b'\xd0\x00'
+
+
+def _encode_length(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        n, digit = divmod(n, 128)
+        out.append(digit | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+async def _read_packet(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    header = (await reader.readexactly(1))[0]
+    multiplier, length = 1, 0
+    while True:
+        digit = (await reader.readexactly(1))[0]
+        length += (digit & 0x7f) * multiplier
+        multiplier *= 128
+        if not digit & 0x80:
+            break
+    return header, await reader.readexactly(length)
+
+
+class StandinBroker:
+    def __init__(self):
+        # (writer, filtre, groupe partagé ou None)
+        self.subscriptions: list[tuple[asyncio.StreamWriter, str, str | None]] = []
+        self._turns: dict[str, int] = {}
+
+    def _subscribe(self, writer, body: bytes) -> None:
+        packet_id, pos, codes = body[:2], 2, bytearray()
+        while pos < len(body):
+            size, = struct.unpack_from('!H', body, pos)
+            pattern = body[pos + 2:pos + 2 + size].decode()
+            pos += 2 + size + 1
+            group = None
+            if pattern.startswith('$share/'):
+                _, group, pattern = pattern.split('/', 2)
+            self.subscriptions.append((writer, pattern, group))
+            codes.append(0)
+        writer.write(b'\x90' + _encode_length(2 + len(codes)) + packet_id + codes)
+
+    def _publish(self, writer, header: int, body: bytes) -> None:
+        size, = struct.unpack_from('!H', body)
+        topic = body[2:2 + size].decode()
+        if (header >> 1) & 0x03:
+            # QoS 1 (ou 2, traité pareil) : acquittement immédiat, identifiant retiré du paquet.
+            packet_id = body[2 + size:4 + size]
+            writer.write(b'\x40\x02' + packet_id)
+            body = body[:2 + size] + body[4 + size:]
+        # Distribution en QoS 0, sans drapeaux DUP/RETAIN.
+        packet = b'\x30' + _encode_length(len(body)) + body
+        groups: dict[str, list] = {}
+        for subscriber, pattern, group in self.subscriptions:
+            if not topic_matches(pattern, topic):
+                continue
+            if group is None:
+                subscriber.write(packet)
+            else:
+                groups.setdefault(group, []).append(subscriber)
+        for group, members in groups.items():
+            turn = self._turns.get(group, -1) + 1
+            self._turns[group] = turn
+            members[turn % len(members)].write(packet)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                header, body = await _read_packet(reader)
+                kind = header >> 4
+                if kind == 1:
+                    writer.write(_CONNACK)
+                elif kind == 3:
+                    self._publish(writer, header, body)
+                elif kind == 8:
+                    self._subscribe(writer, body)
+                elif kind == 12:
+                    writer.write(_PINGRESP)
+                elif kind == 14:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscriptions = [sub for sub in self.subscriptions if sub[0] is not writer]
+            writer.close()
+
+
+async def serve(host: str, port: int) -> None:
+    server = await asyncio.start_server(StandinBroker().handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def run(host: str, port: int) -> None:
+    try:
+        asyncio.run(serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    args = parser.parse_args()
+    run(args.host, args.port)
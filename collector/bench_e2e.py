@@ -0,0 +1,420 @@
+"""Benchmark de bout en bout du collector : MQTT -> SQLite -> SSE, et lectures HTTP en charge.
+
+Pour chaque palier de taille de table (--sizes), la base est pré-remplie comme dans
+bench_queries.py, puis le collector est lancé tel qu'en production (`python app.py`,
+éventuellement en multi-processus) contre un broker local (bench_broker.py, ou --broker).
+Un éditeur publie --messages mesures à --rate messages/s pendant que --sse-clients
+clients suivent /collector/events et qu'un client interroge en boucle /collector/history
+et /collector/stats. Rapport :
+
+- débit d'ingestion soutenu (mesures reçues en SSE par seconde) et pertes ;
+- latence publication -> trame SSE (p50/p99/max), d'après l'horodatage du message ;
+- débit d'écriture SQLite (lignes par seconde, et par seconde de commit d'après les métriques) ;
+- latences de /collector/history et /collector/stats en fonction de la taille de la table.
+
+    python bench_e2e.py --sizes 0,1000000 --messages 50000 --rate 5000 --json e2e.json
+    python bench_e2e.py --baseline e2e.json  # compare au rapport d'une version précédente
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='0,100000', help="paliers de taille de table avant la charge (lignes)")
+    parser.add_argument('--messages', type=int, default=20000, help="mesures publiées par palier")
+    parser.add_argument('--rate', type=float, default=2000, help="messages publiés par seconde (0 : sans limite)")
+    parser.add_argument('--nids', type=int, default=200, help="nombre de nids simulés")
+    parser.add_argument('--sse-clients', type=int, default=4, help="clients SSE simultanés")
+    parser.add_argument('--workers', type=int, default=1, help="COLLECTOR_WORKERS du collector")
+    parser.add_argument('--encoding', default='json', choices=('json', 'binary'), help="format des messages MQTT")
+    parser.add_argument('--broker', help="broker existant host:port (broker local de bench_broker.py par défaut)")
+    parser.add_argument('--mqtt-port', type=int, default=18830, help="port du broker local")
+    parser.add_argument('--http-port', type=int, default=18081, help="port HTTP du collector")
+    parser.add_argument('--idle-timeout', type=float, default=10, help="arrêt si aucune trame SSE pendant ce délai (s)")
+    parser.add_argument('--json', dest='json_path', help="écrit les résultats au format JSON")
+    parser.add_argument('--baseline', help="rapport JSON d'une version précédente, pour comparaison")
+    return parser.parse_args()
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"p50_ms": None, "p99_ms": None, "max_ms": None}
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+def publisher(host: str, port: int, topic: str, messages: int, rate: float, nids: int, encoding: str, report) -> None:
+    """Processus éditeur : publie à cadence fixe (sans dérive) ; l'horodatage sert à la latence."""
+    import random
+    import paho.mqtt.client as mqtt
+
+    sys.path.insert(0, HERE)
+    import telemetry_codec
+
+    client = mqtt.Client()
+    client.connect(host, port, 60)
+    client.loop_start()
+    interval = 1 / rate if rate > 0 else 0
+    started = next_at = time.monotonic()
+    for k in range(messages):
+        nid = f"N{k % nids:04d}"
+        data = {
+            "nid": nid,
+            "temperature": round(random.uniform(20.0, 38.0), 2),
+            "humidite": round(random.uniform(55.0, 98.0), 2),
+            "vibration": round(random.uniform(2.6, 6.0), 2),
+            "tension": round(random.uniform(0.0, 4.9), 2),
+            "horodatage": datetime.utcnow().isoformat() + "Z",
+        }
+        payload = telemetry_codec.encode(data) if encoding == 'binary' else json.dumps(data)
+        client.publish(topic.format(nid=nid), payload)
+        if interval:
+            next_at += interval
+            delay = next_at - time.monotonic()
+            # Pas de sommeil en dessous de la milliseconde : la cadence moyenne est tenue par lots.
+            if delay > 0.001:
+                time.sleep(delay)
+    report.put({"published": messages, "seconds": time.monotonic() - started})
+    time.sleep(1)
+    client.loop_stop()
+    client.disconnect()
+
+
+_HORODATAGE = re.compile(rb'"horodatage":\s*"([^"]+)Z"')
+
+
+def _sent_at(frame: bytes) -> float | None:
+    # Lecture directe de l'horodatage, sans analyser toute la trame : le client de mesure
+    # ne doit pas devenir le goulot d'étranglement.
+    match = _HORODATAGE.search(frame)
+    if match is None:
+        return None
+    return datetime.fromisoformat(match.group(1).decode()).replace(tzinfo=timezone.utc).timestamp()
+
+
+async def sse_client(session, url: str, expected: int, idle_timeout: float, stats: dict) -> None:
+    """Lit le flux SSE jusqu'à `expected` trames (ou inactivité) ; latence = réception - horodatage."""
+    latencies = stats["latencies"]
+    async with session.get(url) as resp:
+        buffer = b''
+        while stats["received"] < expected:
+            try:
+                chunk = await asyncio.wait_for(resp.content.readany(), idle_timeout)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            now = time.time()
+            buffer += chunk
+            *frames, buffer = buffer.split(b'\n\n')
+            for frame in frames:
+                sent = _sent_at(frame)
+                if sent is None:
+                    continue
+                stats["received"] += 1
+                latencies.append((now - sent) * 1000)
+                stats["last"] = now
+
+
+async def query_loop(session, base: str, nid: str, stop: asyncio.Event, results: dict) -> None:
+    """Interroge en boucle history et stats pendant la charge (le cache est invalidé par l'ingestion)."""
+    queries = {
+        "history_24h": f"{base}/collector/history?nid={nid}&hours=24&limit=1000",
+        "history_1h_all_nids": f"{base}/collector/history?hours=1&limit=1000",
+        "stats": f"{base}/collector/stats?nid={nid}",
+        "stats_db": f"{base}/collector/stats?nid={nid}&source=db",
+    }
+    for name in queries:
+        results[name] = {"samples": [], "cache_hits": 0, "errors": 0}
+    while not stop.is_set():
+        for name, url in queries.items():
+            entry = results[name]
+            started = time.perf_counter()
+            try:
+                async with session.get(url) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        entry["errors"] += 1
+                        continue
+                    entry["cache_hits"] += resp.headers.get('X-Cache') == 'HIT'
+            except Exception:
+                entry["errors"] += 1
+                continue
+            entry["samples"].append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.05)
+
+
+def scrape_metrics(text: str) -> dict:
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, _, value = line.rpartition(' ')
+            values[name] = float(value)
+    return values
+
+
+async def wait_ready(session, base: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(f"{base}/collector/latest") as resp:
+                await resp.read()
+                return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Le collector ne répond pas ; voir son journal")
+            await asyncio.sleep(0.2)
+
+
+async def run_load(args, host: str, port: int) -> dict:
+    import aiohttp
+
+    base = f"http://127.0.0.1:{args.http_port}"
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=None)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        await wait_ready(session, base)
+        # Laisse le temps au collector de s'abonner avant la première publication.
+        await asyncio.sleep(1)
+        async with session.get(f"{base}/collector/metrics") as resp:
+            before = scrape_metrics(await resp.text()) if resp.status == 200 else {}
+
+        clients = [{"received": 0, "latencies": [], "last": None} for _ in range(args.sse_clients)]
+        readers = [
+            asyncio.create_task(sse_client(session, f"{base}/collector/events", args.messages, args.idle_timeout, stats))
+            for stats in clients
+        ]
+        stop = asyncio.Event()
+        queries: dict = {}
+        poller = asyncio.create_task(query_loop(session, base, "N0000", stop, queries))
+        await asyncio.sleep(0.5)
+
+        ctx = multiprocessing.get_context('spawn')
+        report = ctx.Queue()
+        proc = ctx.Process(target=publisher, args=(
+            host, port, 'kelo/nid/{nid}/telemetry', args.messages, args.rate, args.nids, args.encoding, report))
+        started = time.time()
+        proc.start()
+        await asyncio.gather(*readers)
+        stop.set()
+        await poller
+        published = await asyncio.get_running_loop().run_in_executor(None, report.get)
+        proc.join()
+
+        async with session.get(f"{base}/collector/metrics") as resp:
+            after = scrape_metrics(await resp.text()) if resp.status == 200 else {}
+
+    latencies = [latency for stats in clients for latency in stats["latencies"]]
+    received = [stats["received"] for stats in clients]
+    last = clients[0]["last"] or started
+    return {
+        "published": published["published"],
+        "publish_rate": round(published["published"] / published["seconds"], 1),
+        "sse_received_min": min(received),
+        "sse_lost_max": args.messages - min(received),
+        "ingest_rate": round(clients[0]["received"] / max(last - started, 1e-9), 1),
+        "latency": percentiles(latencies),
+        "queries": {
+            name: {
+                **percentiles(entry["samples"]),
+                "requests": len(entry["samples"]),
+                "cache_hit_ratio": round(entry["cache_hits"] / len(entry["samples"]), 3) if entry["samples"] else None,
+                "errors": entry["errors"],
+            }
+            for name, entry in queries.items()
+        },
+        "load_seconds": round(last - started, 3),
+        "metrics": {key: after.get(key, 0) - before.get(key, 0) for key in (
+            'kelo_db_batch_rows_sum', 'kelo_db_batch_rows_count', 'kelo_db_commit_seconds_sum',
+            'kelo_ingest_dropped_total{policy="block"}', 'kelo_ingest_dropped_total{policy="drop_oldest"}',
+        )} if after else {},
+    }
+
+
+def count_rows(app) -> int:
+    """Lignes de la base et de ses partitions (créées par le collector pendant la charge)."""
+    total = 0
+    for path in (app.DB_PATH, *app._scan_partitions().values()):
+        conn = sqlite3.connect(path)
+        try:
+            total += conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        finally:
+            conn.close()
+    return total
+
+
+def start_collector(args, db_path: str, host: str, port: int, log) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        'DB_PATH': db_path,
+        'MQTT_BROKER': host,
+        'MQTT_PORT': str(port),
+        'MQTT_TOPIC': 'kelo/#',
+        'HTTP_PORT': str(args.http_port),
+        'COLLECTOR_WORKERS': str(args.workers),
+        'SSL_ENABLED': 'false',
+    }
+    return subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'app.py')], env=env, cwd=HERE, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop_collector(proc: subprocess.Popen) -> None:
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def summarize(entry: dict) -> str:
+    load, queries = entry["load"], entry["load"]["queries"]
+    return (
+        f"{entry['rows']:>10} lignes | ingestion {load['ingest_rate']:>9} msg/s"
+        f" (perdus {load['sse_lost_max']}) | latence p50 {load['latency']['p50_ms']} ms"
+        f" p99 {load['latency']['p99_ms']} ms | écriture {entry['db']['rows_per_s']} lignes/s"
+        f" | history p50 {queries['history_24h']['p50_ms']} ms | stats p50 {queries['stats']['p50_ms']} ms"
+        f" (db {queries['stats_db']['p50_ms']} ms)"
+    )
+
+
+# Indicateurs comparés à --baseline : (chemin dans le rapport, True si plus grand = mieux).
+COMPARED = (
+    (("load", "ingest_rate"), True),
+    (("load", "latency", "p50_ms"), False),
+    (("load", "latency", "p99_ms"), False),
+    (("db", "rows_per_s"), True),
+    (("load", "queries", "history_24h", "p50_ms"), False),
+    (("load", "queries", "stats", "p50_ms"), False),
+    (("load", "queries", "stats_db", "p50_ms"), False),
+)
+
+
+def _lookup(entry: dict, path: tuple):
+    for key in path:
+        entry = entry.get(key) if isinstance(entry, dict) else None
+    return entry
+
+
+def compare(report: dict, baseline_path: str) -> None:
+    with open(baseline_path, encoding='utf-8') as fh:
+        baseline = {entry["rows"]: entry for entry in json.load(fh)["results"]}
+    for entry in report["results"]:
+        previous = baseline.get(entry["rows"])
+        if previous is None:
+            continue
+        print(f"{entry['rows']:>10} lignes, par rapport à {baseline_path} :")
+        for path, higher_is_better in COMPARED:
+            old, new = _lookup(previous, path), _lookup(entry, path)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            better = change > 0 if higher_is_better else change < 0
+            print(f"  {'.'.join(path):<40} {old:>12} -> {new:>12} ({change:+.1f} %{', mieux' if better else ''})")
+
+
+def main() -> None:
+    args = parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    workdir = tempfile.mkdtemp(prefix='kelo-bench-e2e-')
+    db_path = os.path.join(workdir, 'results.db')
+    os.environ['DB_PATH'] = db_path
+    sys.path.insert(0, HERE)
+    import app
+    from bench_broker import run as run_broker
+    from bench_queries import fill
+
+    app.init_db()
+    broker = None
+    if args.broker:
+        host, _, port = args.broker.rpartition(':')
+        port = int(port)
+    else:
+        host, port = '127.0.0.1', args.mqtt_port
+        broker = multiprocessing.get_context('spawn').Process(target=run_broker, args=(host, port), daemon=True)
+        broker.start()
+
+    report = {
+        "benchmark": "e2e",
+        "messages": args.messages,
+        "rate": args.rate,
+        "nids": args.nids,
+        "sse_clients": args.sse_clients,
+        "workers": args.workers,
+        "encoding": args.encoding,
+        "json_backend": app.fastjson.BACKEND,
+        "results": [],
+    }
+    log_path = os.path.join(workdir, 'collector.log')
+    now_ms = int(time.time() * 1000)
+    try:
+        with open(log_path, 'ab') as log:
+            for size in sizes:
+                # Historique pré-rempli hors charge (le collector est arrêté), plus ancien que les
+                # mesures publiées : la fenêtre des 24h reste comparable d'un palier à l'autre.
+                filled = count_rows(app)
+                if size > filled:
+                    fill(app.db_conn, filled, size, args.nids, 60_000, now_ms - 3_600_000)
+                    app.db_conn.execute("ANALYZE")
+                rows_before = count_rows(app)
+                collector = start_collector(args, db_path, host, port, log)
+                try:
+                    load = asyncio.run(run_load(args, host, port))
+                finally:
+                    stop_collector(collector)
+                stored = count_rows(app) - rows_before
+                metrics = load.pop("metrics")
+                commit_seconds = metrics.get('kelo_db_commit_seconds_sum')
+                entry = {
+                    "rows": size,
+                    "load": load,
+                    "db": {
+                        "rows_stored": stored,
+                        "rows_per_s": round(stored / load["load_seconds"], 1) if load["load_seconds"] else None,
+                        # Débit du thread d'écriture seul ; en multi-processus, métriques du superviseur
+                        # relayées par les workers (mises à jour chaque seconde).
+                        "rows_per_commit_s": round(metrics['kelo_db_batch_rows_sum'] / commit_seconds, 1)
+                        if commit_seconds else None,
+                        "mean_batch_rows": round(metrics['kelo_db_batch_rows_sum'] / metrics['kelo_db_batch_rows_count'], 1)
+                        if metrics.get('kelo_db_batch_rows_count') else None,
+                    },
+                }
+                report["results"].append(entry)
+                print(summarize(entry), flush=True)
+    except Exception:
+        print(f"Journal du collector : {log_path}", file=sys.stderr)
+        raise
+    finally:
+        if broker is not None:
+            broker.terminate()
+    # Base et journal ne sont conservés qu'en cas d'échec.
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
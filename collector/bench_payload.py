@@ -0,0 +1,120 @@
+"""Micro-benchmark du traitement d'un message MQTT par le collector (temps CPU par message).
+
+Compare l'ancien chemin (json.loads, puis json.dumps du payload conservé et de la trame
+SSE) au chemin actuel (une seule analyse via fastjson, payload d'origine conservé et
+inséré tel quel dans la trame SSE), puis au format binaire compact (telemetry_codec,
+encodé une fois en JSON pour la trame SSE). La découpe en colonnes est commune aux trois.
+
+    python bench_payload.py --messages 200000 --json bench_payload.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000, help="nombre de messages traités par mesure")
+    parser.add_argument('--nids', type=int, default=50, help="nombre de nids simulés")
+    parser.add_argument('--repeat', type=int, default=5, help="répétitions (la meilleure est retenue)")
+    parser.add_argument('--json', dest='json_path', help="écrit les résultats au format JSON")
+    return parser.parse_args()
+
+
+def sample_messages(count: int, nids: int) -> list[tuple[str, bytes]]:
+    """Messages au format du simulateur : (topic, payload JSON en octets)."""
+    messages = []
+    for k in range(count):
+        nid = f"N{k % nids:04d}"
+        payload = {
+            "nid": nid,
+            "temperature": round(random.uniform(20.0, 38.0), 2),
+            "humidite": round(random.uniform(55.0, 98.0), 2),
+            "vibration": round(random.uniform(2.6, 6.0), 2),
+            "tension": round(random.uniform(0.0, 4.9), 2),
+            "horodatage": datetime.utcnow().isoformat() + "Z",
+        }
+        messages.append((f"kelo/nid/{nid}/telemetry", json.dumps(payload).encode()))
+    return messages
+
+
+def legacy_path(app, sse, messages) -> None:
+    for event_id, (topic, raw) in enumerate(messages):
+        data = json.loads(raw.decode())
+        nid = data.get('nid', 'unknown')
+        app._split_payload(data)
+        json.dumps(data, ensure_ascii=False)
+        sse.encode_event({"nid": nid, "topic": topic, "data": data}, event_id)
+
+
+def fast_path(app, sse, messages) -> None:
+    fastjson = app.fastjson
+    for event_id, (topic, raw) in enumerate(messages):
+        text = raw.decode()
+        data = fastjson.loads(text)
+        nid = data.get('nid', 'unknown')
+        app._split_payload(data)
+        sse.encode_raw_event(nid, topic, raw, event_id)
+
+
+def binary_path(app, sse, messages) -> None:
+    decode = app.telemetry_codec.decode
+    dumps = app.fastjson.dumps
+    for event_id, (topic, raw) in enumerate(messages):
+        data = decode(raw)
+        app._split_payload(data)
+        sse.encode_raw_event(data['nid'], topic, dumps(data), event_id)
+
+
+def measure(fn, app, sse, messages, repeat: int) -> float:
+    """Meilleur temps CPU par message, en microsecondes."""
+    best = None
+    for _ in range(repeat):
+        started = time.process_time()
+        fn(app, sse, messages)
+        elapsed = time.process_time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(messages) * 1e6, 3)
+
+
+def main() -> None:
+    args = parse_args()
+    os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(prefix='kelo-bench-'), 'results.db'))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+    import sse
+
+    messages = sample_messages(args.messages, args.nids)
+    binary_messages = [(topic, app.telemetry_codec.encode(json.loads(raw))) for topic, raw in messages]
+    json_bytes = sum(len(raw) for _, raw in messages) / len(messages)
+    binary_bytes = sum(len(raw) for _, raw in binary_messages) / len(messages)
+    legacy = measure(legacy_path, app, sse, messages, args.repeat)
+    fast = measure(fast_path, app, sse, messages, args.repeat)
+    binary = measure(binary_path, app, sse, binary_messages, args.repeat)
+    print(f"backend JSON : {app.fastjson.BACKEND}")
+    print(f"ancien chemin : {legacy:>8} µs/message")
+    print(f"chemin actuel : {fast:>8} µs/message ({legacy / fast:.2f}x)")
+    print(f"binaire       : {binary:>8} µs/message ({legacy / binary:.2f}x)")
+    print(f"taille moyenne : {json_bytes:.1f} octets en JSON, {binary_bytes:.1f} en binaire", flush=True)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as fh:
+            json.dump({
+                "benchmark": "payload",
+                "backend": app.fastjson.BACKEND,
+                "messages": args.messages,
+                "legacy_us_per_message": legacy,
+                "fast_us_per_message": fast,
+                "binary_us_per_message": binary,
+                "json_bytes_per_message": round(json_bytes, 1),
+                "binary_bytes_per_message": round(binary_bytes, 1),
+            }, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
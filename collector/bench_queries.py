@@ -0,0 +1,107 @@
+"""Benchmark des requêtes de lecture du collector en fonction de la taille de la table.
+
+La table est remplie avec des nids publiant à cadence fixe : chaque palier ajoute de
+l'historique plus ancien, la fenêtre des dernières 24h garde donc la même taille.
+Avec les index (nid, ts) et (ts), les latences doivent rester stables d'un palier à l'autre.
+
+    python bench_queries.py --sizes 100000,1000000,10000000 --json bench_queries.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100000,1000000', help="paliers de taille de table (lignes)")
+    parser.add_argument('--nids', type=int, default=200, help="nombre de nids simulés")
+    parser.add_argument('--interval', type=float, default=60, help="période de publication par nid (s)")
+    parser.add_argument('--repeat', type=int, default=50, help="répétitions par requête")
+    parser.add_argument('--db', help="fichier SQLite à utiliser (temporaire par défaut)")
+    parser.add_argument('--json', dest='json_path', help="écrit les résultats au format JSON")
+    return parser.parse_args()
+
+
+def fill(conn, start: int, end: int, nids: int, interval_ms: int, now_ms: int) -> None:
+    """Insère les lignes [start, end) en remontant dans le temps depuis now_ms."""
+    chunk = 100_000
+    for base in range(start, end, chunk):
+        rows = []
+        for k in range(base, min(base + chunk, end)):
+            nid = f"N{k % nids:04d}"
+            ts = now_ms - (k // nids) * interval_ms
+            received_at = datetime.utcfromtimestamp(ts / 1000).isoformat() + 'Z'
+            rows.append((
+                ts, received_at, f"kelo/nid/{nid}/telemetry", nid,
+                round(random.uniform(20.0, 38.0), 2), round(random.uniform(55.0, 98.0), 2),
+                round(random.uniform(2.6, 6.0), 2), round(random.uniform(0.0, 4.9), 2),
+                received_at, None, None,
+            ))
+        conn.executemany(
+            "INSERT INTO results (ts, received_at, topic, nid, temperature, humidite, vibration,"
+            " tension, horodatage, extra, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+
+
+def measure(fn, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3),
+    }
+
+
+def main() -> None:
+    args = parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    os.environ['DB_PATH'] = args.db or os.path.join(tempfile.mkdtemp(prefix='kelo-bench-'), 'results.db')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    app.init_db()
+    now_ms = int(time.time() * 1000)
+    interval_ms = int(args.interval * 1000)
+    nid = "N0000"
+
+    report = []
+    filled = 0
+    for size in sizes:
+        fill(app.db_conn, filled, size, args.nids, interval_ms, now_ms)
+        filled = size
+        app.db_conn.execute("ANALYZE")
+        entry = {
+            "rows": size,
+            "history_24h": measure(lambda: app.query_history_by_date(nid=nid, hours=24, limit=1000), args.repeat),
+            "history_24h_all_nids": measure(lambda: app.query_history_by_date(hours=24, limit=1000), args.repeat),
+            "stats_24h": measure(lambda: app.get_statistics(nid), args.repeat),
+            "results_nid": measure(lambda: app.query_results(limit=100, nid=nid), args.repeat),
+        }
+        report.append(entry)
+        print(
+            f"{size:>12} lignes | history {entry['history_24h']['p50_ms']:>8} ms"
+            f" | history (tous) {entry['history_24h_all_nids']['p50_ms']:>8} ms"
+            f" | stats {entry['stats_24h']['p50_ms']:>8} ms"
+            f" | results {entry['results_nid']['p50_ms']:>8} ms",
+            flush=True,
+        )
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as fh:
+            json.dump({"benchmark": "queries", "nids": args.nids, "results": report}, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Contrôle de cohérence de /collector/stats : agrégats en mémoire contre calcul SQL.
+
+Des mesures sont écrites par le thread d'écriture du collector (partitions comprises)
+sur les 25 dernières heures, dont une grappe autour de la limite des 24h. Pour une suite
+d'instants « maintenant » balayant deux tranches, get_rolling_statistics doit rendre
+le résultat de get_statistics : nombres de mesures, min et max identiques, moyennes à
+0,01 près (les sommes ne sont pas faites dans le même ordre, l'arrondi au centième peut
+basculer). Le contrôle est refait après un redémarrage du thread d'écriture (démarrage à
+chaud depuis la base). Code de sortie 1 en cas d'écart.
+
+    python check_stats.py --nids 20 --readings 20000 --seed 1
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nids', type=int, default=20, help="nombre de nids")
+    parser.add_argument('--readings', type=int, default=20000, help="nombre de mesures écrites")
+    parser.add_argument('--steps', type=int, default=60, help="instants contrôlés sur deux tranches")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def make_row(ts: int, nid: str, rng: random.Random) -> tuple:
+    """Ligne au format de _prepare_row, avec un horodatage de réception imposé."""
+    received_at = datetime.utcfromtimestamp(ts / 1000).isoformat() + 'Z'
+    temperature = round(rng.uniform(20.0, 38.0), 2) if rng.random() > 0.05 else None
+    return (
+        ts, received_at, f"kelo/nid/{nid}/telemetry", nid,
+        temperature, round(rng.uniform(55.0, 98.0), 2), round(rng.uniform(2.6, 6.0), 2),
+        round(rng.uniform(0.0, 4.9), 2), received_at, None, None,
+    )
+
+
+def same(memory: dict, sql: dict) -> bool:
+    if memory["count"] != sql["count"]:
+        return False
+    for field in ("temperature", "humidity"):
+        a, b = memory[field], sql[field]
+        if (a["min"], a["max"]) != (b["min"], b["max"]) or (a["avg"] is None) != (b["avg"] is None):
+            return False
+        if a["avg"] is not None and abs(a["avg"] - b["avg"]) > 0.0101:
+            return False
+    return True
+
+
+def compare(app, nids: list, now_values: list) -> int:
+    mismatches = 0
+    for now_ms in now_values:
+        for nid in nids:
+            memory = app.get_rolling_statistics(nid, now_ms)
+            sql = app.get_statistics(nid, now_ms)
+            if not same(memory, sql):
+                mismatches += 1
+                if mismatches <= 5:
+                    print(f"Écart {nid} à {now_ms} : mémoire {memory} / SQL {sql}", flush=True)
+    return mismatches
+
+
+def main() -> None:
+    args = parse_args()
+    os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='kelo-stats-'), 'results.db')
+    os.environ.setdefault('DB_RETENTION_DAYS', '0')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    rng = random.Random(args.seed)
+    window_ms = app.STATS_WINDOW_HOURS * 3_600_000
+    bucket_ms = app.rolling_stats.bucket_ms
+    now_ms = int(time.time() * 1000)
+    nids = [f"N{i:03d}" for i in range(args.nids)]
+    # Un quart des mesures autour de la limite des 24h (± deux tranches), le reste sur 25h.
+    edge = now_ms - window_ms
+    stamps = [
+        rng.randint(edge - 2 * bucket_ms, edge + 2 * bucket_ms) if k % 4 == 0
+        else rng.randint(now_ms - window_ms - 3_600_000, now_ms)
+        for k in range(args.readings)
+    ]
+    stamps.sort()
+
+    app.init_db()
+    app.start_db_writer()
+    futures = [app._enqueue_row(make_row(ts, rng.choice(nids), rng)) for ts in stamps]
+    for future in futures:
+        future.result()
+
+    # Instants postérieurs à la dernière mesure : toutes les tranches utiles sont encore en mémoire.
+    now_values = [now_ms + k * 2 * bucket_ms // args.steps for k in range(args.steps)]
+    # Limite des 24h alignée sur une tranche, et juste avant.
+    aligned = (edge // bucket_ms + 1) * bucket_ms + window_ms
+    now_values += [aligned, aligned - 1]
+    mismatches = compare(app, nids, now_values)
+    print(f"Agrégats alimentés en direct : {len(now_values) * len(nids)} comparaisons, {mismatches} écarts", flush=True)
+
+    app.stop_db_writer()
+    app._rolling_stats_ready = False
+    app.start_db_writer()
+    while not app._rolling_stats_ready:
+        time.sleep(0.05)
+    warm = compare(app, nids, now_values)
+    print(f"Après démarrage à chaud : {len(now_values) * len(nids)} comparaisons, {warm} écarts", flush=True)
+    app.stop_db_writer()
+    sys.exit(1 if mismatches or warm else 0)
+
+
+if __name__ == '__main__':
+    main()
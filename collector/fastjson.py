@@ -0,0 +1,41 @@
+"""Encodage et décodage JSON du collector : orjson s'il est installé, sinon la bibliothèque standard.
+
+JSON_BACKEND=json force la bibliothèque standard (orjson est optionnel, absent de l'image
+par défaut). Les deux backends produisent du JSON compact encodé en UTF-8.
+"""
+import json
+import os
+
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if JSON_BACKEND == 'json':
+    orjson = None
+elif JSON_BACKEND == 'orjson' and orjson is None:
+    raise ImportError("JSON_BACKEND=orjson mais le module orjson n'est pas installé")
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # Clés non textuelles, entiers hors 64 bits... : la bibliothèque standard sait faire.
+            return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+else:
+    loads = json.loads
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def dumps_str(obj) -> str:
+    """Variante texte, pour les colonnes SQLite."""
+    return dumps(obj).decode()
@@ -0,0 +1,151 @@
+"""Injection de lenteurs de stockage : la session MQTT du collector doit survivre.
+
+Le collector est lancé dans ce processus contre un broker local (mosquitto) ; un
+éditeur publie à débit fixe pendant que l'écriture SQLite est bloquée `--stall`
+secondes toutes les `--stall-every` secondes. En fin de test, on vérifie que la
+connexion MQTT n'a jamais été perdue, que tous les messages ont été reçus et que
+chaque mesure est enregistrée ou comptée comme abandonnée selon la politique.
+
+    python fault_harness.py --policy spill --rate 500 --duration 30 --stall 8 --keepalive 5
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--broker', default='127.0.0.1', help="adresse du broker MQTT")
+    parser.add_argument('--port', type=int, default=1883, help="port du broker MQTT")
+    parser.add_argument('--policy', default='spill', choices=('block', 'drop_oldest', 'spill'))
+    parser.add_argument('--queue-max', type=int, default=2000, help="taille de la file d'écriture")
+    parser.add_argument('--rate', type=float, default=500, help="messages publiés par seconde")
+    parser.add_argument('--duration', type=float, default=30, help="durée de publication (s)")
+    parser.add_argument('--stall', type=float, default=8, help="durée d'un blocage du stockage (s)")
+    parser.add_argument('--stall-every', type=float, default=15, help="période des blocages (s)")
+    parser.add_argument('--keepalive', type=int, default=5, help="keepalive MQTT du collector (s)")
+    parser.add_argument('--drain-timeout', type=float, default=120, help="attente maximale de fin d'écriture (s)")
+    parser.add_argument('--json', dest='json_path', help="écrit le rapport au format JSON")
+    return parser.parse_args()
+
+
+def configure_env(args) -> None:
+    workdir = tempfile.mkdtemp(prefix='kelo-faults-')
+    os.environ.update({
+        'DB_PATH': os.path.join(workdir, 'results.db'),
+        'MQTT_BROKER': args.broker,
+        'MQTT_PORT': str(args.port),
+        'MQTT_TOPIC': 'kelo/faults/#',
+        'MQTT_KEEPALIVE': str(args.keepalive),
+        'MQTT_MODE': 'asyncio',
+        'INGEST_OVERFLOW_POLICY': args.policy,
+        'DB_QUEUE_MAX': str(args.queue_max),
+    })
+
+
+def inject_stalls(app, stall: float, every: float) -> list:
+    """Remplace _write_batch par une version qui bloque pendant les fenêtres de panne."""
+    original = app._write_batch
+    started = time.monotonic()
+    stalls = []
+
+    def slow_write_batch(*args, **kwargs):
+        elapsed = time.monotonic() - started
+        phase = elapsed % every
+        if elapsed >= every and phase < stall:
+            stalls.append(stall - phase)
+            time.sleep(stall - phase)
+        return original(*args, **kwargs)
+
+    app._write_batch = slow_write_batch
+    return stalls
+
+
+def publish(args, published: list) -> None:
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client()
+    client.connect(args.broker, args.port, 60)
+    client.loop_start()
+    interval = 1 / args.rate
+    deadline = time.monotonic() + args.duration
+    next_at = time.monotonic()
+    seq = 0
+    while time.monotonic() < deadline:
+        client.publish('kelo/faults/F001/telemetry', json.dumps({'nid': 'F001', 'temperature': 20.0, 'seq': seq}))
+        seq += 1
+        next_at += interval
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    published.append(seq)
+    time.sleep(1)
+    client.loop_stop()
+    client.disconnect()
+
+
+def stored_rows(app) -> int:
+    return sum(conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] for conn in app._read_sources())
+
+
+def main() -> int:
+    args = parse_args()
+    configure_env(args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import asyncio
+    import app
+    from aiohttp import web
+
+    app.init_db()
+    stalls = inject_stalls(app, args.stall, args.stall_every)
+    app.start_db_writer()
+
+    async def run() -> dict:
+        runner = web.AppRunner(await app.init_app())
+        await runner.setup()
+        await asyncio.sleep(1)
+        published: list = []
+        publisher = threading.Thread(target=publish, args=(args, published))
+        publisher.start()
+        while publisher.is_alive():
+            await asyncio.sleep(0.2)
+        drain_deadline = time.monotonic() + args.drain_timeout
+        while (app._ingest_queue.qsize() or app._spill_pending) and time.monotonic() < drain_deadline:
+            await asyncio.sleep(0.2)
+        await asyncio.sleep(0.5)
+        await runner.cleanup()
+        return {"published": published[0]}
+
+    report = asyncio.run(run())
+    app.stop_db_writer()
+    report.update({
+        "policy": args.policy,
+        "received": int(app.MQTT_MESSAGES.total()),
+        "stored": stored_rows(app),
+        "dropped": int(app.INGEST_DROPPED.total()),
+        "spilled": int(app.INGEST_SPILLED.total()),
+        "replayed": int(app.INGEST_REPLAYED.total()),
+        "mqtt_connects": int(app.MQTT_CONNECTS.total()),
+        "stalls": len(stalls),
+        "longest_stall_s": round(max(stalls, default=0), 2),
+        "keepalive_s": args.keepalive,
+    })
+    checks = {
+        "session_survived": report["mqtt_connects"] == 1,
+        "all_received": report["received"] == report["published"],
+        "accounted": report["stored"] + report["dropped"] == report["received"],
+    }
+    report["checks"] = checks
+    print(json.dumps(report, indent=2), flush=True)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Bus local entre le superviseur et les workers du collector (socket Unix).
+
+Messages Python sérialisés avec pickle, préfixés par leur longueur. Le socket n'est
+accessible qu'à l'utilisateur qui exécute le collector : seuls des processus de
+confiance y échangent des messages.
+"""
+import asyncio
+import os
+import pickle
+import struct
+
+_HEADER = struct.Struct('!I')
+
+
+def encode_message(message) -> bytes:
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(len(data)) + data
+
+
+async def read_message(reader: asyncio.StreamReader):
+    size, = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return pickle.loads(await reader.readexactly(size))
+
+
+class BusServer:
+    """Côté superviseur : reçoit les messages des workers et diffuse à tous.
+
+    `on_message(message)` est appelé dans la boucle pour chaque message reçu ;
+    `welcome()` fournit le premier message envoyé à un worker qui se connecte.
+    pause_reading() suspend la lecture des workers (leurs envois s'accumulent dans le
+    socket) jusqu'à resume_reading().
+    """
+
+    def __init__(self, path: str, on_message, welcome=None):
+        self.path = path
+        self.on_message = on_message
+        self.welcome = welcome
+        self.writers: set[asyncio.StreamWriter] = set()
+        self._server = None
+        self._reading = asyncio.Event()
+        self._reading.set()
+
+    def pause_reading(self) -> None:
+        self._reading.clear()
+
+    def resume_reading(self) -> None:
+        self._reading.set()
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o600)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if self.welcome is not None:
+            writer.write(encode_message(self.welcome()))
+        self.writers.add(writer)
+        try:
+            while True:
+                await self._reading.wait()
+                self.on_message(await read_message(reader))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Worker parti, ou arrêt du superviseur (tâche annulée en fin de boucle).
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    def broadcast(self, message) -> None:
+        """Envoie un message à tous les workers ; il n'est sérialisé qu'une fois."""
+        frame = encode_message(message)
+        for writer in list(self.writers):
+            if writer.is_closing():
+                self.writers.discard(writer)
+                continue
+            writer.write(frame)
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for writer in list(self.writers):
+            writer.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class BusClient:
+    """Côté worker : envoie des messages au superviseur et reçoit ses diffusions."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def connect(self, attempts: int = 50, delay: float = 0.1):
+        """Se connecte (le superviseur peut être en cours de démarrage) et retourne le message d'accueil."""
+        for attempt in range(attempts):
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(delay)
+        return await read_message(self._reader)
+
+    def send(self, message) -> None:
+        self._writer.write(encode_message(message))
+
+    def congested(self) -> bool:
+        """Vrai si les envois dépassent le seuil haut du tampon (le superviseur ne lit plus)."""
+        transport = self._writer.transport
+        return transport.get_write_buffer_size() > transport.get_write_buffer_limits()[1]
+
+    async def drain(self) -> None:
+        await self._writer.drain()
+
+    async def receive(self):
+        """Prochain message diffusé ; lève asyncio.IncompleteReadError si le bus est fermé."""
+        return await read_message(self._reader)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
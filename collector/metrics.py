@@ -0,0 +1,210 @@
+import bisect
+import math
+import threading
+
+# Bornes par défaut des histogrammes de latence (secondes).
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Value:
+    """Compteur ou jauge : une valeur protégée par un verrou (incréments depuis plusieurs threads)."""
+
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        # Un compteur par borne, plus le dépassement (+Inf) ; cumulés à l'export seulement.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Metric:
+    """Famille de séries d'un même nom ; sans étiquettes, elle s'utilise directement."""
+
+    def __init__(self, name: str, help_text: str, kind: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = _Histogram(self.buckets) if self.kind == 'histogram' else _Value()
+                    self._children[values] = child
+        return child
+
+    def inc(self, amount: float = 1) -> None:
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._default.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def total(self) -> float:
+        """Somme des valeurs de toutes les séries (compteurs et jauges)."""
+        return sum(child.value for child in list(self._children.values()))
+
+    def state(self) -> list:
+        """Valeurs de toutes les séries, à transmettre à un autre processus (voir load)."""
+        state = []
+        for values, child in list(self._children.items()):
+            if self.kind != 'histogram':
+                state.append((values, child.value))
+                continue
+            with child._lock:
+                state.append((values, (list(child.counts), child.sum)))
+        return state
+
+    def load(self, state: list) -> None:
+        """Remplace les valeurs des séries par celles d'un autre processus (résultat de state())."""
+        for values, value in state:
+            child = self.labels(*values)
+            if self.kind != 'histogram':
+                child.set(value)
+                continue
+            with child._lock:
+                child.counts, child.sum = list(value[0]), value[1]
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            if self.kind != 'histogram':
+                yield self.name, _format_labels(self.labelnames, values), child.value
+                continue
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f'{self.name}_bucket', _format_labels(self.labelnames, values, le), cumulative
+            labels = _format_labels(self.labelnames, values)
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+class CallbackMetric:
+    """Série calculée à l'export : `fn()` renvoie une valeur, ou {valeurs d'étiquettes: valeur}."""
+
+    def __init__(self, name: str, help_text: str, kind: str, fn, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def state(self):
+        return self.fn()
+
+    def load(self, state) -> None:
+        self.fn = lambda: state
+
+    def samples(self):
+        result = self.fn()
+        if not self.labelnames:
+            yield self.name, '', result
+            return
+        for values, value in result.items():
+            if not isinstance(values, tuple):
+                values = (values,)
+            yield self.name, _format_labels(self.labelnames, values), value
+
+
+class Registry:
+    """Registre de métriques exporté au format texte de Prometheus (version 0.0.4)."""
+
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrique déjà enregistrée : {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Metric:
+        return self._register(Metric(name, help_text, 'counter', labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple = ()) -> Metric:
+        return self._register(Metric(name, help_text, 'gauge', labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Metric:
+        return self._register(Metric(name, help_text, 'histogram', labelnames, buckets))
+
+    def callback(self, name: str, help_text: str, kind: str, fn, labelnames: tuple = ()) -> CallbackMetric:
+        return self._register(CallbackMetric(name, help_text, kind, fn, labelnames))
+
+    def state(self, names) -> dict:
+        """État des métriques `names`, pour les exposer depuis un autre processus (load)."""
+        return {name: self._metrics[name].state() for name in names}
+
+    def load(self, state: dict) -> None:
+        for name, values in state.items():
+            self._metrics[name].load(values)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
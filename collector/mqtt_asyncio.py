@@ -0,0 +1,128 @@
+import asyncio
+
+import paho.mqtt.client as mqtt
+
+
+class AsyncioMqtt:
+    """Pilote un client paho depuis la boucle asyncio, sans thread ni loop_forever.
+
+    Le socket du client est surveillé par les lecteurs/écrivains de la boucle ; les
+    messages lus pendant une itération sont regroupés et transmis d'un seul appel à
+    `on_batch(messages)`, dans le thread de la boucle. pause_reading() cesse de lire le
+    socket (le broker retient alors les messages) jusqu'à resume_reading().
+    """
+
+    def __init__(self, client: mqtt.Client, on_batch, read_burst: int = 256, retry_seconds: float = 5):
+        self.client = client
+        self.on_batch = on_batch
+        self.read_burst = read_burst
+        self.retry_seconds = retry_seconds
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._sock = None
+        self._pending: list = []
+        self._flush_scheduled = False
+        self._paused = False
+        self._disconnected = asyncio.Event()
+        self.counters = {"messages": 0, "batches": 0, "reconnects": 0}
+        client.on_message = self._on_message
+
+    def _on_message(self, client, userdata, msg) -> None:
+        self._pending.append(msg)
+        if not self._flush_scheduled:
+            # Traité à l'itération suivante, avec tout ce qui aura été lu d'ici là.
+            self._flush_scheduled = True
+            self.loop.call_soon(self._flush)
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        messages, self._pending = self._pending, []
+        self.counters["messages"] += len(messages)
+        self.counters["batches"] += 1
+        try:
+            self.on_batch(messages)
+        except Exception as err:
+            print(f"Erreur de traitement MQTT : {err}", flush=True)
+
+    def _on_readable(self) -> None:
+        # loop_read ne lit qu'un paquet quand rien n'est en vol : on enchaîne les lectures
+        # tant qu'elles produisent des messages, pour vider le socket en une itération.
+        for _ in range(self.read_burst):
+            before = len(self._pending)
+            if self.client.loop_read() != mqtt.MQTT_ERR_SUCCESS or self._sock is None:
+                break
+            if len(self._pending) == before:
+                break
+
+    def pause_reading(self) -> None:
+        if not self._paused and self._sock is not None:
+            self.loop.remove_reader(self._sock)
+        self._paused = True
+
+    def resume_reading(self) -> None:
+        if self._paused and self._sock is not None:
+            self.loop.add_reader(self._sock, self._on_readable)
+        self._paused = False
+
+    def _on_socket_close(self, client, userdata, sock) -> None:
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        self._sock = None
+        self._disconnected.set()
+
+    def _on_register_write(self, client, userdata, sock) -> None:
+        self.loop.add_writer(sock, client.loop_write)
+
+    def _on_unregister_write(self, client, userdata, sock) -> None:
+        self.loop.remove_writer(sock)
+
+    def _watch_socket(self) -> None:
+        # Branché après connect() : celui-ci s'exécute hors de la boucle.
+        client = self.client
+        self._sock = client.socket()
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_register_write
+        client.on_socket_unregister_write = self._on_unregister_write
+        if not self._paused:
+            self.loop.add_reader(self._sock, self._on_readable)
+        if client.want_write():
+            self.loop.add_writer(self._sock, client.loop_write)
+
+    def _unwatch_socket(self) -> None:
+        client = self.client
+        client.on_socket_close = None
+        client.on_socket_register_write = None
+        client.on_socket_unregister_write = None
+        if self._sock is not None:
+            self.loop.remove_reader(self._sock)
+            self.loop.remove_writer(self._sock)
+            self._sock = None
+
+    async def run(self, host: str, port: int, keepalive: int = 60) -> None:
+        """Connecte, reconnecte après coupure et entretient la session (ping) jusqu'à annulation."""
+        self.loop = asyncio.get_running_loop()
+        while True:
+            try:
+                # Résolution DNS et connexion TCP bloquantes : exécutées hors de la boucle.
+                await self.loop.run_in_executor(None, self.client.connect, host, port, keepalive)
+            except Exception as err:
+                print(f"MQTT connection error to {host}:{port}: {err}", flush=True)
+                await asyncio.sleep(self.retry_seconds)
+                continue
+            self._disconnected.clear()
+            self._watch_socket()
+            try:
+                while not self._disconnected.is_set():
+                    try:
+                        await asyncio.wait_for(self._disconnected.wait(), 1)
+                    except asyncio.TimeoutError:
+                        pass
+                    if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                        break
+            finally:
+                self._unwatch_socket()
+                try:
+                    self.client.disconnect()
+                except Exception:
+                    pass
+            self.counters["reconnects"] += 1
+            await asyncio.sleep(self.retry_seconds)
@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+
+
+class CachedBody:
+    """Corps de réponse déjà encodé, avec sa version gzip éventuelle."""
+
+    __slots__ = ('seq', 'created', 'body', 'gzip_body')
+
+    def __init__(self, seq: int, body: bytes, gzip_body: bytes | None = None):
+        self.seq = seq
+        self.created = time.monotonic()
+        self.body = body
+        self.gzip_body = gzip_body
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzip_body or b'')
+
+
+class ResponseCache:
+    """Cache LRU de réponses encodées, invalidé par le numéro de séquence d'ingestion.
+
+    Une entrée reste valable tant qu'aucune écriture n'a eu lieu depuis son calcul (même
+    `seq`) et qu'elle a moins de `ttl` secondes ; `max_stale` secondes de tolérance
+    permettent de la servir malgré des écritures, pour absorber les sondages simultanés
+    de plusieurs tableaux de bord. La taille totale est bornée à `max_bytes` octets.
+    À utiliser uniquement depuis la boucle asyncio.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 60, max_stale: float = 0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.size = 0
+        self._entries: OrderedDict = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, seq: int) -> CachedBody | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        age = time.monotonic() - entry.created
+        if age >= self.max_stale and (entry.seq != seq or age >= self.ttl):
+            self.counters["stale"] += 1
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return entry
+
+    def put(self, key, seq: int, body: bytes, gzip_body: bytes | None = None) -> CachedBody:
+        entry = CachedBody(seq, body, gzip_body)
+        if key in self._entries:
+            self._remove(key)
+        if entry.size > self.max_bytes:
+            return entry
+        self._entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+            self.counters["evictions"] += 1
+        return entry
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+    def _remove(self, key) -> None:
+        self.size -= self._entries.pop(key).size
@@ -0,0 +1,130 @@
+import threading
+import time
+
+
+class RollingStats:
+    """Agrégats glissants (count/min/max/moyenne) par nid, découpés en tranches de temps.
+
+    Chaque nid possède un anneau de tranches de `bucket_seconds` secondes ; une tranche
+    est réutilisée dès qu'elle sort de la fenêtre. Une lecture parcourt au plus
+    window_seconds / bucket_seconds tranches, quel que soit le volume de mesures.
+
+    snapshot() ne compte que les tranches entièrement dans la fenêtre : la plus ancienne,
+    coupée par la limite, est laissée à l'appelant (intervalle donné par edge()).
+    """
+
+    def __init__(self, fields: tuple, window_seconds: float = 86400, bucket_seconds: float = 300):
+        self.fields = tuple(fields)
+        self.window_ms = int(window_seconds * 1000)
+        self.bucket_ms = int(bucket_seconds * 1000)
+        # Une tranche de plus que la fenêtre : la plus ancienne peut être partiellement couverte.
+        self.size = -(-self.window_ms // self.bucket_ms) + 1
+        self._rings: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, nid: str, bucket_no: int) -> list | None:
+        """Tranche `bucket_no` du nid ; None si son emplacement sert déjà à une tranche plus récente."""
+        ring = self._rings.get(nid)
+        if ring is None:
+            ring = self._rings[nid] = [None] * self.size
+        slot = bucket_no % self.size
+        bucket = ring[slot]
+        if bucket is not None and bucket[0] > bucket_no:
+            # Mesure arrivée en retard (rejeu), déjà hors de la fenêtre.
+            return None
+        if bucket is None or bucket[0] != bucket_no:
+            # [numéro de tranche, nb de mesures, puis (count, somme, min, max) par champ]
+            bucket = [bucket_no, 0] + [0, 0.0, None, None] * len(self.fields)
+            ring[slot] = bucket
+        return bucket
+
+    def add(self, nid: str, ts_ms: int, values: tuple) -> None:
+        """Ajoute une mesure ; `values` suit l'ordre de `fields` (None si absente)."""
+        with self._lock:
+            bucket = self._bucket(nid, ts_ms // self.bucket_ms)
+            if bucket is None:
+                return
+            bucket[1] += 1
+            for i, value in enumerate(values):
+                if value is None:
+                    continue
+                base = 2 + i * 4
+                bucket[base] += 1
+                bucket[base + 1] += value
+                if bucket[base + 2] is None or value < bucket[base + 2]:
+                    bucket[base + 2] = value
+                if bucket[base + 3] is None or value > bucket[base + 3]:
+                    bucket[base + 3] = value
+
+    def merge_bucket(self, nid: str, bucket_no: int, count: int, partials: tuple) -> None:
+        """Cumule dans une tranche des agrégats déjà calculés (démarrage à chaud).
+
+        `partials` contient (count, somme, min, max) pour chaque champ, à plat.
+        """
+        with self._lock:
+            bucket = self._bucket(nid, bucket_no)
+            if bucket is None:
+                return
+            bucket[1] += count
+            for i in range(len(self.fields)):
+                f_count, f_sum, f_min, f_max = partials[i * 4:i * 4 + 4]
+                if not f_count:
+                    continue
+                base = 2 + i * 4
+                bucket[base] += f_count
+                bucket[base + 1] += f_sum
+                if bucket[base + 2] is None or f_min < bucket[base + 2]:
+                    bucket[base + 2] = f_min
+                if bucket[base + 3] is None or f_max > bucket[base + 3]:
+                    bucket[base + 3] = f_max
+
+    def snapshot(self, nid: str, now_ms: int | None = None) -> tuple[int, list[tuple]]:
+        """Retourne (nb de mesures, [(count, somme, min, max) par champ]) des tranches de la fenêtre.
+
+        Les mesures de edge(now_ms) n'y figurent pas.
+        """
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        first_bucket = -(-(now_ms - self.window_ms) // self.bucket_ms)
+        count = 0
+        totals = [[0, 0.0, None, None] for _ in self.fields]
+        with self._lock:
+            ring = self._rings.get(nid)
+            if ring is None:
+                return 0, [tuple(total) for total in totals]
+            live = False
+            for bucket in ring:
+                if bucket is None or bucket[0] < first_bucket:
+                    continue
+                live = True
+                count += bucket[1]
+                for i, total in enumerate(totals):
+                    f_count, f_sum, f_min, f_max = bucket[2 + i * 4:6 + i * 4]
+                    if not f_count:
+                        continue
+                    total[0] += f_count
+                    total[1] += f_sum
+                    if total[2] is None or f_min < total[2]:
+                        total[2] = f_min
+                    if total[3] is None or f_max > total[3]:
+                        total[3] = f_max
+            if not live:
+                del self._rings[nid]
+        return count, [tuple(total) for total in totals]
+
+    def edge(self, now_ms: int) -> tuple[int, int]:
+        """Intervalle [début de la fenêtre, début de la première tranche complète) absent de snapshot()."""
+        cutoff = now_ms - self.window_ms
+        return cutoff, -(-cutoff // self.bucket_ms) * self.bucket_ms
+
+    def prune(self, now_ms: int | None = None) -> None:
+        """Oublie les nids sans aucune mesure dans la fenêtre."""
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        first_bucket = (now_ms - self.window_ms) // self.bucket_ms
+        with self._lock:
+            for nid in [
+                nid for nid, ring in self._rings.items()
+                if all(bucket is None or bucket[0] < first_bucket for bucket in ring)
+            ]:
+                del self._rings[nid]
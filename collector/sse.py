@@ -0,0 +1,199 @@
+import asyncio
+import json
+from collections import deque
+
+SLOW_CONSUMER_POLICIES = ('drop_oldest', 'disconnect')
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    """Filtre de topic MQTT : `+` remplace un niveau, `#` (en dernier) tous les suivants."""
+    pattern_levels = pattern.split('/')
+    topic_levels = topic.split('/')
+    for i, level in enumerate(pattern_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]):
+            return False
+    return len(pattern_levels) == len(topic_levels)
+
+
+def encode_event(data, event_id: int | None = None) -> bytes:
+    """Encode une trame SSE une seule fois, quel que soit le nombre de clients.
+
+    `event_id` (id de la mesure en base) est repris par EventSource dans Last-Event-ID.
+    """
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n".encode()
+
+
+def encode_raw_event(nid: str, topic: str, raw: bytes, event_id: int | None = None) -> bytes | None:
+    """Trame {nid, topic, data} où `data` est le payload JSON reçu, inséré tel quel.
+
+    Retourne None si le payload tient sur plusieurs lignes (interdit dans un champ data:).
+    """
+    raw = raw.strip()
+    if b'\n' in raw or b'\r' in raw:
+        return None
+    prefix = b"id: %d\n" % event_id if event_id is not None else b""
+    head = json.dumps({"nid": nid, "topic": topic})[:-1].encode()
+    return b"%sdata: %s, \"data\": %s}\n\n" % (prefix, head, raw)
+
+
+class SseClient:
+    """File d'envoi bornée d'un client SSE, vidée par la tâche qui sert sa requête."""
+
+    __slots__ = ('frames', 'wakeup', 'closed', 'dropped', 'nids', 'topics', 'last_id')
+
+    def __init__(self, nids: frozenset = frozenset(), topics: tuple = ()):
+        self.frames: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+        # Filtres d'abonnement ; aucun filtre = tous les événements.
+        self.nids = nids
+        self.topics = topics
+        # Dernier id envoyé : les trames déjà rejouées ne sont pas renvoyées.
+        self.last_id = 0
+
+    def accepts(self, nid: str | None, topic: str | None) -> bool:
+        if not self.nids and not self.topics:
+            return True
+        if nid in self.nids:
+            return True
+        return topic is not None and any(topic_matches(pattern, topic) for pattern in self.topics)
+
+    def drain(self) -> bytes:
+        """Retire toutes les trames en attente, concaténées pour un seul write()."""
+        self.wakeup.clear()
+        parts = []
+        for event_id, frame in self.frames:
+            if event_id is None:
+                parts.append(frame)
+            elif event_id > self.last_id:
+                parts.append(frame)
+                self.last_id = event_id
+        self.frames.clear()
+        return b''.join(parts)
+
+
+class SseHub:
+    """Diffusion SSE : chaque événement est placé dans la file de chaque client, sans attente.
+
+    Un client trop lent voit ses trames les plus anciennes supprimées (drop_oldest) ou
+    est déconnecté (disconnect) lorsque sa file atteint `max_queue` trames. À utiliser
+    uniquement depuis la boucle asyncio.
+
+    Les clients abonnés à des nids sont indexés par nid, ceux abonnés à des filtres de
+    topic par filtre : un événement ne parcourt que les clients intéressés.
+
+    Les `replay_size` derniers événements identifiés sont conservés déjà encodés pour
+    être rejoués aux clients qui se reconnectent avec Last-Event-ID.
+    """
+
+    def __init__(self, max_queue: int = 256, policy: str = 'drop_oldest', replay_size: int = 1000):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Politique SSE inconnue : {policy}")
+        self.max_queue = max_queue
+        self.policy = policy
+        self.clients: set[SseClient] = set()
+        self._unfiltered: set[SseClient] = set()
+        self._by_nid: dict[str, set[SseClient]] = {}
+        self._by_topic: dict[str, set[SseClient]] = {}
+        # topic -> filtres correspondants, recalculé quand les filtres changent.
+        self._topic_cache: dict[str, tuple[str, ...]] = {}
+        # (id, nid, topic, trame) des derniers événements, par id croissant.
+        self.ring: deque = deque(maxlen=replay_size)
+        self.counters = {
+            "events": 0,
+            "frames_queued": 0,
+            "frames_dropped": 0,
+            "slow_disconnects": 0,
+            "write_errors": 0,
+            "replays_from_ring": 0,
+            "replays_from_db": 0,
+        }
+
+    def register(self, nids=(), topics=()) -> SseClient:
+        client = SseClient(frozenset(nids), tuple(topics))
+        self.clients.add(client)
+        if not client.nids and not client.topics:
+            self._unfiltered.add(client)
+        for nid in client.nids:
+            self._by_nid.setdefault(nid, set()).add(client)
+        for pattern in client.topics:
+            if pattern not in self._by_topic:
+                self._topic_cache.clear()
+            self._by_topic.setdefault(pattern, set()).add(client)
+        return client
+
+    def unregister(self, client: SseClient) -> None:
+        self.clients.discard(client)
+        self._unfiltered.discard(client)
+        for nid in client.nids:
+            subscribers = self._by_nid.get(nid)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self._by_nid[nid]
+        for pattern in client.topics:
+            subscribers = self._by_topic.get(pattern)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self._by_topic[pattern]
+                    self._topic_cache.clear()
+
+    def subscribers(self, nid: str | None = None, topic: str | None = None) -> set[SseClient]:
+        """Clients intéressés par un événement de ce nid et de ce topic."""
+        targets = set(self._unfiltered)
+        if nid is not None and nid in self._by_nid:
+            targets |= self._by_nid[nid]
+        if topic is not None and self._by_topic:
+            patterns = self._topic_cache.get(topic)
+            if patterns is None:
+                patterns = tuple(p for p in self._by_topic if topic_matches(p, topic))
+                if len(self._topic_cache) > 10000:
+                    self._topic_cache.clear()
+                self._topic_cache[topic] = patterns
+            for pattern in patterns:
+                targets |= self._by_topic[pattern]
+        return targets
+
+    def publish(
+        self, frame: bytes, nid: str | None = None, topic: str | None = None, event_id: int | None = None
+    ) -> None:
+        self.counters["events"] += 1
+        if event_id is not None:
+            self.ring.append((event_id, nid, topic, frame))
+        for client in self.subscribers(nid, topic):
+            self._enqueue(client, (event_id, frame))
+
+    def replay(self, client: SseClient, last_id: int) -> tuple[list[bytes], bool]:
+        """Trames de l'anneau postérieures à `last_id` qui concernent ce client.
+
+        Le booléen indique si l'anneau couvre tout l'écart ; sinon les événements
+        manquants doivent être relus en base avant de rejouer l'anneau.
+        """
+        complete = bool(self.ring) and self.ring[0][0] <= last_id + 1
+        frames = [
+            frame for event_id, nid, topic, frame in self.ring
+            if event_id > last_id and client.accepts(nid, topic)
+        ]
+        return frames, complete
+
+    def _enqueue(self, client: SseClient, frame: tuple) -> None:
+        if client.closed:
+            return
+        if len(client.frames) >= self.max_queue:
+            if self.policy == 'disconnect':
+                client.closed = True
+                client.frames.clear()
+                client.wakeup.set()
+                self.counters["slow_disconnects"] += 1
+                return
+            client.frames.popleft()
+            client.dropped += 1
+            self.counters["frames_dropped"] += 1
+        client.frames.append(frame)
+        client.wakeup.set()
+        self.counters["frames_queued"] += 1
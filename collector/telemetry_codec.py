@@ -0,0 +1,101 @@
+"""Encodage binaire compact des mesures d'un nid, alternative au JSON sur MQTT.
+
+Un message binaire commence par l'octet 0xCB, qu'un payload JSON ne peut pas porter en
+tête : le collector reconnaît le format au premier octet, sans configuration. Structure
+(gros-boutiste) :
+
+    uint8       0xCB
+    uint8       version du format (1)
+    uint8       longueur du nid, suivie du nid en UTF-8
+    int64       horodatage en microsecondes depuis l'epoch (UTC)
+    4 x int16   temperature, humidite, vibration, tension en centièmes
+
+La valeur -32768 marque un champ absent. Un message fait 22 octets pour un nid de
+3 caractères, contre environ 150 en JSON ; les mesures sont arrondies au centième,
+comme celles du simulateur.
+
+Ce module est présent à l'identique dans collector/ et simulateur/ (images séparées).
+"""
+import struct
+from datetime import datetime, timedelta
+
+MARKER = b'\xcb'
+VERSION = 1
+FIELDS = ('temperature', 'humidite', 'vibration', 'tension')
+
+_HEADER = struct.Struct('!cBB')
+_BODY = struct.Struct('!q4h')
+_MISSING = -32768
+_MISSING_TIME = -2 ** 63
+_EPOCH = datetime(1970, 1, 1)
+_KEYS = frozenset(('nid', 'horodatage', *FIELDS))
+# Dernière seconde formatée : les messages d'une même seconde ne refont pas la conversion.
+_last_second = (None, '')
+
+
+def is_binary(payload: bytes) -> bool:
+    return payload[:1] == MARKER
+
+
+def _centi(data: dict, field: str) -> int:
+    value = data.get(field)
+    if value is None:
+        return _MISSING
+    scaled = round(value * 100)
+    if not -32767 <= scaled <= 32767:
+        raise ValueError(f"{field}={value} hors de la plage du format binaire")
+    return scaled
+
+
+def encode(data: dict) -> bytes:
+    """Encode une mesure ; ValueError si elle n'est pas représentable (champ inconnu, valeur hors plage)."""
+    extra = data.keys() - _KEYS
+    if extra:
+        raise ValueError(f"Champs non pris en charge par le format binaire : {', '.join(sorted(extra))}")
+    nid = str(data.get('nid', '')).encode()
+    if len(nid) > 255:
+        raise ValueError("nid trop long pour le format binaire")
+    horodatage = data.get('horodatage')
+    if horodatage is None:
+        micros = _MISSING_TIME
+    else:
+        parsed = datetime.fromisoformat(horodatage.removesuffix('Z'))
+        if parsed.tzinfo is not None:
+            raise ValueError("horodatage attendu en UTC avec le suffixe Z")
+        micros = (parsed - _EPOCH) // timedelta(microseconds=1)
+    return (
+        _HEADER.pack(MARKER, VERSION, len(nid)) + nid
+        + _BODY.pack(micros, *(_centi(data, field) for field in FIELDS))
+    )
+
+
+def _format_time(micros: int) -> str:
+    """Même texte que datetime.isoformat() + 'Z' (sans fraction si elle est nulle)."""
+    global _last_second
+    seconds, fraction = divmod(micros, 1_000_000)
+    cached, prefix = _last_second
+    if seconds != cached:
+        prefix = (_EPOCH + timedelta(seconds=seconds)).isoformat()
+        _last_second = (seconds, prefix)
+    return f"{prefix}.{fraction:06d}Z" if fraction else prefix + "Z"
+
+
+def decode(payload: bytes) -> dict:
+    """Décode un message binaire en dictionnaire identique au JSON du simulateur ; ValueError s'il est invalide."""
+    try:
+        marker, version, size = _HEADER.unpack_from(payload)
+        if marker != MARKER or version != VERSION:
+            raise ValueError(f"Format binaire inconnu (version {version})")
+        end = _HEADER.size + size
+        if len(payload) != end + _BODY.size:
+            raise ValueError("Longueur de message binaire invalide")
+        micros, *values = _BODY.unpack_from(payload, end)
+        data = {"nid": payload[_HEADER.size:end].decode()}
+    except (struct.error, UnicodeDecodeError) as err:
+        raise ValueError(f"Message binaire invalide : {err}") from None
+    for field, value in zip(FIELDS, values):
+        if value != _MISSING:
+            data[field] = value / 100
+    if micros != _MISSING_TIME:
+        data["horodatage"] = _format_time(micros)
+    return data
@@ -0,0 +1,278 @@
+"""Livraison des alertes Telegram en arrière-plan, hors du chemin de publication et des requêtes HTTP.
+
+submit() dépose le message dans la file bornée de chaque chat et rend la main aussitôt.
+Un thread par chat livre ses messages dans l'ordre, sur une session HTTP partagée dont
+les connexions keep-alive sont réutilisées : un chat lent ou injoignable ne retarde pas
+les autres. Les échecs transitoires (réseau, 429, 5xx) sont retentés avec un délai
+exponentiel ; le `retry_after` d'un 429 Telegram est respecté. File pleine : le message
+le plus ancien est abandonné et compté dans `dropped`.
+
+Regroupement : les alertes arrivées pendant `coalesce_window` secondes, ou tant que le
+budget d'envoi du chat (`chat_rate` messages par minute) n'autorise pas d'appel, partent
+en un seul message récapitulatif, découpé à la limite de taille de Telegram. Mille
+dépassements simultanés donnent ainsi une poignée d'appels par chat.
+
+    python alerting.py --alerts 1000 --chats 3 --latency 0.2
+"""
+import logging
+import queue
+import random
+import threading
+import time
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Longueur maximale d'un message Telegram.
+MESSAGE_LIMIT = 4096
+
+
+def build_digest(alerts: list[tuple], limit: int = MESSAGE_LIMIT) -> list[str]:
+    """Messages récapitulatifs d'un lot d'alertes (message, catégorie, résumé).
+
+    Une alerte seule est envoyée telle quelle. Sinon, les alertes d'une même catégorie
+    tiennent sur une ligne (« Température élevée (812) : A12 38.2 °C, ... »), les autres
+    ont une ligne chacune ; les doublons sont comptés (×n). Un lot trop long est découpé
+    en plusieurs messages de moins de `limit` caractères, numérotés.
+    """
+    if len(alerts) == 1:
+        return [alerts[0][0][:limit]]
+    groups: dict[str | None, Counter] = {}
+    for message, group, summary in alerts:
+        groups.setdefault(group, Counter())[summary if group else message] += 1
+    # Place réservée à l'en-tête (« 🚨 1000 alertes (12/12) : »).
+    room = limit - 40
+    lines = []
+    for group, counts in groups.items():
+        entries = [entry if n == 1 else f"{entry} (×{n})" for entry, n in counts.items()]
+        if group is None:
+            lines += entries
+            continue
+        prefix, items = f"{group} ({sum(counts.values())}) : ", []
+        for entry in entries:
+            if items and len(prefix) + sum(len(item) + 2 for item in items) + len(entry) > room:
+                lines.append(prefix + ", ".join(items))
+                prefix, items = f"{group} (suite) : ", []
+            items.append(entry)
+        lines.append(prefix + ", ".join(items))
+
+    chunks, chunk, size = [], [], 0
+    for line in lines:
+        line = line[:room]
+        if chunk and size + len(line) + 1 > room:
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line) + 1
+    chunks.append(chunk)
+    total = len(alerts)
+    if len(chunks) == 1:
+        return [f"🚨 {total} alertes :\n" + "\n".join(chunks[0])]
+    return [
+        f"🚨 {total} alertes ({i}/{len(chunks)}) :\n" + "\n".join(chunk)
+        for i, chunk in enumerate(chunks, 1)
+    ]
+
+
+class AlertDispatcher:
+    """File d'alertes par chat, vidée par un thread par chat ; les threads démarrent au premier envoi.
+
+    `chat_rate` : appels par minute et par chat (0 : sans limite) ; `coalesce_window` :
+    attente minimale (s) pour regrouper les alertes en un récapitulatif (0 : seules les
+    alertes déjà en file sont regroupées).
+    """
+
+    def __init__(self, api_url: str, chat_ids, queue_size: int = 1000, max_retries: int = 3,
+                 backoff: float = 1.0, max_backoff: float = 30.0, timeout: float = 10.0,
+                 coalesce_window: float = 0.0, chat_rate: float = 0.0):
+        self.api_url = api_url
+        self.chat_ids = list(chat_ids)
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.coalesce_window = coalesce_window
+        self.min_interval = 60 / chat_rate if chat_rate > 0 else 0.0
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._queues: dict[str, queue.Queue] = {}
+        self._session = None
+
+    def _start(self) -> None:
+        session = requests.Session()
+        # Une connexion gardée ouverte par chat livré en parallèle.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, len(self.chat_ids)))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self._session = session
+        for chat_id in self.chat_ids:
+            self._queues[chat_id] = queue.Queue(self.queue_size)
+            threading.Thread(target=self._run, args=(chat_id,), name=f"telegram-{chat_id}", daemon=True).start()
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[name] += n
+
+    def submit(self, message: str, group: str | None = None, summary: str | None = None) -> None:
+        """Met l'alerte en file pour chaque chat, sans attendre sa livraison.
+
+        `group` (catégorie) et `summary` (texte court) servent aux récapitulatifs ; sans
+        catégorie, le message complet y figure.
+        """
+        alert = (message, group if summary else None, summary)
+        with self._lock:
+            if self._session is None:
+                self._start()
+            for chat_id, chat_queue in self._queues.items():
+                try:
+                    chat_queue.put_nowait(alert)
+                except queue.Full:
+                    # File pleine : l'alerte la plus ancienne cède la place à la nouvelle. Le
+                    # thread du chat peut avoir vidé la file entre-temps : la place est alors
+                    # libre (submit() est le seul producteur, sous self._lock).
+                    try:
+                        chat_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+                    else:
+                        chat_queue.task_done()
+                        self.counts['dropped'] += 1
+                        logger.warning(f"File d'alertes Telegram pleine pour {chat_id}, alerte la plus ancienne abandonnée")
+                    chat_queue.put_nowait(alert)
+            self.counts['queued'] += 1
+
+    def _collect(self, chat_queue: queue.Queue, first: tuple, deadline: float) -> list[tuple]:
+        """`first` et les messages arrivés avant `deadline` (au plus une file pleine)."""
+        batch = [first]
+        while len(batch) < self.queue_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(chat_queue.get(timeout=remaining) if remaining > 0 else chat_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, chat_id: str) -> None:
+        chat_queue = self._queues[chat_id]
+        next_send = 0.0
+        while True:
+            # Fenêtre de regroupement : au moins coalesce_window après le premier message,
+            # et jusqu'à ce que le budget d'envoi du chat autorise un appel.
+            first = chat_queue.get()
+            batch = self._collect(chat_queue, first, max(time.monotonic() + self.coalesce_window, next_send))
+            try:
+                if len(batch) > 1:
+                    self._count('coalesced', len(batch))
+                for text in build_digest(batch):
+                    delay = next_send - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    try:
+                        self._deliver(chat_id, text)
+                    except Exception as e:
+                        self._count('failed')
+                        logger.error(f"Erreur Telegram pour {chat_id} : {e}")
+                    next_send = time.monotonic() + self.min_interval
+            finally:
+                for _ in batch:
+                    chat_queue.task_done()
+
+    def _retry_delay(self, attempt: int, response) -> float:
+        if response is not None and response.status_code == 429:
+            try:
+                return float(response.json()['parameters']['retry_after'])
+            except (ValueError, KeyError, TypeError):
+                pass
+        # Délai exponentiel avec aléa : les chats en échec ne retentent pas tous ensemble.
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _deliver(self, chat_id: str, message: str) -> None:
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self._session.post(
+                    self.api_url, json={"chat_id": chat_id, "text": message}, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = e
+            else:
+                if response.ok:
+                    self._count('sent')
+                    logger.info(f"Alerte Telegram envoyée à {chat_id} : {message.splitlines()[0]}")
+                    return
+                error = f"HTTP {response.status_code} {response.text[:200]}"
+                if response.status_code != 429 and response.status_code < 500:
+                    # Requête refusée (chat inconnu, token invalide) : inutile de retenter.
+                    break
+            if attempt == self.max_retries:
+                break
+            delay = self._retry_delay(attempt, response)
+            self._count('retries')
+            logger.warning(f"Alerte Telegram pour {chat_id} en échec ({error}), nouvel essai dans {delay:.1f}s")
+            time.sleep(delay)
+        self._count('failed')
+        logger.error(f"Erreur Telegram pour {chat_id} : {error}")
+
+    def pending(self) -> int:
+        return sum(chat_queue.unfinished_tasks for chat_queue in self._queues.values())
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Attend la livraison (ou l'abandon) des alertes en file ; False si le délai expire."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            "chats": len(self.chat_ids),
+            "pending": self.pending(),
+            **{name: counts.get(name, 0) for name in ('queued', 'sent', 'failed', 'retries', 'dropped', 'coalesced')},
+        }
+
+
+def main() -> None:
+    import argparse
+    import telegram_standin
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--alerts', type=int, default=1000, help="nombre d'alertes simultanées")
+    parser.add_argument('--chats', type=int, default=3, help="nombre de chats destinataires")
+    parser.add_argument('--latency', type=float, default=0.2, help="latence du serveur Telegram local (s)")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="part des réponses 502 du serveur local")
+    parser.add_argument('--window', type=float, default=2.0, help="fenêtre de regroupement (s)")
+    parser.add_argument('--rate', type=float, default=20, help="appels par minute et par chat (0 : sans limite)")
+    args = parser.parse_args()
+
+    server, state = telegram_standin.start(latency=args.latency, fail_rate=args.fail_rate)
+    url = f"http://127.0.0.1:{server.server_port}/botTEST/sendMessage"
+    chat_ids = [str(1000 + i) for i in range(args.chats)]
+    dispatcher = AlertDispatcher(url, chat_ids, backoff=0.05, coalesce_window=args.window, chat_rate=args.rate)
+
+    started = time.perf_counter()
+    for i in range(args.alerts):
+        nid, value = f"SIM{i:05d}", 32 + i % 700 / 100
+        dispatcher.submit(f"Alerte nid {nid} : température élevée ({value:.2f} °C)",
+                          "Température élevée", f"{nid} {value:.2f} °C")
+    submitted = time.perf_counter() - started
+    dispatcher.flush()
+    delivered = time.perf_counter() - started
+    server.shutdown()
+
+    sequential = args.alerts * args.chats * args.latency
+    print(f"submit : {submitted / args.alerts * 1e6:.1f} µs/alerte (appelant bloqué {submitted * 1000:.1f} ms au total)")
+    print(f"livraison : {delivered:.2f}s, {state.requests} appels API pour {args.alerts * args.chats} alertes"
+          f" (envoi séquentiel sans file : ~{sequential:.2f}s bloquants)")
+    print(f"dispatcher : {dispatcher.stats()}")
+    print(f"serveur : {state.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""Génération des mesures simulées, par lots de nids : une mesure par nid à chaque pas.
+
+Profils :
+- uniform : tirages indépendants dans les plages historiques du simulateur ;
+- realistic : séries temporelles par nid, avec cycle journalier de température (pic
+  vers 15 h UTC) et bruit corrélé dans le temps, humidité inversement liée à la
+  température, décharge de la batterie (`tension`, remplacée une fois vide) et pics
+  de vibration occasionnels.
+
+NumPy est utilisé s'il est installé (tirages et calculs vectorisés sur tous les nids),
+sinon la bibliothèque standard ; GENERATOR_BACKEND=python force cette dernière. Une
+graine (`seed`) rend les séries reproductibles pour un même backend et une même suite
+d'instants `t` passés à step().
+
+    python generators.py --nids 10000 --steps 20 --profile realistic
+"""
+import math
+import os
+import random
+import threading
+import time
+
+GENERATOR_BACKEND = os.getenv('GENERATOR_BACKEND', 'auto')
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if GENERATOR_BACKEND == 'python':
+    np = None
+elif GENERATOR_BACKEND == 'numpy' and np is None:
+    raise ImportError("GENERATOR_BACKEND=numpy mais le module numpy n'est pas installé")
+
+BACKEND = 'numpy' if np is not None else 'python'
+
+PROFILES = ('uniform', 'realistic')
+FIELDS = ('temperature', 'humidite', 'vibration', 'tension')
+
+# Plages du profil uniform (celles du simulateur d'origine).
+UNIFORM_RANGES = {
+    'temperature': (20.0, 38.0),
+    'humidite': (55.0, 98.0),
+    'vibration': (2.6, 6.0),
+    'tension': (0.0, 4.9),
+}
+
+# Profil realistic. Temps de corrélation (s) et écart-type des bruits ; couplage de
+# l'humidité à l'écart de température (% par °C) ; décharge de la batterie (V par heure).
+TEMP_TAU, TEMP_SIGMA = 1800.0, 0.6
+HUM_TAU, HUM_SIGMA = 3600.0, 2.0
+HUM_TEMP_COUPLING = -2.5
+TEMP_PEAK_HOUR = 15.0
+VIB_SIGMA = 0.15
+VIB_SPIKE_PROBABILITY = 0.01
+VIB_SPIKE_RANGE = (1.5, 3.0)
+BATTERY_FULL_RANGE = (4.3, 4.9)
+BATTERY_DRAIN_RANGE = (0.002, 0.02)
+BATTERY_EMPTY = 0.3
+BATTERY_SIGMA = 0.01
+
+
+def _diurnal(t: float) -> float:
+    hour = (t % 86400) / 3600
+    return math.cos(2 * math.pi * (hour - TEMP_PEAK_HOUR) / 24)
+
+
+class SeriesGenerator:
+    """Séries de mesures de plusieurs nids ; step() produit une mesure par nid.
+
+    `time_scale` accélère le temps simulé (60 : une journée de cycle en 24 minutes).
+    """
+
+    def __init__(self, nids, profile: str = 'uniform', seed: int | None = None, time_scale: float = 1.0):
+        if profile not in PROFILES:
+            raise ValueError(f"Profil de génération inconnu : {profile} ({', '.join(PROFILES)})")
+        self.nids = list(nids)
+        self.profile = profile
+        self.time_scale = time_scale
+        self._lock = threading.Lock()
+        self._origin = None
+        self._last = None
+        self._rng = np.random.default_rng(seed) if np is not None else random.Random(seed)
+        if profile == 'realistic':
+            self._init_realistic()
+
+    def _uniform(self, low: float, high: float):
+        n = len(self.nids)
+        if np is not None:
+            return self._rng.uniform(low, high, n)
+        return [self._rng.uniform(low, high) for _ in range(n)]
+
+    def _init_realistic(self) -> None:
+        n = len(self.nids)
+        self._temp_base = self._uniform(24.0, 29.0)
+        self._temp_amplitude = self._uniform(3.0, 6.0)
+        self._hum_base = self._uniform(70.0, 85.0)
+        self._vib_base = self._uniform(2.8, 3.6)
+        self._battery = self._uniform(*BATTERY_FULL_RANGE)
+        self._drain = self._uniform(*BATTERY_DRAIN_RANGE)
+        self._temp_noise = np.zeros(n) if np is not None else [0.0] * n
+        self._hum_noise = np.zeros(n) if np is not None else [0.0] * n
+
+    def _model_time(self, t: float) -> float:
+        if self._origin is None:
+            self._origin = t
+        return self._origin + (t - self._origin) * self.time_scale
+
+    def step(self, t: float | None = None) -> dict[str, list[float]]:
+        """Mesures de tous les nids à l'instant `t` (secondes epoch, maintenant par défaut).
+
+        Retourne une colonne par champ (FIELDS), dans l'ordre de `nids`, arrondie au centième.
+        """
+        with self._lock:
+            model_t = self._model_time(time.time() if t is None else t)
+            # Premier pas : dt infini, les bruits sont tirés dans leur loi stationnaire.
+            dt = math.inf if self._last is None else max(0.0, model_t - self._last)
+            self._last = model_t
+            if self.profile == 'uniform':
+                columns = {field: self._uniform(*UNIFORM_RANGES[field]) for field in FIELDS}
+            elif np is not None:
+                columns = self._realistic_numpy(model_t, dt)
+            else:
+                columns = self._realistic_python(model_t, dt)
+        if np is not None:
+            return {field: np.round(values, 2).tolist() for field, values in columns.items()}
+        return {field: [round(value, 2) for value in values] for field, values in columns.items()}
+
+    def _realistic_numpy(self, t: float, dt: float) -> dict:
+        rng, n = self._rng, len(self.nids)
+        rho_t, rho_h = math.exp(-dt / TEMP_TAU), math.exp(-dt / HUM_TAU)
+        self._temp_noise = rho_t * self._temp_noise + TEMP_SIGMA * math.sqrt(1 - rho_t ** 2) * rng.standard_normal(n)
+        self._hum_noise = rho_h * self._hum_noise + HUM_SIGMA * math.sqrt(1 - rho_h ** 2) * rng.standard_normal(n)
+        temperature = self._temp_base + self._temp_amplitude * _diurnal(t) + self._temp_noise
+        humidite = self._hum_base + HUM_TEMP_COUPLING * (temperature - self._temp_base) + self._hum_noise
+
+        if dt != math.inf:
+            self._battery = self._battery - self._drain * dt / 3600
+        empty = self._battery < BATTERY_EMPTY
+        if empty.any():
+            self._battery[empty] = rng.uniform(*BATTERY_FULL_RANGE, int(empty.sum()))
+        tension = self._battery + BATTERY_SIGMA * rng.standard_normal(n)
+
+        spikes = (rng.random(n) < VIB_SPIKE_PROBABILITY) * rng.uniform(*VIB_SPIKE_RANGE, n)
+        vibration = self._vib_base + VIB_SIGMA * rng.standard_normal(n) + spikes
+        return {
+            'temperature': temperature,
+            'humidite': np.clip(humidite, 0.0, 100.0),
+            'vibration': np.clip(vibration, 0.0, None),
+            'tension': np.clip(tension, 0.0, None),
+        }
+
+    def _realistic_python(self, t: float, dt: float) -> dict:
+        rng = self._rng
+        rho_t, rho_h = math.exp(-dt / TEMP_TAU), math.exp(-dt / HUM_TAU)
+        sigma_t, sigma_h = TEMP_SIGMA * math.sqrt(1 - rho_t ** 2), HUM_SIGMA * math.sqrt(1 - rho_h ** 2)
+        diurnal = _diurnal(t)
+        columns = {field: [] for field in FIELDS}
+        for i in range(len(self.nids)):
+            self._temp_noise[i] = rho_t * self._temp_noise[i] + sigma_t * rng.gauss(0.0, 1.0)
+            self._hum_noise[i] = rho_h * self._hum_noise[i] + sigma_h * rng.gauss(0.0, 1.0)
+            deviation = self._temp_amplitude[i] * diurnal + self._temp_noise[i]
+            humidite = self._hum_base[i] + HUM_TEMP_COUPLING * deviation + self._hum_noise[i]
+
+            if dt != math.inf:
+                self._battery[i] -= self._drain[i] * dt / 3600
+            if self._battery[i] < BATTERY_EMPTY:
+                self._battery[i] = rng.uniform(*BATTERY_FULL_RANGE)
+            tension = self._battery[i] + BATTERY_SIGMA * rng.gauss(0.0, 1.0)
+
+            spike = rng.uniform(*VIB_SPIKE_RANGE) if rng.random() < VIB_SPIKE_PROBABILITY else 0.0
+            vibration = self._vib_base[i] + VIB_SIGMA * rng.gauss(0.0, 1.0) + spike
+            columns['temperature'].append(self._temp_base[i] + deviation)
+            columns['humidite'].append(min(100.0, max(0.0, humidite)))
+            columns['vibration'].append(max(0.0, vibration))
+            columns['tension'].append(max(0.0, tension))
+        return columns
+
+
+def _legacy(nids: list, steps: int) -> None:
+    for _ in range(steps):
+        for _nid in nids:
+            {field: round(random.uniform(*UNIFORM_RANGES[field]), 2) for field in FIELDS}
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nids', type=int, default=10000, help="nombre de nids par pas")
+    parser.add_argument('--steps', type=int, default=20, help="nombre de pas générés")
+    parser.add_argument('--profile', default='realistic', choices=PROFILES)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    nids = [f"SIM{i:05d}" for i in range(args.nids)]
+    generator = SeriesGenerator(nids, args.profile, args.seed)
+    started = time.perf_counter()
+    for k in range(args.steps):
+        generator.step(k * 60.0)
+    elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    _legacy(nids, args.steps)
+    legacy = time.perf_counter() - started
+    readings = args.nids * args.steps
+    print(f"backend {BACKEND}, profil {args.profile} : {elapsed / readings * 1e6:.3f} µs/mesure")
+    print(f"random.uniform par appel : {legacy / readings * 1e6:.3f} µs/mesure")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""Rejeu sur MQTT de mesures enregistrées par le collector, à vitesse accélérée.
+
+Sources :
+- une base results.db du collector, avec ses partitions journalières (répertoire
+  `partitions/` voisin, ou --partitions) : lues ensemble dans l'ordre des horodatages
+  de réception (colonne ts, ou received_at pour les bases d'avant la migration) ;
+- un export NDJSON de /collector/export (horodatage : received_at), ou un fichier d'une
+  mesure JSON par ligne (horodatage : champ `horodatage`, topic construit depuis le nid).
+
+Les lignes sont lues au fil de l'eau (curseurs SQLite, lecture ligne à ligne), jamais
+chargées en entier. Les écarts entre messages d'origine sont respectés, divisés par la
+vitesse (`max` : sans attente). Le payload JSON conservé (DB_KEEP_PAYLOAD) est republié
+tel quel ; sinon il est reconstitué depuis les colonnes.
+
+    python replay.py data/results.db --speed 10 --broker 127.0.0.1:1883
+"""
+import heapq
+import json
+import os
+import re
+import sqlite3
+import time
+import urllib.request
+from collections import Counter
+from datetime import datetime, timezone
+
+METRIC_FIELDS = ('temperature', 'humidite', 'vibration', 'tension')
+_PARTITION_FILE = re.compile(r'^results-(\d{8})\.db$')
+_SQLITE_MAGIC = b'SQLite format 3\x00'
+_FETCH_ROWS = 1000
+_PAYLOAD_COLUMNS = ('nid', *METRIC_FIELDS, 'horodatage', 'extra', 'payload')
+# Millisecondes epoch d'un received_at ISO (même calcul que la migration du collector).
+_RECEIVED_MS = "CAST(ROUND((julianday(rtrim(received_at, 'Z')) - 2440587.5) * 86400000) AS INTEGER)"
+
+
+def parse_speed(value) -> float:
+    """Facteur de vitesse : nombre (1, 10, 0.5...) ou `max` (0 : sans attente)."""
+    if str(value).strip().lower() == 'max':
+        return 0.0
+    speed = float(value)
+    if speed <= 0:
+        raise ValueError(f"Vitesse de rejeu invalide : {value} (nombre positif ou max)")
+    return speed
+
+
+def _epoch(iso: str) -> float:
+    return datetime.fromisoformat(iso.removesuffix('Z')).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _row_payload(row: sqlite3.Row) -> str:
+    """Payload d'une ligne : JSON d'origine s'il est conservé, sinon reconstitué comme /collector/results."""
+    columns = row.keys()
+    if "payload" in columns and row["payload"] is not None:
+        return row["payload"]
+    payload = {}
+    for name in ("nid", *METRIC_FIELDS, "horodatage"):
+        if name in columns and row[name] is not None:
+            payload[name] = row[name]
+    if "extra" in columns and row["extra"] is not None:
+        payload.update(json.loads(row["extra"]))
+    return json.dumps(payload)
+
+
+def _iter_db_file(path: str, nid: str | None):
+    # Chemin échappé : « ? », « # » ou « % » dans un nom de fichier ne sont pas lus comme de l'URI.
+    conn = sqlite3.connect('file:' + urllib.request.pathname2url(os.path.abspath(path)) + '?mode=ro', uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        # Bases du collector d'origine (sans ts ni colonnes typées) ou en cours de migration
+        # (ts encore NULL) : l'instant de réception est alors calculé depuis received_at,
+        # comme le fait la migration.
+        table = {row["name"] for row in conn.execute("PRAGMA table_info(results)")}
+        received_ms = _RECEIVED_MS if "received_at" in table else "NULL"
+        t = f"COALESCE(ts, {received_ms})" if "ts" in table else received_ms
+        columns = [name for name in _PAYLOAD_COLUMNS if name in table]
+        sql = f"SELECT {t} AS t, topic, {', '.join(columns)} FROM results"
+        params: tuple = ()
+        if nid:
+            sql += " WHERE nid = ?"
+            params = (nid,)
+        cursor = conn.execute(sql + " ORDER BY t, id", params)
+        while True:
+            rows = cursor.fetchmany(_FETCH_ROWS)
+            if not rows:
+                break
+            for row in rows:
+                if row["t"] is not None:
+                    yield row["t"] / 1000, row["topic"], _row_payload(row)
+    finally:
+        conn.close()
+
+
+def db_sources(path: str, partitions_dir: str | None = None) -> list[str]:
+    """La base principale et ses partitions journalières, si elles existent."""
+    partitions_dir = partitions_dir or os.path.join(os.path.dirname(path) or '.', 'partitions')
+    sources = [path]
+    if os.path.isdir(partitions_dir):
+        sources += [
+            os.path.join(partitions_dir, name)
+            for name in sorted(os.listdir(partitions_dir)) if _PARTITION_FILE.match(name)
+        ]
+    return sources
+
+
+def iter_db(path: str, nid: str | None = None, partitions_dir: str | None = None):
+    """(t, topic, payload) de la base et de ses partitions, fusionnés par ordre de réception."""
+    files = [_iter_db_file(source, nid) for source in db_sources(path, partitions_dir)]
+    return heapq.merge(*files, key=lambda reading: reading[0])
+
+
+def iter_ndjson(path: str, nid: str | None = None, build_topic=None):
+    """(t, topic, payload) d'un export NDJSON, ou d'un fichier d'une mesure par ligne."""
+    with open(path, encoding='utf-8') as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "payload" in record and "received_at" in record:
+                reading, topic, at = record["payload"], record.get("topic"), record["received_at"]
+                payload = json.dumps(reading)
+            else:
+                reading, topic, at = record, None, record.get("horodatage")
+                payload = line
+            reading_nid = reading.get("nid") if isinstance(reading, dict) else None
+            if nid and reading_nid != nid:
+                continue
+            if at is None:
+                continue
+            if topic is None:
+                if build_topic is None or reading_nid is None:
+                    continue
+                topic = build_topic(reading_nid)
+            yield _epoch(at), topic, payload
+
+
+def open_source(path: str, nid: str | None = None, build_topic=None, partitions_dir: str | None = None):
+    """Itérateur de mesures selon le type du fichier (base SQLite reconnue à son en-tête)."""
+    with open(path, 'rb') as fh:
+        is_sqlite = fh.read(len(_SQLITE_MAGIC)) == _SQLITE_MAGIC
+    return iter_db(path, nid, partitions_dir) if is_sqlite else iter_ndjson(path, nid, build_topic)
+
+
+class ReplayReport:
+    """Débits par topic et retard sur le calendrier d'origine, par fenêtre de rapport."""
+
+    def __init__(self, top: int = 10):
+        self.top = top
+        self.sent = 0
+        self.errors = 0
+        self.started = self.window_started = time.monotonic()
+        self.window = Counter()
+        self.max_lag = 0.0
+        self.position = None
+
+    def record(self, topic: str, t: float, lag: float, published: bool = True) -> None:
+        if not published:
+            self.errors += 1
+            return
+        self.sent += 1
+        self.window[topic] += 1
+        self.position = t
+        self.max_lag = max(self.max_lag, lag)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        elapsed = max(now - self.window_started, 1e-9)
+        report = {
+            "sent": self.sent,
+            "errors": self.errors,
+            "rate": round(sum(self.window.values()) / elapsed, 1),
+            "topics": len(self.window),
+            "topic_rates": {topic: round(count / elapsed, 2) for topic, count in self.window.most_common(self.top)},
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "position": datetime.fromtimestamp(self.position, timezone.utc).isoformat() if self.position else None,
+        }
+        self.window = Counter()
+        self.window_started = now
+        self.max_lag = 0.0
+        return report
+
+
+def replay(readings, publish, speed: float, report: ReplayReport, report_interval: float = 10, log=print) -> dict:
+    """Republie les mesures en respectant leurs écarts divisés par `speed` (0 : sans attente).
+
+    Les échéances sont calculées depuis le premier message : le temps de publication ne
+    s'accumule pas. `publish(topic, payload)` retourne False si le message est refusé ; il
+    peut bloquer pour limiter la file d'envoi.
+    """
+    origin = wall_origin = None
+    next_report = time.monotonic() + report_interval
+    for t, topic, payload in readings:
+        now = time.monotonic()
+        lag = 0.0
+        if speed:
+            if origin is None:
+                origin, wall_origin = t, now
+            # Horodatages non monotones (exports, horloges des nids) : publication immédiate.
+            due = wall_origin + max(0.0, t - origin) / speed
+            if due - now > 0.001:
+                time.sleep(due - now)
+            else:
+                lag = max(0.0, now - due)
+        report.record(topic, t, lag, publish(topic, payload))
+        if now >= next_report:
+            log(f"Rejeu : {json.dumps(report.snapshot())}")
+            next_report = now + report_interval
+    final = report.snapshot()
+    final["total_rate"] = round(report.sent / max(time.monotonic() - report.started, 1e-9), 1)
+    log(f"Rejeu terminé : {json.dumps(final)}")
+    return final
+
+
+class Publisher:
+    """Publication paho bornée : toutes les `window` publications, attend l'écriture de la dernière."""
+
+    def __init__(self, client, qos: int = 0, window: int = 1000):
+        self.client = client
+        self.qos = qos
+        self.window = window
+        self._count = 0
+
+    def __call__(self, topic: str, payload) -> bool:
+        info = self.client.publish(topic, payload, qos=self.qos)
+        if info.rc != 0:
+            # Connexion perdue : paho se reconnecte, le message est compté en erreur.
+            return False
+        self._count += 1
+        if self._count % self.window == 0:
+            info.wait_for_publish()
+        return True
+
+
+def main() -> None:
+    import argparse
+    import paho.mqtt.client as mqtt
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help="results.db du collector ou fichier NDJSON")
+    parser.add_argument('--speed', default='1', help="facteur de vitesse (1, 10...) ou max")
+    parser.add_argument('--broker', default='127.0.0.1:1883', help="broker MQTT host:port")
+    parser.add_argument('--nid', help="ne rejoue que ce nid")
+    parser.add_argument('--partitions', help="répertoire des partitions (partitions/ à côté de la base par défaut)")
+    parser.add_argument('--topic-template', default='kelo/nid/{nid}/telemetry',
+                        help="topic des mesures sans topic d'origine (fichier d'une mesure par ligne)")
+    parser.add_argument('--qos', type=int, default=0)
+    parser.add_argument('--report-interval', type=float, default=10)
+    args = parser.parse_args()
+
+    host, _, port = args.broker.rpartition(':')
+    client = mqtt.Client()
+    client.connect(host, int(port), 60)
+    client.loop_start()
+    try:
+        readings = open_source(
+            args.source, args.nid, lambda nid: args.topic_template.format(nid=nid), args.partitions)
+        replay(readings, Publisher(client, args.qos), parse_speed(args.speed), ReplayReport(), args.report_interval)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+import asyncio
+import heapq
 import json
 import random
 import time
@@ -5,12 +7,16 @@ import os
 import logging
 from datetime import datetime
 import threading
-import requests
+import zlib
 import paho.mqtt.client as mqtt
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from auth_routes import auth_bp
 from auth import init_auth_db
+import telemetry_codec
+from generators import FIELDS, PROFILES, SeriesGenerator
+import replay
+from alerting import AlertDispatcher
 
 # ============================
 # LOGGING
@@ -40,6 +46,35 @@ DEFAULT_MQTT_TOPIC_TEMPLATE = 'kelo/nid/{nid}/telemetry'
 MQTT_TOPIC_TEMPLATE = os.getenv('MQTT_TOPIC_TEMPLATE', DEFAULT_MQTT_TOPIC_TEMPLATE)
 SIMULATED_NID = os.getenv('SIMULATED_NID', 'A12')
 PUBLISH_INTERVAL = float(os.getenv('PUBLISH_INTERVAL', 5))
+# Format des messages MQTT : json (défaut) ou binary (voir telemetry_codec.py).
+TELEMETRY_ENCODING = os.getenv('TELEMETRY_ENCODING', 'json').strip().lower()
+if TELEMETRY_ENCODING not in ('json', 'binary'):
+    raise ValueError(f"TELEMETRY_ENCODING invalide : {TELEMETRY_ENCODING} (json ou binary)")
+# Générateur de mesures (voir generators.py) : uniform (tirages indépendants) ou realistic
+# (séries temporelles) ; GENERATOR_SEED rend les séries reproductibles.
+GENERATOR_PROFILE = os.getenv('GENERATOR_PROFILE', 'uniform').strip().lower()
+if GENERATOR_PROFILE not in PROFILES:
+    raise ValueError(f"GENERATOR_PROFILE invalide : {GENERATOR_PROFILE} ({', '.join(PROFILES)})")
+GENERATOR_SEED = int(os.getenv('GENERATOR_SEED')) if os.getenv('GENERATOR_SEED') else None
+GENERATOR_TIME_SCALE = float(os.getenv('GENERATOR_TIME_SCALE', 1))
+# Mode rejeu : republie les mesures d'une base results.db du collector ou d'un export NDJSON
+# (REPLAY_SOURCE), écarts d'origine divisés par REPLAY_SPEED (max : sans attente).
+REPLAY_SOURCE = os.getenv('REPLAY_SOURCE', '').strip()
+REPLAY_SPEED = replay.parse_speed(os.getenv('REPLAY_SPEED', '1'))
+REPLAY_NID = os.getenv('REPLAY_NID', '').strip() or None
+REPLAY_REPORT_INTERVAL = float(os.getenv('REPLAY_REPORT_INTERVAL', 10))
+# Mode charge : LOAD_NIDS nids simulés (0 : un seul nid, SIMULATED_NID) publiant ensemble
+# LOAD_RATE messages/s, chacun à intervalle régulier décalé d'un aléa de ±LOAD_JITTER période.
+LOAD_NIDS = int(os.getenv('LOAD_NIDS', 0))
+LOAD_RATE = float(os.getenv('LOAD_RATE', 100))
+LOAD_JITTER = float(os.getenv('LOAD_JITTER', 0.1))
+LOAD_NID_PREFIX = os.getenv('LOAD_NID_PREFIX', 'SIM')
+# QoS 1 : la latence d'acquittement (PUBACK) du broker est mesurée.
+LOAD_QOS = int(os.getenv('LOAD_QOS', 1))
+LOAD_MAX_INFLIGHT = int(os.getenv('LOAD_MAX_INFLIGHT', 1000))
+LOAD_DURATION = float(os.getenv('LOAD_DURATION', 0))
+LOAD_REPORT_INTERVAL = float(os.getenv('LOAD_REPORT_INTERVAL', 10))
+LOAD_ALERTS = os.getenv('LOAD_ALERTS', 'false').lower() in {'1', 'true', 'yes', 'on'}
 TEMPERATURE_ALERT_THRESHOLD = float(os.getenv('TEMPERATURE_ALERT_THRESHOLD', 32))
 HUMIDITE_ALERT_THRESHOLD = float(os.getenv('HUMIDITE_ALERT_THRESHOLD', 95))
 VIBRATION_ALERT_THRESHOLD = float(os.getenv('VIBRATION_ALERT_THRESHOLD', 5))
@@ -53,39 +88,39 @@ for raw_value in (os.getenv('TELEGRAM_CHAT_IDS', ''), TELEGRAM_CHAT_ID):
         if chat_id and chat_id not in TELEGRAM_CHAT_IDS:
             TELEGRAM_CHAT_IDS.append(chat_id)
 TELEGRAM_ALERTS_ENABLED = os.getenv('TELEGRAM_ALERTS_ENABLED', 'true').lower() in {'1', 'true', 'yes', 'on'}
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE', 'https://api.telegram.org').rstrip('/')
+# Livraison en arrière-plan : file bornée par chat, nouveaux essais avec délai exponentiel.
+ALERT_QUEUE_SIZE = int(os.getenv('ALERT_QUEUE_SIZE', 1000))
+ALERT_MAX_RETRIES = int(os.getenv('ALERT_MAX_RETRIES', 3))
+ALERT_RETRY_BACKOFF = float(os.getenv('ALERT_RETRY_BACKOFF', 1))
+ALERT_HTTP_TIMEOUT = float(os.getenv('ALERT_HTTP_TIMEOUT', 10))
+# Regroupement en récapitulatifs : fenêtre (s) et budget d'appels par minute et par chat.
+ALERT_COALESCE_WINDOW = float(os.getenv('ALERT_COALESCE_WINDOW', 2))
+ALERT_CHAT_RATE = float(os.getenv('ALERT_CHAT_RATE', 20))
 
 # ============================
 # TELEGRAM BOT
 # ============================
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage" if TELEGRAM_BOT_TOKEN else None
+TELEGRAM_API_URL = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/sendMessage" if TELEGRAM_BOT_TOKEN else None
 last_alert_sent_at = {}
 ALERT_COOLDOWN_SECONDS = float(os.getenv('ALERT_COOLDOWN_SECONDS', 60))
+alert_dispatcher = AlertDispatcher(
+    TELEGRAM_API_URL, TELEGRAM_CHAT_IDS, ALERT_QUEUE_SIZE, ALERT_MAX_RETRIES, ALERT_RETRY_BACKOFF,
+    timeout=ALERT_HTTP_TIMEOUT, coalesce_window=ALERT_COALESCE_WINDOW, chat_rate=ALERT_CHAT_RATE,
+)
 
-def send_telegram_alert(message):
-    """Envoie une alerte Telegram"""
+def send_telegram_alert(message, group=None, summary=None):
+    """Met une alerte Telegram en file ; elle est livrée en arrière-plan à chaque chat, regroupée
+    avec les alertes voisines (catégorie `group`, texte court `summary`)"""
     if not TELEGRAM_ALERTS_ENABLED:
-        return
+        return False
 
     if not TELEGRAM_API_URL or not TELEGRAM_CHAT_IDS:
         logger.warning("Telegram non configuré, alerte ignorée")
-        return
-
-    has_error = False
-    for chat_id in TELEGRAM_CHAT_IDS:
-        try:
-            response = requests.post(
-                TELEGRAM_API_URL,
-                json={"chat_id": chat_id, "text": message},
-                timeout=10
-            )
-            response.raise_for_status()
-            logger.info(f"Alerte Telegram envoyée à {chat_id} : {message}")
-        except Exception as e:
-            has_error = True
-            logger.error(f"Erreur Telegram pour {chat_id} : {e}")
+        return False
 
-    if has_error:
-        logger.warning("Une ou plusieurs alertes Telegram n'ont pas pu être envoyées")
+    alert_dispatcher.submit(message, group, summary)
+    return True
 
 def should_send_alert(alert_key):
     now = time.time()
@@ -140,18 +175,43 @@ def connect_mqtt():
 # ============================
 # GENERATION DES DONNÉES
 # ============================
-def generate_data(nid):
-    data = {
-        "nid": nid,
-        "temperature": round(random.uniform(20.0, 38.0), 2),
-        "humidite": round(random.uniform(55.0, 98.0), 2),
-        "vibration": round(random.uniform(2.6, 6.0), 2),
-        "tension": round(random.uniform(0.0, 4.9), 2),
-        "horodatage": datetime.utcnow().isoformat() + "Z"
-    }
-    check_alerts(data)
+def create_generator(nids, seed=GENERATOR_SEED):
+    return SeriesGenerator(nids, GENERATOR_PROFILE, seed, GENERATOR_TIME_SCALE)
+
+# Une série par nid pour generate_data ; le mode charge génère tous ses nids par lots.
+nid_generators = {}
+
+def build_data(nid, columns, i):
+    """Mesure du nid à partir de la colonne i d'un pas de générateur."""
+    data = {"nid": nid}
+    for field in FIELDS:
+        data[field] = columns[field][i]
+    data["horodatage"] = datetime.utcnow().isoformat() + "Z"
+    return data
+
+def generate_data(nid, alerts=True):
+    generator = nid_generators.get(nid)
+    if generator is None:
+        # Graine propre à chaque nid, dérivée de GENERATOR_SEED.
+        seed = None if GENERATOR_SEED is None else GENERATOR_SEED + zlib.crc32(nid.encode())
+        generator = nid_generators.setdefault(nid, create_generator([nid], seed))
+    data = build_data(nid, generator.step(), 0)
+    if alerts:
+        check_alerts(data)
     return data
 
+def encode_payload(data):
+    """Payload MQTT d'une mesure, au format TELEMETRY_ENCODING.
+
+    Une mesure que le format binaire ne sait pas représenter est publiée en JSON.
+    """
+    if TELEMETRY_ENCODING == 'binary':
+        try:
+            return telemetry_codec.encode(data)
+        except ValueError as e:
+            logger.warning(f" Mesure publiée en JSON : {e}")
+    return json.dumps(data)
+
 # ============================
 # ALERTES
 # ============================
@@ -160,22 +220,26 @@ def check_alerts(data):
 
     if data["temperature"] > TEMPERATURE_ALERT_THRESHOLD and should_send_alert((nid, "temperature")):
         send_telegram_alert(
-            f"Alerte nid {nid} : température élevée ({data['temperature']} °C)"
+            f"Alerte nid {nid} : température élevée ({data['temperature']} °C)",
+            "Température élevée", f"{nid} {data['temperature']} °C",
         )
 
     if data["humidite"] > HUMIDITE_ALERT_THRESHOLD and should_send_alert((nid, "humidite")):
         send_telegram_alert(
-            f"Alerte nid {nid} : humidité élevée ({data['humidite']} %)"
+            f"Alerte nid {nid} : humidité élevée ({data['humidite']} %)",
+            "Humidité élevée", f"{nid} {data['humidite']} %",
         )
 
     if data["vibration"] > VIBRATION_ALERT_THRESHOLD and should_send_alert((nid, "vibration")):
         send_telegram_alert(
-            f"Alerte nid {nid} : vibration élevée ({data['vibration']})"
+            f"Alerte nid {nid} : vibration élevée ({data['vibration']})",
+            "Vibration élevée", f"{nid} {data['vibration']}",
         )
 
     if data["tension"] < TENSION_ALERT_THRESHOLD and should_send_alert((nid, "tension")):
         send_telegram_alert(
-            f"Alerte nid {nid} : tension faible ({data['tension']} V)"
+            f"Alerte nid {nid} : tension faible ({data['tension']} V)",
+            "Tension faible", f"{nid} {data['tension']} V",
         )
 
 # ============================
@@ -183,20 +247,216 @@ def check_alerts(data):
 # ============================
 def publish_loop():
     global mqtt_client
-    mqtt_client = connect_mqtt()
+    if REPLAY_SOURCE:
+        replay_loop()
+        return
+    if LOAD_NIDS > 0:
+        asyncio.run(load_loop())
+        return
 
+    mqtt_client = connect_mqtt()
+    # Échéances calculées depuis le départ : la durée de publication ne décale pas la cadence.
+    next_at = time.monotonic()
     while True:
         data = generate_data(SIMULATED_NID)
         topic = build_topic(SIMULATED_NID)
 
         try:
-            mqtt_client.publish(topic, json.dumps(data))
+            mqtt_client.publish(topic, encode_payload(data))
             logger.info(f" MQTT publié sur {topic}")
         except Exception as e:
             logger.error(f" Erreur MQTT : {e}")
             mqtt_client = connect_mqtt()
 
-        time.sleep(PUBLISH_INTERVAL)
+        next_at += PUBLISH_INTERVAL
+        now = time.monotonic()
+        if next_at < now - PUBLISH_INTERVAL:
+            # Longue coupure (reconnexion) : les échéances manquées ne sont pas rattrapées en rafale.
+            next_at = now
+        time.sleep(max(0, next_at - now))
+
+# ============================
+# MODE REJEU
+# ============================
+def replay_loop():
+    global mqtt_client
+    mqtt_client = connect_mqtt()
+    publisher = replay.Publisher(mqtt_client)
+
+    def publish(topic, payload):
+        # Payload d'origine republié tel quel, sauf en format binaire.
+        if TELEMETRY_ENCODING == 'binary':
+            payload = encode_payload(json.loads(payload))
+        return publisher(topic, payload)
+
+    speed = 'max' if not REPLAY_SPEED else f"x{REPLAY_SPEED:g}"
+    logger.info(f" Rejeu de {REPLAY_SOURCE} ({speed})")
+    readings = replay.open_source(REPLAY_SOURCE, REPLAY_NID, build_topic)
+    replay.replay(readings, publish, REPLAY_SPEED, replay.ReplayReport(), REPLAY_REPORT_INTERVAL, log=logger.info)
+    mqtt_client.loop_stop()
+    mqtt_client.disconnect()
+
+# ============================
+# MODE CHARGE (MULTI-NIDS)
+# ============================
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+class LoadReport:
+    """Compteurs du mode charge, partagés entre la boucle de publication et le thread réseau paho."""
+
+    # Publication sans acquittement au-delà de ce délai : comptée comme perdue.
+    ACK_TIMEOUT = 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.early_acks = {}
+        self.sent = 0
+        self.acked = 0
+        self.errors = 0
+        self.unacked = 0
+        self.started = self.window_started = time.monotonic()
+        self.window_sent = 0
+        self.ack_latencies = []
+        self.lags = []
+        self.last = {}
+
+    def on_publish(self, client, userdata, mid):
+        now = time.perf_counter()
+        with self.lock:
+            sent_at = self.pending.pop(mid, None)
+            if sent_at is None:
+                self.early_acks[mid] = now
+            else:
+                self._acked(now - sent_at)
+
+    def _acked(self, latency):
+        self.acked += 1
+        self.ack_latencies.append(latency)
+
+    def publish(self, client, topic, payload, lag):
+        """Publie un message ; `lag` est le retard sur son échéance (s)."""
+        # publish() est appelé hors du verrou : paho appelle on_publish en tenant ses propres
+        # verrous. Un acquittement arrivé avant l'enregistrement de l'envoi est mis de côté.
+        sent_at = time.perf_counter()
+        info = client.publish(topic, payload, qos=LOAD_QOS)
+        with self.lock:
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.errors += 1
+                return
+            acked_at = self.early_acks.pop(info.mid, None)
+            if acked_at is None:
+                self.pending[info.mid] = sent_at
+            else:
+                self._acked(acked_at - sent_at)
+            self.sent += 1
+            self.window_sent += 1
+            self.lags.append(lag)
+
+    def snapshot(self, ended=None):
+        """Bilan depuis le précédent : débit atteint, latences d'acquittement et retard d'échéance."""
+        now = ended or time.monotonic()
+        expired_before = time.perf_counter() - self.ACK_TIMEOUT
+        with self.lock:
+            expired = [mid for mid, sent_at in self.pending.items() if sent_at < expired_before]
+            for mid in expired:
+                del self.pending[mid]
+            self.unacked += len(expired)
+            elapsed = now - self.window_started
+            acks, lags = self.ack_latencies, self.lags
+            self.last = {
+                "nids": LOAD_NIDS,
+                "target_rate": LOAD_RATE,
+                "rate": round(self.window_sent / elapsed, 1) if elapsed > 0 else None,
+                "total_rate": round(self.sent / (now - self.started), 1) if now > self.started else None,
+                "sent": self.sent,
+                "acked": self.acked,
+                "inflight": len(self.pending),
+                "unacked": self.unacked,
+                "errors": self.errors,
+                "qos": LOAD_QOS,
+                "ack_p50_ms": _ms(_percentile(acks, 0.5)),
+                "ack_p99_ms": _ms(_percentile(acks, 0.99)),
+                "ack_max_ms": _ms(max(acks, default=None)),
+                "lag_p99_ms": _ms(_percentile(lags, 0.99)),
+            }
+            self.window_sent = 0
+            self.window_started = now
+            self.ack_latencies, self.lags = [], []
+            return self.last
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+load_report = LoadReport()
+
+async def _report_loop():
+    while True:
+        await asyncio.sleep(LOAD_REPORT_INTERVAL)
+        logger.info(f" Charge : {json.dumps(load_report.snapshot())}")
+
+async def load_loop():
+    """Publie pour LOAD_NIDS nids à LOAD_RATE messages/s au total.
+
+    Chaque nid publie toutes les LOAD_NIDS / LOAD_RATE secondes, décalé des autres ; ses
+    échéances sont calculées depuis le départ (l'aléa ne s'accumule pas, pas de dérive).
+    Un échéancier unique (tas) remplace un timer par nid.
+    """
+    global mqtt_client
+    mqtt_client = connect_mqtt()
+    mqtt_client.max_inflight_messages_set(LOAD_MAX_INFLIGHT)
+    mqtt_client.on_publish = load_report.on_publish
+
+    nids = [f"{LOAD_NID_PREFIX}{i:05d}" for i in range(LOAD_NIDS)]
+    topics = [build_topic(nid) for nid in nids]
+    # Un pas du générateur par tour de publication (tous les nids d'un coup) ; l'aléa peut
+    # faire chevaucher deux tours, les précédents sont gardés un moment.
+    generator = create_generator(nids)
+    rounds = {}
+    period = LOAD_NIDS / LOAD_RATE
+    jitter = LOAD_JITTER * period
+
+    def due(i, k):
+        return start + (k + i / LOAD_NIDS) * period + random.uniform(-jitter, jitter)
+
+    start = time.monotonic() + jitter
+    load_report.started = load_report.window_started = start
+    schedule = [(due(i, 0), i, 0) for i in range(LOAD_NIDS)]
+    heapq.heapify(schedule)
+    deadline = start + LOAD_DURATION if LOAD_DURATION > 0 else None
+    logger.info(f" Mode charge : {LOAD_NIDS} nids, {LOAD_RATE} msg/s, période {period:.3f} s par nid")
+
+    reporter = asyncio.create_task(_report_loop())
+    try:
+        while True:
+            at, i, k = schedule[0]
+            if deadline is not None and at >= deadline:
+                break
+            now = time.monotonic()
+            if at - now > 0.001:
+                await asyncio.sleep(at - now)
+                continue
+            heapq.heapreplace(schedule, (due(i, k + 1), i, k + 1))
+            columns = rounds.get(k)
+            if columns is None:
+                columns = rounds[k] = generator.step()
+                rounds.pop(k - 3, None)
+            data = build_data(nids[i], columns, i)
+            if LOAD_ALERTS:
+                check_alerts(data)
+            load_report.publish(mqtt_client, topics[i], encode_payload(data), max(0.0, now - at))
+    finally:
+        reporter.cancel()
+        ended = time.monotonic()
+        # Derniers acquittements avant le bilan final.
+        await asyncio.sleep(1)
+        logger.info(f" Charge terminée : {json.dumps(load_report.snapshot(ended))}")
+        mqtt_client.loop_stop()
+        mqtt_client.disconnect()
 
 # ============================
 # ROUTES FLASK (API REST)
@@ -211,13 +471,26 @@ def send_data():
     data = generate_data(SIMULATED_NID)
     return jsonify(data)
 
+@app.route('/load', methods=['GET'])
+def load_stats():
+    """API REST : dernier bilan du mode charge"""
+    if LOAD_NIDS <= 0:
+        return jsonify({"status": "disabled"}), 404
+    return jsonify(load_report.last)
+
 @app.route('/alert', methods=['POST'])
 def alert():
     """API REST : envoie une alerte Telegram manuelle"""
     data = request.get_json()
     message = f"🚨 Alerte : {data['type']} - Valeur : {data['value']}"
-    send_telegram_alert(message)
-    return jsonify({"status": "sent"})
+    if not send_telegram_alert(message):
+        return jsonify({"status": "ignored"})
+    return jsonify({"status": "queued"})
+
+@app.route('/alerts', methods=['GET'])
+def alert_stats():
+    """API REST : compteurs de livraison des alertes Telegram"""
+    return jsonify(alert_dispatcher.stats())
 
 @app.route('/sensor-data', methods=['POST'])
 def receive_sensor_data():
@@ -0,0 +1,132 @@
+"""Serveur HTTP local imitant l'API sendMessage de Telegram, pour les essais des alertes.
+
+Accepte `POST /bot<token>/sendMessage` (JSON `chat_id`, `text`) et répond comme
+Telegram (`{"ok": true, "result": ...}`). Latence, erreurs 5xx et limitations 429
+(avec `retry_after`) sont simulables ; `GET /stats` renvoie les messages reçus par
+chat et le nombre de connexions ouvertes (une seule par client keep-alive).
+
+    python telegram_standin.py --port 18880 --latency 0.2
+    TELEGRAM_API_BASE=http://127.0.0.1:18880 python simulateur.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandinState:
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0, throttle_every: int = 0,
+                 retry_after: int = 1):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.messages: dict[str, list[str]] = {}
+        self.statuses = Counter()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "connections": self.connections,
+                "statuses": {str(status): count for status, count in self.statuses.items()},
+                "messages": {chat_id: len(texts) for chat_id, texts in self.messages.items()},
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # En-têtes et corps écrits en un seul segment (sinon Nagle + ACK retardé : ~40 ms par réponse).
+    wbufsize = 64 * 1024
+    state: StandinState
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._reply(200, self.state.stats())
+        else:
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not (self.path.startswith('/bot') and self.path.endswith('/sendMessage')):
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+        state = self.state
+        if state.latency:
+            time.sleep(state.latency)
+        try:
+            message = json.loads(body)
+            chat_id, text = str(message['chat_id']), message['text']
+        except (ValueError, KeyError, TypeError):
+            self._reply(400, {"ok": False, "error_code": 400, "description": "Bad Request: invalid message"})
+            return
+        with state.lock:
+            state.requests += 1
+            if state.throttle_every and state.requests % state.throttle_every == 0:
+                status = 429
+            elif random.random() < state.fail_rate:
+                status = 502
+            else:
+                status = 200
+                state.messages.setdefault(chat_id, []).append(text)
+            state.statuses[status] += 1
+        if status == 429:
+            self._reply(429, {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {state.retry_after}",
+                "parameters": {"retry_after": state.retry_after},
+            })
+        elif status == 502:
+            self._reply(502, {"ok": False, "error_code": 502, "description": "Bad Gateway"})
+        else:
+            self._reply(200, {"ok": True, "result": {"chat": {"id": chat_id}, "text": text}})
+
+
+def start(host: str = '127.0.0.1', port: int = 0, **options) -> tuple[ThreadingHTTPServer, StandinState]:
+    """Démarre le serveur dans un thread ; l'URL de base est http://host:server.server_port."""
+    state = StandinState(**options)
+    handler = type('Handler', (_Handler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18880)
+    parser.add_argument('--latency', type=float, default=0.0, help="délai de chaque réponse (s)")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="part des requêtes en erreur 502")
+    parser.add_argument('--throttle-every', type=int, default=0, help="une requête sur N reçoit un 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after des réponses 429 (s)")
+    args = parser.parse_args()
+    server, _ = start(args.host, args.port, latency=args.latency, fail_rate=args.fail_rate,
+                      throttle_every=args.throttle_every, retry_after=args.retry_after)
+    print(f"Telegram local sur http://{args.host}:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
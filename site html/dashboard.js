@@ -659,7 +659,7 @@ const History = {
     if (!state) return;
 
     try {
-      const url = `/collector/history?nid=${encodeURIComponent(nid)}&hours=${encodeURIComponent(hours)}&limit=${CONFIG.charts.historyMaxPoints}`;
+      const url = `/collector/history?nid=${encodeURIComponent(nid)}&hours=${encodeURIComponent(hours)}&limit=${CONFIG.charts.historyMaxPoints}&resolution=auto`;
       const res = await fetch(url, { cache: 'no-store' });
 
       if (!res.ok) throw new Error(`Erreur serveur ${res.status}`);
@@ -695,6 +695,8 @@ const Realtime = (() => {
   let sseSource            = null;
   let pollHandle           = null;
   let lastPayloadSignature = null;
+  let latestEtag           = null;
+  const nestVersions       = new Map();
 
   function _parsePayload(raw) {
     try {
@@ -713,12 +715,20 @@ const Realtime = (() => {
     }
   }
 
+  // Instantané de tous les nids, conditionnel : 304 sans corps tant que rien n'a changé,
+  // et seuls les nids dont la version a avancé sont retraités.
   async function _pollLatest() {
     try {
-      const res = await fetch('/collector/latest', { cache: 'no-store' });
-      if (!res.ok) return;
-      const payload = await res.json();
-      _onPayload(payload, payload.topic || 'collector/latest');
+      const headers = latestEtag ? { 'If-None-Match': latestEtag } : {};
+      const res = await fetch('/collector/latest?all=1', { cache: 'no-store', headers });
+      if (res.status === 304 || !res.ok) return;
+      latestEtag = res.headers.get('ETag');
+      const snapshot = await res.json();
+      for (const [nid, payload] of Object.entries(snapshot.nests || {})) {
+        if (nestVersions.get(nid) === payload.version) continue;
+        nestVersions.set(nid, payload.version);
+        _onPayload(payload, payload.topic || 'collector/latest');
+      }
     } catch (_) {}
   }
 